@@ -0,0 +1,73 @@
+"""Export CSV: fetchall en memoria vs cursor sin buffer con fetchmany.
+
+Lee las tablas del MySQL configurado en .env (solo lectura; corre después de
+db/load.py). Exporta cada tabla de exports/export.py con la implementación
+anterior y con la de streaming, compara el pico de memoria Python y verifica
+que ambos CSV son idénticos byte a byte. Con EXPORT_FACT_TRIPS=1 incluye
+fact_trips.
+
+    python benchmarks/bench_export.py
+"""
+import csv
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import mysql.connector
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from exports import export
+
+
+def legacy_export(conn, name: str, query: str) -> int:
+    # Implementación previa de export_table, conservada solo como referencia
+    cursor = conn.cursor()
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    columns = [desc[0] for desc in cursor.description]
+    with open(export.EXPORT_DIR / f"{name}.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    cursor.close()
+    return len(rows)
+
+
+def measure(fn, conn, name: str, query: str, directory: Path) -> tuple:
+    export.EXPORT_DIR = directory
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn(conn, name, query)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (directory / f"{name}.csv").read_bytes(), elapsed, peak
+
+
+def main():
+    conn = mysql.connector.connect(**export.DB_CONFIG)
+    queries = {**export.QUERIES, "fact_trips": export.FACT_QUERY} if export.EXPORT_FACT_TRIPS else export.QUERIES
+
+    print("=" * 60)
+    print("Benchmark export CSV — fetchall vs streaming")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, query in queries.items():
+            results = {}
+            for label, fn in [("fetchall", legacy_export), ("streaming", export.export_table)]:
+                directory = Path(tmp) / label
+                directory.mkdir(exist_ok=True)
+                results[label] = measure(fn, conn, name, query, directory)
+            assert results["fetchall"][0] == results["streaming"][0], name
+            print(f"   {name:<13} {len(results['streaming'][0]) / 1e6:7.1f} MB CSV | " + " | ".join(
+                f"{label} {elapsed:5.2f}s pico {peak / 1e6:7.1f} MB" for label, (_, elapsed, peak) in results.items()
+            ))
+    conn.close()
+    print("   ✅ CSV idénticos byte a byte")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Layout de fact_trips: PK VARCHAR sin particiones vs particiones mensuales con PK binaria.
+
+Necesita el contenedor MySQL del README levantado con --local-infile=1. Para cada
+tamaño (BENCH_SIZES, por defecto 1M y 10M de filas) y cada layout de db/schema.py,
+crea fact_trips en una base descartable, carga el staging sintético por lotes de 1M
+con LOAD DATA LOCAL INFILE y mide:
+  - throughput de inserción (filas/s), con los índices de cada layout ya creados;
+  - latencia mediana de consultas por rango de fecha, de timestamps, de zona y de
+    compañía, y las particiones que lee cada una según EXPLAIN.
+Verifica que ambos layouts devuelven los mismos resultados.
+
+    python benchmarks/bench_fact_layout.py
+"""
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import mysql.connector
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_staging_dtypes import synthetic_staging
+from db import load
+from db.schema import DB_CONFIG, FACT_LAYOUT_INDEXES, create_indexes, fact_ddl
+
+SIZES = [int(n) for n in os.getenv("BENCH_SIZES", "1000000,10000000").split(",")]
+BENCH_DB = os.getenv("BENCH_DB_NAME", "windycity_bench")
+CHUNK_ROWS = 1_000_000
+REPEATS = 5
+
+# {date} es la columna de fecha que poda particiones en cada layout
+QUERIES = {
+    "semana por fecha": """
+        SELECT COUNT(*), SUM(trip_total) FROM fact_trips
+        WHERE {date} BETWEEN '2026-01-05' AND '2026-01-11'
+    """,
+    "día por timestamp": """
+        SELECT COUNT(*), SUM(fare) FROM fact_trips
+        WHERE trip_start_timestamp >= '2026-01-20' AND trip_start_timestamp < '2026-01-21'
+    """,
+    "zona en un mes": """
+        SELECT COUNT(*), SUM(trip_total) FROM fact_trips
+        WHERE pickup_community_area = 8 AND {date} BETWEEN '2026-01-01' AND '2026-01-31'
+    """,
+    "compañía en una semana": """
+        SELECT COUNT(*), SUM(tips) FROM fact_trips
+        WHERE company = 'Company 07' AND {date} BETWEEN '2026-01-05' AND '2026-01-11'
+    """,
+}
+
+LAYOUTS = {
+    "plain": {"date": "trip_date", "indexes": {}},
+    "partitioned": {"date": "trip_date_key", "indexes": FACT_LAYOUT_INDEXES},
+}
+
+
+def connect():
+    config = {k: v for k, v in DB_CONFIG.items() if k != "database"}
+    config.update(user="root", password=os.getenv("DB_ROOT_PASSWORD", "windycity123"))
+    conn = mysql.connector.connect(**config, allow_local_infile=True)
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS {BENCH_DB}")
+    cursor.execute(f"USE {BENCH_DB}")
+    return conn, cursor
+
+
+def create_fact_trips(cursor, layout: str):
+    cursor.execute("DROP TABLE IF EXISTS fact_trips")
+    cursor.execute(fact_ddl(layout).strip().rstrip(";"))
+    create_indexes(cursor, "fact_trips", LAYOUTS[layout]["indexes"])
+
+
+def load_rows(conn, cursor, rows: int) -> float:
+    elapsed = 0.0
+    for offset in range(0, rows, CHUNK_ROWS):
+        # Mismo seed por lote en ambos layouts: los datos cargados son idénticos
+        df = synthetic_staging(min(CHUNK_ROWS, rows - offset), seed=offset // CHUNK_ROWS, offset=offset)
+        t0 = time.perf_counter()
+        load.insert_fact_trips_infile(cursor, df)
+        conn.commit()
+        elapsed += time.perf_counter() - t0
+    return elapsed
+
+
+def run_query(cursor, sql: str) -> tuple:
+    timings = []
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        cursor.execute(sql)
+        result = cursor.fetchall()
+        timings.append(time.perf_counter() - t0)
+    cursor.execute(f"EXPLAIN {sql}")
+    columns = [desc[0] for desc in cursor.description]
+    partitions = cursor.fetchall()[0][columns.index("partitions")]
+    return result, statistics.median(timings), partitions
+
+
+def main():
+    conn, cursor = connect()
+    try:
+        for rows in SIZES:
+            print("\n" + "=" * 60)
+            print(f"Benchmark layout fact_trips — {rows:,} filas")
+            results = {}
+            for layout, config in LAYOUTS.items():
+                create_fact_trips(cursor, layout)
+                conn.commit()
+                elapsed = load_rows(conn, cursor, rows)
+                print(f"\n   {layout:<12} inserción {elapsed:7.1f}s  {rows / elapsed:>10,.0f} filas/s")
+                for name, sql in QUERIES.items():
+                    result, latency, partitions = run_query(cursor, sql.format(date=config["date"]))
+                    results.setdefault(name, {})[layout] = result
+                    read = len(partitions.split(",")) if partitions else "-"
+                    print(f"      {name:<24} {latency * 1000:8.1f} ms | particiones leídas {read}")
+            for name, by_layout in results.items():
+                assert by_layout["plain"] == by_layout["partitioned"], name
+            print("\n   ✅ mismos resultados en ambos layouts")
+            print("=" * 60)
+    finally:
+        cursor.execute(f"DROP DATABASE IF EXISTS {BENCH_DB}")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
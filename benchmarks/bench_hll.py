@@ -0,0 +1,77 @@
+"""Sketches HLL de active_taxis: error contra nunique exacto y unión entre lotes.
+
+Sobre el staging sintético verifica que:
+  - unir los sketches de dos lotes disjuntos da exactamente el sketch del total
+    (lo que usa la carga incremental);
+  - active_taxis diario derivado solo de los sketches por hora, y los estimados
+    por hora y por par de zonas, quedan dentro del error documentado en db/hll.py
+    (1.04 / sqrt(M) de desvío típico; se exige error medio ≤ 1σ y máximo ≤ 4σ + 2 taxis).
+
+    python benchmarks/bench_hll.py
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_staging_dtypes import synthetic_staging
+from db import hll
+from db.kpis import SKETCH_TABLES, ZONE_KEYS, compute_kpis, merge_sketches
+
+ROWS = int(os.getenv("BENCH_ROWS", 1_000_000))
+
+CHECKS = {
+    # KPI exacto: (tabla de sketches, claves del grano)
+    "daily_kpis": ("hourly_taxi_sketches", ["trip_date"]),
+    "hourly_kpis": ("hourly_taxi_sketches", ["trip_date", "trip_hour"]),
+    "zone_kpis": ("zone_taxi_sketches", ZONE_KEYS),
+}
+
+
+def compare(exact: pd.DataFrame, estimated: pd.DataFrame, keys: list) -> tuple:
+    rows = exact[keys + ["active_taxis"]].merge(estimated, on=keys, how="left", suffixes=("", "_hll"))
+    rows = rows[rows["active_taxis"] > 0]
+    return rows["active_taxis_hll"].fillna(0) - rows["active_taxis"], rows["active_taxis"]
+
+
+def main():
+    df = synthetic_staging(ROWS)
+
+    t0 = time.perf_counter()
+    kpis = compute_kpis(df, list(CHECKS) + SKETCH_TABLES)
+    elapsed = time.perf_counter() - t0
+
+    print("=" * 60)
+    print(f"Benchmark sketches HLL — {ROWS:,} filas (P={hll.P}, σ={hll.RELATIVE_ERROR:.2%})")
+    print(f"   KPIs + sketches en {elapsed:.2f}s")
+
+    # Unión de lotes: dos mitades al azar deben reconstruir el sketch completo, registro a registro
+    batch = np.random.default_rng(7).random(len(df)) < 0.5
+    halves = [compute_kpis(part, SKETCH_TABLES) for part in (df[batch], df[~batch])]
+    for table, (_, keys) in zip(SKETCH_TABLES, [CHECKS["hourly_kpis"], CHECKS["zone_kpis"]]):
+        merged = merge_sketches(pd.concat([half[table] for half in halves], ignore_index=True), keys)
+        full = merge_sketches(kpis[table], keys)
+        assert merged[keys].equals(full[keys]) and (merged["taxi_sketch"] == full["taxi_sketch"]).all(), table
+        size = kpis[table]["taxi_sketch"].map(len)
+        print(f"   {table:<21} {len(size):>6,} sketches | {size.mean():6.0f} bytes promedio (sin comprimir {hll.M})")
+    print("   ✅ la unión de lotes reproduce exactamente los sketches del total")
+
+    for name, (table, keys) in CHECKS.items():
+        error, exact = compare(kpis[name], merge_sketches(kpis[table], keys), keys)
+        relative = (error / exact).abs()
+        print(f"   {name:<12} error relativo medio {relative.mean():6.2%} | máximo {relative.max():6.2%} "
+              f"| máximo absoluto {error.abs().max():.0f} taxis")
+        assert relative.mean() <= hll.RELATIVE_ERROR, name
+        assert (error.abs() <= 4 * hll.RELATIVE_ERROR * exact + 2).all(), name
+    print("   ✅ estimaciones dentro del error documentado")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark de ingesta secuencial, concurrente y keyset contra un servidor HTTP local.
+
+El servidor imita la API Socrata ($limit/$offset/$select=count(*) y el filtro
+keyset sobre (trip_start_timestamp, trip_id)) y sirve páginas sintéticas con una
+latencia fija por request más un costo proporcional a las filas que salta $offset.
+
+    python benchmarks/bench_ingest.py
+"""
+import hashlib
+import json
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "ingestion"))
+
+import ingest  # noqa: E402
+
+TOTAL_ROWS = 100_000
+PAGE_SIZE = 5_000
+LATENCY_SECONDS = 0.4
+OFFSET_COST_PER_ROW = 5e-6
+BASE_TS = datetime(2025, 12, 3)
+WORKER_COUNTS = [1, 4, 8]
+
+
+def synthetic_row(i: int) -> dict:
+    ts = BASE_TS + timedelta(seconds=i * 5)
+    return {
+        "trip_id": hashlib.sha1(str(i).encode()).hexdigest(),
+        "taxi_id": hashlib.sha1(str(i % 3000).encode()).hexdigest(),
+        "trip_start_timestamp": ts.strftime("%Y-%m-%dT%H:%M:%S.000"),
+        "trip_end_timestamp": (ts + timedelta(minutes=12)).strftime("%Y-%m-%dT%H:%M:%S.000"),
+        "trip_seconds": "720",
+        "trip_miles": "3.1",
+        "fare": "12.25",
+        "tips": "2.0",
+        "tolls": "0.0",
+        "extras": "1.0",
+        "trip_total": "15.75",
+        "payment_type": "Credit Card",
+        "company": "Flash Cab",
+    }
+
+
+class SocrataStub(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        time.sleep(LATENCY_SECONDS)
+        if "count" in params.get("$select", ""):
+            body = [{"count": str(TOTAL_ROWS)}]
+        else:
+            limit = int(params["$limit"])
+            cursor = re.search(r"trip_start_timestamp > '([^']+)'", params["$where"])
+            if cursor:
+                # Los timestamps sintéticos son únicos: el cursor identifica la fila exacta
+                last = datetime.strptime(cursor.group(1), "%Y-%m-%dT%H:%M:%S.%f")
+                offset = int((last - BASE_TS).total_seconds() // 5) + 1
+            else:
+                offset = int(params.get("$offset", 0))
+                time.sleep(offset * OFFSET_COST_PER_ROW)
+            body = [synthetic_row(i) for i in range(offset, min(offset + limit, TOTAL_ROWS))]
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def timed(fn, latencies: list):
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        result = fn(*args, **kwargs)
+        if result:
+            latencies.append(time.perf_counter() - t0)
+        return result
+    return wrapper
+
+
+def run(workers: int, pagination: str = "offset") -> tuple:
+    latencies = []
+    fetch_page, fetch_page_after = ingest.fetch_page, ingest.fetch_page_after
+    ingest.fetch_page = timed(fetch_page, latencies)
+    ingest.fetch_page_after = timed(fetch_page_after, latencies)
+    ingest.PAGINATION = pagination
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        manifest = ingest.load_manifest(output_dir)
+        session = ingest.build_session(workers)
+        start = datetime.now()
+        t0 = time.perf_counter()
+        if pagination == "keyset":
+            ingest.ingest_keyset(session, manifest, start, output_dir)
+        elif workers > 1:
+            ingest.ingest_concurrent(session, manifest, start, workers, output_dir)
+        else:
+            ingest.ingest_sequential(session, manifest, start, output_dir)
+        elapsed = time.perf_counter() - t0
+        session.close()
+        rows = sum(p["records"] for p in manifest["pages"].values())
+        assert rows == TOTAL_ROWS, f"{rows} != {TOTAL_ROWS}"
+    ingest.fetch_page, ingest.fetch_page_after = fetch_page, fetch_page_after
+    return elapsed, latencies
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SocrataStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ingest.API_BASE_URL = f"http://127.0.0.1:{server.server_port}/resource/stub.json"
+    ingest.PAGE_SIZE = PAGE_SIZE
+
+    results = {f"offset workers={w}": run(w) for w in WORKER_COUNTS}
+    results["keyset"] = run(1, "keyset")
+    server.shutdown()
+
+    print("\n" + "=" * 60)
+    print(f"Benchmark ingesta — {TOTAL_ROWS:,} filas, páginas de {PAGE_SIZE:,}, latencia {LATENCY_SECONDS}s")
+    baseline = results[f"offset workers={WORKER_COUNTS[0]}"][0]
+    for label, (elapsed, latencies) in results.items():
+        print(
+            f"   {label:<18} {elapsed:6.2f}s  x{baseline / elapsed:.1f}"
+            f"  | latencia 1ra página {latencies[0]:.2f}s, última {latencies[-1]:.2f}s"
+        )
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
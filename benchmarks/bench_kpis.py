@@ -0,0 +1,145 @@
+"""Motor de KPIs: cinco groupby sobre copias filtradas vs un único cubo con roll-ups.
+
+Calcula las cinco tablas agregadas con la implementación anterior de db/load.py y
+con db/kpis.compute_kpis sobre el mismo staging sintético. Compara tiempo y pico
+de memoria, y verifica que ambas producen exactamente las mismas filas una vez
+llevadas a los tipos de MySQL (DECIMAL(12,2) para montos, FLOAT para millas y
+coordenadas).
+
+    python benchmarks/bench_kpis.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_staging_dtypes import synthetic_staging
+from db.kpis import compute_kpis
+
+ROWS = int(os.getenv("BENCH_ROWS", 1_000_000))
+
+MONEY_COLUMNS = ["total_revenue", "total_fare", "total_tips", "total_tolls", "total_extras"]
+FLOAT_COLUMNS = ["total_trip_miles", "avg_latitude", "avg_longitude"]
+
+
+def legacy_kpis(df: pd.DataFrame) -> dict:
+    # Implementación previa de db/load.py, conservada solo como referencia
+    clean = df[df["is_outlier"] == 0]
+    daily = clean.groupby("trip_date").agg(
+        total_trips=("trip_id", "count"),
+        active_taxis=("taxi_id", "nunique"),
+        total_revenue=("trip_total", "sum"),
+        total_fare=("fare", "sum"),
+        total_tips=("tips", "sum"),
+        total_tolls=("tolls", "sum"),
+        total_extras=("extras", "sum"),
+        total_trip_miles=("trip_miles", "sum"),
+        total_trip_seconds=("trip_seconds", "sum"),
+    ).reset_index()
+    outliers = df.groupby("trip_date")["is_outlier"].sum().reset_index()
+    outliers.columns = ["trip_date", "outlier_count"]
+    daily = daily.merge(outliers, on="trip_date", how="left")
+
+    hourly = df[df["is_outlier"] == 0].groupby(["trip_date", "trip_hour"]).agg(
+        trip_weekday=("trip_weekday", "first"),
+        total_trips=("trip_id", "count"),
+        active_taxis=("taxi_id", "nunique"),
+        total_revenue=("trip_total", "sum"),
+        total_fare=("fare", "sum"),
+        total_tips=("tips", "sum"),
+        total_tolls=("tolls", "sum"),
+        total_extras=("extras", "sum"),
+        total_trip_seconds=("trip_seconds", "sum"),
+        total_trip_miles=("trip_miles", "sum"),
+    ).reset_index()
+
+    zone = df[df["is_outlier"] == 0].copy()
+    zone["pickup_community_area"] = zone["pickup_community_area"].fillna(-1).astype(int)
+    zone["dropoff_community_area"] = zone["dropoff_community_area"].fillna(-1).astype(int)
+    zone = zone.groupby(["pickup_community_area", "dropoff_community_area"]).agg(
+        total_trips=("trip_id", "count"),
+        active_taxis=("taxi_id", "nunique"),
+        total_revenue=("trip_total", "sum"),
+        total_fare=("fare", "sum"),
+        total_trip_miles=("trip_miles", "sum"),
+    ).reset_index()
+
+    pickup = df[df["pickup_community_area"].notna()][
+        ["pickup_community_area", "pickup_centroid_latitude", "pickup_centroid_longitude"]
+    ].copy()
+    pickup.columns = ["community_area", "lat", "lon"]
+    dropoff = df[df["dropoff_community_area"].notna()][
+        ["dropoff_community_area", "dropoff_centroid_latitude", "dropoff_centroid_longitude"]
+    ].copy()
+    dropoff.columns = ["community_area", "lat", "lon"]
+    combined = pd.concat([pickup, dropoff], ignore_index=True).astype({"lat": "float64", "lon": "float64"})
+    coords = combined.dropna(subset=["lat", "lon"]).groupby("community_area").agg(
+        avg_latitude=("lat", "mean"),
+        avg_longitude=("lon", "mean"),
+    ).reset_index()
+
+    payment = df[df["is_outlier"] == 0].groupby(["trip_date", "payment_type", "company"], observed=True).agg(
+        total_trips=("trip_id", "count"),
+        total_revenue=("trip_total", "sum"),
+        total_tips=("tips", "sum"),
+        total_fare=("fare", "sum"),
+    ).reset_index()
+    payment["company"] = payment["company"].astype(object).fillna("")
+
+    return {
+        "daily_kpis": daily, "hourly_kpis": hourly, "zone_kpis": zone,
+        "zone_coords": coords, "payment_kpis": payment,
+    }
+
+
+def as_mysql(agg: pd.DataFrame) -> pd.DataFrame:
+    # Los valores tal como quedan guardados en MySQL
+    agg = agg.copy()
+    for col in agg.columns:
+        if col in MONEY_COLUMNS:
+            agg[col] = agg[col].round(2)
+        elif col in FLOAT_COLUMNS:
+            agg[col] = agg[col].astype(np.float32)
+        elif isinstance(agg[col].dtype, pd.CategoricalDtype):
+            agg[col] = agg[col].astype(object)
+        elif pd.api.types.is_integer_dtype(agg[col].dtype):
+            agg[col] = agg[col].astype("int64")
+    return agg.sort_values(list(agg.columns[:3])).reset_index(drop=True)
+
+
+def measure(fn, df: pd.DataFrame) -> tuple:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn(df)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    df = synthetic_staging(ROWS)
+
+    legacy, legacy_s, legacy_peak = measure(legacy_kpis, df)
+    cube, cube_s, cube_peak = measure(compute_kpis, df)
+
+    for name, expected in legacy.items():
+        pd.testing.assert_frame_equal(as_mysql(expected), as_mysql(cube[name]), check_exact=True)
+
+    print("=" * 60)
+    print(f"Benchmark KPIs — {ROWS:,} filas")
+    print(f"   cinco groupby   {legacy_s:6.2f}s | pico memoria {legacy_peak / 1e6:7.1f} MB")
+    print(f"   cubo único      {cube_s:6.2f}s | pico memoria {cube_peak / 1e6:7.1f} MB  x{legacy_s / cube_s:.1f}")
+    print("   ✅ las cinco tablas son idénticas con los tipos de MySQL")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
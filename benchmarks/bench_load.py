@@ -0,0 +1,79 @@
+"""Carga de fact_trips: executemany de INSERT IGNORE vs LOAD DATA LOCAL INFILE.
+
+Necesita el contenedor MySQL del README levantado con --local-infile=1. Trabaja
+sobre una base descartable (BENCH_DB_NAME, por defecto windycity_bench) con el
+usuario root, carga el mismo frame sintético con cada método y compara
+CHECKSUM TABLE para verificar que ambos dejan exactamente las mismas filas.
+
+    python benchmarks/bench_load.py
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+import mysql.connector
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_staging_dtypes import synthetic_staging
+from db import load
+from db.schema import DB_CONFIG, TABLES
+
+ROWS = int(os.getenv("BENCH_ROWS", 1_000_000))
+BENCH_DB = os.getenv("BENCH_DB_NAME", "windycity_bench")
+
+METHODS = {
+    "insert": load.insert_fact_trips,
+    "infile": load.insert_fact_trips_infile,
+}
+
+
+def connect():
+    config = {k: v for k, v in DB_CONFIG.items() if k != "database"}
+    config.update(user="root", password=os.getenv("DB_ROOT_PASSWORD", "windycity123"))
+    conn = mysql.connector.connect(**config, allow_local_infile=True)
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS {BENCH_DB}")
+    cursor.execute(f"USE {BENCH_DB}")
+    return conn, cursor
+
+
+def reset_fact_trips(cursor):
+    cursor.execute("DROP TABLE IF EXISTS fact_trips")
+    for stmt in [s.strip() for s in TABLES["fact_trips"].strip().split(";") if s.strip()]:
+        cursor.execute(stmt)
+
+
+def main():
+    df = synthetic_staging(ROWS)
+    conn, cursor = connect()
+
+    results, checksums = {}, {}
+    try:
+        for name, insert in METHODS.items():
+            reset_fact_trips(cursor)
+            conn.commit()
+            t0 = time.perf_counter()
+            insert(cursor, df)
+            conn.commit()
+            results[name] = time.perf_counter() - t0
+            cursor.execute("CHECKSUM TABLE fact_trips")
+            checksums[name] = cursor.fetchone()[1]
+    finally:
+        cursor.execute(f"DROP DATABASE IF EXISTS {BENCH_DB}")
+        cursor.close()
+        conn.close()
+
+    print("\n" + "=" * 60)
+    print(f"Benchmark carga fact_trips — {ROWS:,} filas")
+    for name, elapsed in results.items():
+        print(f"   {name:<7} {elapsed:7.1f}s  {ROWS / elapsed:>10,.0f} filas/s  x{results['insert'] / elapsed:.1f}")
+    assert len(set(checksums.values())) == 1, checksums
+    print("   ✅ CHECKSUM TABLE idéntico en ambos métodos")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Quality checks: staging completo en memoria + un escaneo por check vs una pasada por lotes.
+
+Escribe un dataset de staging sintético (BENCH_ROWS filas, por defecto 2M) en un
+directorio temporal y corre los checks de quality/checks.py con la implementación
+anterior (read_staging y cada check recorriendo el frame) y con el motor de una
+pasada. Compara tiempo y pico de memoria Python, y verifica que ambos reportes
+son idénticos. También verifica que agregar un viaje en un día nuevo (con taxi,
+compañía y tipo de pago nuevos) no cambia la huella de las demás particiones,
+que es lo que permite a QUALITY_MODE=incremental saltearlas.
+
+    python benchmarks/bench_quality.py
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_staging_dtypes import synthetic_raw
+from ingestion import staging, staging_reader
+from quality import checks, totals
+
+ROWS = int(os.getenv("BENCH_ROWS", 2_000_000))
+CHUNK_ROWS = 500_000
+
+
+def legacy_counts(df) -> dict:
+    # Implementación previa: el frame entero en memoria y un recorrido por predicado
+    return {
+        "rows": len(df),
+        "counts": {name: int(mask(df).sum()) for name, (_, mask, _) in checks.PREDICATES.items()},
+        "start_min": df["trip_start_timestamp"].min(),
+        "start_max": df["trip_start_timestamp"].max(),
+        "unique": int(df["trip_id"].nunique()),
+        "total_diffs": histogram(totals.diff_histogram(df)),
+    }
+
+
+def histogram(hist) -> dict:
+    return {tuple(row[:-1]): row[-1] for row in hist.itertuples(index=False)}
+
+
+def engine_counts() -> dict:
+    acc = checks.scan_staging()
+    return {**{k: v for k, v in acc.items() if k not in ("trip_id_hashes", "unique_trip_ids", "total_diffs")},
+            "unique": acc["unique_trip_ids"], "total_diffs": histogram(totals.combine_histograms(acc["total_diffs"]))}
+
+
+def partition_fingerprints(raw, output_dir: Path) -> dict:
+    # Igual que stage_full: to_arrow sobre el frame completo y después compactar
+    df = staging.deduplicate(staging.add_derived_fields(staging.cast_types(raw)))
+    staging.write_fragments(staging.to_arrow(df), output_dir, "part")
+    staging.compact_partitions(output_dir)
+    return {p.name: checks.partition_fingerprint(p) for p in sorted(output_dir.glob("trip_date=*"))}
+
+
+def check_stable_fingerprints(tmp: Path):
+    raw = synthetic_raw(50_000)
+    extra = synthetic_raw(1, seed=1, offset=len(raw))
+    extra[["taxi_id", "company", "payment_type"]] = ["new-taxi", "New Co", "Crypto"]
+    extra[["trip_start_timestamp", "trip_end_timestamp"]] = ["2026-03-01T10:00:00.000", "2026-03-01T10:20:00.000"]
+
+    before = partition_fingerprints(raw, tmp / "before")
+    after = partition_fingerprints(pd.concat([raw, extra], ignore_index=True), tmp / "after")
+    assert set(after) - set(before) == {"trip_date=2026-03-01"}
+    changed = [name for name, fingerprint in before.items() if after[name] != fingerprint]
+    assert not changed, f"{len(changed)} particiones cambiaron de huella"
+
+
+def measure(fn) -> tuple:
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    # Segunda corrida solo para el pico: tracemalloc distorsiona los tiempos
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        staging_reader.STAGING_DATASET = Path(tmp)
+        for offset in range(0, ROWS, CHUNK_ROWS):
+            raw = synthetic_raw(min(CHUNK_ROWS, ROWS - offset), seed=offset // CHUNK_ROWS, offset=offset)
+            table = staging.to_arrow(staging.add_derived_fields(staging.cast_types(raw)))
+            staging.write_fragments(table, Path(tmp), f"chunk{offset}")
+        # Un archivo ordenado por día, con los row groups de staging.py
+        staging.compact_partitions(Path(tmp))
+
+        results = {
+            "legacy": measure(lambda: legacy_counts(staging_reader.read_staging())),
+            "una pasada": measure(engine_counts),
+        }
+
+    assert results["legacy"][0] == results["una pasada"][0]
+    with tempfile.TemporaryDirectory() as tmp:
+        check_stable_fingerprints(Path(tmp))
+    print("=" * 60)
+    print(f"Benchmark quality checks — {ROWS:,} filas")
+    for label, (_, elapsed, peak) in results.items():
+        print(f"   {label:<11} {elapsed:6.2f}s  pico {peak / 1e6:8.1f} MB")
+    print("   ✅ mismos conteos en ambas implementaciones")
+    print("   ✅ un día nuevo no cambia la huella de las demás particiones")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Tamaño en disco y pico de memoria al guardar una página raw en cada formato.
+
+Simula el body HTTP de una página de 50k filas y lo escribe con el camino legacy
+(json.loads del body completo + json.dump) y con el parser incremental.
+
+    python benchmarks/bench_raw_format.py
+"""
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_ingest import synthetic_row
+from ingestion.raw_format import EXTENSIONS, iter_json_array, read_raw_page, write_records
+
+PAGE_ROWS = 50_000
+CHUNK_BYTES = 1 << 16
+
+
+def body_chunks(body: bytes):
+    for i in range(0, len(body), CHUNK_BYTES):
+        yield body[i:i + CHUNK_BYTES]
+
+
+def measure(fmt: str, body: bytes, tmp: Path) -> tuple:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    if fmt == "json":
+        # Camino legacy: body completo → lista de dicts → json.dump
+        records = json.loads(b"".join(body_chunks(body)))
+    else:
+        records = iter_json_array(body_chunks(body))
+    filepath, count, _ = write_records(records, tmp / f"page_{fmt}", fmt)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert count == PAGE_ROWS and read_raw_page(filepath).num_rows == PAGE_ROWS
+    return filepath.stat().st_size, peak, elapsed
+
+
+def main():
+    body = json.dumps([synthetic_row(i) for i in range(PAGE_ROWS)]).encode()
+    print("=" * 60)
+    print(f"Benchmark formato raw — página de {PAGE_ROWS:,} filas ({len(body) / 1e6:.1f} MB de body)")
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in EXTENSIONS:
+            size, peak, elapsed = measure(fmt, body, Path(tmp))
+            print(f"   {fmt:<11} disco {size / 1e6:6.2f} MB | pico memoria {peak / 1e6:7.1f} MB | {elapsed:.2f}s")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
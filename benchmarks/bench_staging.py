@@ -0,0 +1,51 @@
+"""Tiempo de parseo + casteo de páginas raw según cantidad de procesos worker.
+
+Genera páginas sintéticas en un directorio temporal y mide load_raw_pages con
+1, 2, 4, ... workers hasta os.cpu_count().
+
+    python benchmarks/bench_staging.py
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_ingest import synthetic_row
+from ingestion import staging
+from ingestion.raw_format import write_records
+
+PAGES = 16
+PAGE_ROWS = 25_000
+FORMAT = os.getenv("RAW_FORMAT", "json")
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted({1, *[2 ** i for i in range(1, 5) if 2 ** i <= cpus], cpus})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        staging.RAW_DIR = Path(tmp)
+        for page in range(PAGES):
+            rows = (synthetic_row(page * PAGE_ROWS + i) for i in range(PAGE_ROWS))
+            write_records(rows, staging.RAW_DIR / f"page_{page + 1:04d}", FORMAT)
+
+        results = {}
+        for workers in worker_counts:
+            t0 = time.perf_counter()
+            df = staging.load_raw_pages(workers)
+            results[workers] = time.perf_counter() - t0
+            assert len(df) == PAGES * PAGE_ROWS
+
+    print("=" * 60)
+    print(f"Benchmark staging — {PAGES} páginas {FORMAT} de {PAGE_ROWS:,} filas, {cpus} CPUs")
+    for workers, elapsed in results.items():
+        print(f"   workers={workers:<3} {elapsed:6.2f}s  x{results[1] / elapsed:.1f}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Memoria, tamaño en disco y tiempo de groupby: schema de staging estándar vs compacto.
+
+Genera 1M de viajes sintéticos con la forma de la API (strings, nulos, categorías
+reales de cardinalidad baja), los pasa por cast_types + add_derived_fields y compara
+el schema anterior (object/int64/float64) con STAGING_SCHEMA (categóricas, enteros
+angostos, centavos int64, coordenadas float32).
+
+    python benchmarks/bench_staging_dtypes.py
+"""
+import hashlib
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ingestion import staging
+from ingestion.staging_reader import to_frame
+
+ROWS = 1_000_000
+
+# Dtypes que tenía staging antes del schema compacto
+STANDARD_DTYPES = {
+    "taxi_id": object, "payment_type": object, "company": object,
+    "trip_seconds": "Int64", "pickup_community_area": "Int64", "dropoff_community_area": "Int64",
+    **{col: "float64" for col in staging.COORD_FIELDS},
+    "trip_hour": "int64", "trip_weekday": "int64", "is_outlier": "int64",
+}
+
+
+def synthetic_raw(rows: int, seed: int = 42, offset: int = 0) -> pd.DataFrame:
+    """Páginas raw sintéticas como las entrega la API: todo string, con nulos.
+
+    `offset` desplaza la numeración de trip_id para generar lotes sin ids repetidos.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2025-12-03") + pd.to_timedelta(rng.integers(0, 60 * 86_400, rows), unit="s")
+    seconds = rng.integers(60, 3_600, rows)
+    seconds[rng.random(rows) < 0.001] = 12_000
+    miles = rng.exponential(3.0, rows).round(1)
+    fare = rng.uniform(3.25, 80.0, rows).round(2)
+    fare[rng.random(rows) < 0.001] = -5.0
+    tips = (fare * rng.choice([0, 0.15, 0.2], rows)).round(2)
+    tolls = np.where(rng.random(rows) < 0.02, 2.5, 0.0)
+    extras = rng.choice([0.0, 1.0, 4.0], rows)
+    total = (fare + tips + tolls + extras + rng.choice([0.0, 0.5], rows)).round(2)
+
+    areas = np.arange(1, 78)
+    lat = dict(zip(areas, rng.uniform(41.65, 42.02, 77)))
+    lon = dict(zip(areas, rng.uniform(-87.9, -87.52, 77)))
+    pickup = pd.Series(rng.choice(areas, rows)).where(rng.random(rows) > 0.1)
+    dropoff = pd.Series(rng.choice(areas, rows)).where(rng.random(rows) > 0.1)
+
+    taxis = [hashlib.sha1(str(i).encode()).hexdigest() for i in range(3_000)]
+    companies = [f"Company {i:02d}" for i in range(40)]
+    payments = ["Credit Card", "Cash", "Mobile", "Prcard", "Unknown", "No Charge"]
+
+    def text(values, fmt: str) -> pd.Series:
+        values = pd.Series(values)
+        return values.map(fmt.format).where(values.notna())
+
+    return pd.DataFrame({
+        "trip_id": [hashlib.sha1(str(i).encode()).hexdigest() for i in range(offset, offset + rows)],
+        "taxi_id": np.array(taxis, dtype=object)[rng.integers(0, len(taxis), rows)],
+        "trip_start_timestamp": start.strftime("%Y-%m-%dT%H:%M:%S.000"),
+        "trip_end_timestamp": (start + pd.to_timedelta(seconds, unit="s")).strftime("%Y-%m-%dT%H:%M:%S.000"),
+        "trip_seconds": text(seconds, "{}"),
+        "trip_miles": text(miles, "{}"),
+        "pickup_census_tract": None,
+        "dropoff_census_tract": None,
+        "pickup_community_area": text(pickup, "{:.0f}"),
+        "dropoff_community_area": text(dropoff, "{:.0f}"),
+        "fare": text(fare, "{}"),
+        "tips": text(tips, "{}"),
+        "tolls": text(tolls, "{}"),
+        "extras": text(extras, "{}"),
+        "trip_total": text(total, "{}"),
+        "payment_type": np.array(payments, dtype=object)[rng.integers(0, len(payments), rows)],
+        "company": pd.Series(np.array(companies, dtype=object)[rng.integers(0, len(companies), rows)])
+        .where(rng.random(rows) > 0.02),
+        "pickup_centroid_latitude": text(pickup.map(lat), "{:.9f}"),
+        "pickup_centroid_longitude": text(pickup.map(lon), "{:.9f}"),
+        "dropoff_centroid_latitude": text(dropoff.map(lat), "{:.9f}"),
+        "dropoff_centroid_longitude": text(dropoff.map(lon), "{:.9f}"),
+    })
+
+
+def synthetic_staging(rows: int, seed: int = 42, offset: int = 0) -> pd.DataFrame:
+    """Frame de staging tal como lo devuelve read_staging (montos en dólares)."""
+    df = staging.add_derived_fields(staging.cast_types(synthetic_raw(rows, seed, offset)))
+    return to_frame(staging.to_arrow(df))
+
+
+def payment_groupby(df: pd.DataFrame) -> float:
+    t0 = time.perf_counter()
+    df[df["is_outlier"] == 0].groupby(["trip_date", "payment_type", "company"], observed=True).agg(
+        total_trips=("trip_id", "count"),
+        active_taxis=("taxi_id", "nunique"),
+        total_revenue=("trip_total", "sum"),
+    )
+    return time.perf_counter() - t0
+
+
+def main():
+    df = staging.add_derived_fields(staging.cast_types(synthetic_raw(ROWS)))
+    tables = {
+        "estándar": pa.Table.from_pandas(df.astype(STANDARD_DTYPES), preserve_index=False),
+        "compacto": staging.to_arrow(df),
+    }
+
+    print("=" * 60)
+    print(f"Benchmark dtypes de staging — {ROWS:,} filas")
+    with tempfile.TemporaryDirectory() as tmp:
+        frames = {}
+        for name, table in tables.items():
+            path = Path(tmp) / f"{name}.parquet"
+            pq.write_table(table, path)
+            frames[name] = to_frame(pq.read_table(path))
+            memory = frames[name].memory_usage(deep=True).sum()
+            print(f"   {name:<9} disco {path.stat().st_size / 1e6:6.1f} MB | "
+                  f"pandas {memory / 1e6:7.1f} MB | groupby {payment_groupby(frames[name]):.2f}s")
+
+    standard, compact = frames["estándar"], frames["compacto"]
+    for col in staging.DECIMAL_FIELDS:
+        pd.testing.assert_series_equal(standard[col], compact[col], check_exact=True)
+    print("   ✅ montos idénticos tras el round-trip en centavos")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import math
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# HyperLogLog con 2^P registros de 1 byte. Error relativo típico 1.04 / sqrt(M) ≈ 1.6%;
+# benchmarks/bench_hll.py lo mide contra los conteos exactos.
+P = 12
+M = 1 << P
+RELATIVE_ERROR = 1.04 / math.sqrt(M)
+ALPHA = 0.7213 / (1 + 1.079 / M)
+
+
+def hash_values(values) -> np.ndarray:
+    # Hash de 64 bits estable entre corridas y procesos (SipHash con clave fija de pandas)
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def registers(groups: np.ndarray, hashes: np.ndarray, n_groups: int) -> np.ndarray:
+    """Un sketch (fila de M registros) por grupo a partir de pares (grupo, hash)."""
+    index = (hashes >> np.uint64(64 - P)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - P)) - 1)
+    # rank = posición del primer bit en 1 de los 64-P bits restantes; rest < 2^52 entra exacto
+    # en un float64, así que frexp da el exponente sin redondeos (rest = 0 → rank máximo)
+    _, exponent = np.frexp(rest.astype(np.float64))
+    rank = (64 - P + 1 - exponent).astype(np.uint8)
+    sketches = np.zeros((n_groups, M), dtype=np.uint8)
+    np.maximum.at(sketches, (groups, index), rank)
+    return sketches
+
+
+def merge(sketches: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """Une sketches por grupo: el máximo registro a registro equivale a la unión de los conjuntos."""
+    merged = np.zeros((n_groups, M), dtype=np.uint8)
+    np.maximum.at(merged, groups, sketches)
+    return merged
+
+
+def estimate(sketches: np.ndarray) -> np.ndarray:
+    sketches = np.atleast_2d(sketches)
+    raw = ALPHA * M * M / np.exp2(-sketches.astype(np.float64)).sum(axis=1)
+    zeros = (sketches == 0).sum(axis=1)
+    # Rango chico: linear counting sobre los registros vacíos (más preciso con pocos taxis)
+    small = (raw <= 2.5 * M) & (zeros > 0)
+    linear = M * np.log(M / np.maximum(zeros, 1))
+    return np.round(np.where(small, linear, raw)).astype(np.int64)
+
+
+def to_blob(sketch: np.ndarray) -> bytes:
+    # Los sketches de grupos chicos son casi todo ceros: comprimidos ocupan unos cientos de bytes
+    return zlib.compress(sketch.tobytes())
+
+
+def from_blob(blob: bytes) -> np.ndarray:
+    sketch = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+    if len(sketch) != M:
+        raise ValueError(f"Sketch de {len(sketch)} registros, se esperaban {M} (P={P})")
+    return sketch
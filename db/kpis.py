@@ -0,0 +1,262 @@
+import numpy as np
+import pandas as pd
+
+from db import hll
+from quality import totals
+
+# Grano más fino de todas las tablas agregadas: cada KPI es un roll-up de este cubo
+CUBE_KEYS = [
+    "trip_date", "trip_hour", "pickup_community_area", "dropoff_community_area",
+    "payment_type", "company", "is_outlier",
+]
+MONEY_FIELDS = ["trip_total", "fare", "tips", "tolls", "extras"]
+COORD_SIDES = {
+    "pickup": ("pickup_community_area", "pickup_centroid_latitude", "pickup_centroid_longitude"),
+    "dropoff": ("dropoff_community_area", "dropoff_centroid_latitude", "dropoff_centroid_longitude"),
+}
+ZONE_KEYS = ["pickup_community_area", "dropoff_community_area"]
+# NULL en área = -1 (viajes fuera de Chicago, según documentación oficial)
+UNKNOWN_AREA = -1
+
+KPI_TABLES = [
+    "daily_kpis", "hourly_kpis", "zone_kpis", "zone_coord_sums", "zone_coords", "payment_kpis", "total_diff_kpis",
+]
+# Sketches HLL de taxis activos (opcionales): se guardan al lado de hourly_kpis y zone_kpis
+SKETCH_TABLES = ["hourly_taxi_sketches", "zone_taxi_sketches"]
+
+
+def encode(df: pd.DataFrame) -> tuple:
+    # Cada clave se factoriza una sola vez; de acá en adelante todo opera sobre códigos enteros.
+    # Los nulos reciben su propio código (igual que dropna=False).
+    codes, labels = {}, {}
+    for key in CUBE_KEYS + ["taxi_id"]:
+        codes[key], labels[key] = pd.factorize(df[key], use_na_sentinel=False)
+    return codes, labels
+
+
+def combine(codes: dict, labels: dict, keys: list) -> np.ndarray:
+    # Código mixto único por combinación de claves (radix = cantidad de valores de cada clave)
+    combined = np.zeros(len(codes[keys[0]]), dtype=np.int64)
+    for key in keys:
+        combined = combined * len(labels[key]) + np.asarray(codes[key])
+    return combined
+
+
+def split(combined: np.ndarray, labels: dict, keys: list) -> dict:
+    codes = {}
+    for key in reversed(keys):
+        combined, codes[key] = np.divmod(combined, len(labels[key]))
+    return {key: codes[key] for key in keys}
+
+
+def measures(df: pd.DataFrame):
+    # Generador: una columna de medida por vez, así nunca hay más de una copia float64 viva
+    yield "rows", np.ones(len(df))
+    yield "trips", df["trip_id"].notna().to_numpy()
+    # Montos sumados en centavos: suma entera exacta, sin depender del orden del roll-up
+    for col in MONEY_FIELDS:
+        yield f"{col}_cents", (df[col] * 100).round().to_numpy()
+    yield "trip_miles", df["trip_miles"].to_numpy()
+    yield "trip_seconds", df["trip_seconds"].to_numpy("float64", na_value=np.nan)
+    # Coordenadas de zone_coords: solo filas con área y lat/lon presentes en ese lado
+    for side, (area, lat, lon) in COORD_SIDES.items():
+        valid = (df[area].notna() & df[lat].notna() & df[lon].notna()).to_numpy()
+        yield f"{side}_coords", valid
+        yield f"{side}_lat", np.where(valid, df[lat].to_numpy("float64", na_value=np.nan), 0.0)
+        yield f"{side}_lon", np.where(valid, df[lon].to_numpy("float64", na_value=np.nan), 0.0)
+
+
+def build_cube(df: pd.DataFrame, codes: dict, labels: dict) -> pd.DataFrame:
+    """Una única pasada sobre el staging: sumas por celda de CUBE_KEYS (outliers incluidos)."""
+    cells, inverse = np.unique(combine(codes, labels, CUBE_KEYS), return_inverse=True)
+    cube = pd.DataFrame(split(cells, labels, CUBE_KEYS))
+    for name, values in measures(df):
+        # bincount = suma por celda sin groupby; los nulos suman 0 como en pandas
+        cube[name] = np.bincount(inverse, weights=np.nan_to_num(values.astype("float64")), minlength=len(cells))
+    cube["is_outlier"] = labels["is_outlier"].take(cube["is_outlier"])
+    return cube
+
+
+def taxi_pairs(df: pd.DataFrame, codes: dict, labels: dict, keys: list) -> np.ndarray:
+    # Pares únicos (grupo, taxi) entre viajes no outlier, codificados como grupo * taxis + taxi
+    valid = ((df["is_outlier"] == 0) & df["taxi_id"].notna()).to_numpy()
+    taxis = len(labels["taxi_id"])
+    return np.unique(combine(codes, labels, keys)[valid] * taxis + codes["taxi_id"][valid])
+
+
+def active_taxis(df: pd.DataFrame, codes: dict, labels: dict, keys: list) -> pd.Series:
+    """Taxis distintos por grupo entre viajes no outlier (nunique no se puede sumar desde el cubo)."""
+    pairs = taxi_pairs(df, codes, labels, keys)
+    groups, counts = np.unique(pairs // len(labels["taxi_id"]), return_counts=True)
+    # Indexado por el código combinado de `keys`, el mismo que usa rollup
+    return pd.Series(counts, index=groups)
+
+
+def rollup(cube: pd.DataFrame, labels: dict, keys: list, columns: list, taxis: pd.Series = None,
+           dropna: bool = True) -> pd.DataFrame:
+    # Roll-up del cubo (no outliers) sobre códigos enteros; las etiquetas se decodifican al final
+    clean = (cube["is_outlier"] == 0).to_numpy()
+    groups, inverse = np.unique(combine(cube, labels, keys)[clean], return_inverse=True)
+    agg = pd.DataFrame(split(groups, labels, keys))
+    for col in columns:
+        agg[col] = np.bincount(inverse, weights=cube[col].to_numpy()[clean], minlength=len(groups))
+    if taxis is not None:
+        agg["active_taxis"] = taxis.reindex(groups, fill_value=0).to_numpy()
+    for key in keys:
+        agg[key] = labels[key].take(agg[key])
+    if dropna:
+        # Mismo descarte de claves nulas que el groupby por defecto
+        agg = agg.dropna(subset=keys)
+    return agg.sort_values(keys).reset_index(drop=True)
+
+
+def finish(agg: pd.DataFrame, columns: list) -> pd.DataFrame:
+    for col in MONEY_FIELDS:
+        if f"{col}_cents" in agg.columns:
+            agg[f"{col}_cents"] = agg[f"{col}_cents"] / 100
+    for col in ["trips", "trip_seconds", "rows"]:
+        if col in agg.columns:
+            agg[col] = agg[col].astype("int64")
+    agg = agg.rename(columns={
+        "trips": "total_trips", "trip_total_cents": "total_revenue", "fare_cents": "total_fare",
+        "tips_cents": "total_tips", "tolls_cents": "total_tolls", "extras_cents": "total_extras",
+        "trip_miles": "total_trip_miles", "trip_seconds": "total_trip_seconds",
+    })
+    return agg[columns]
+
+
+def daily_kpis(cube: pd.DataFrame, labels: dict, taxis: pd.Series) -> pd.DataFrame:
+    agg = rollup(cube, labels, ["trip_date"], [
+        "trips", "trip_total_cents", "fare_cents", "tips_cents", "tolls_cents", "extras_cents",
+        "trip_miles", "trip_seconds",
+    ], taxis)
+    outliers = cube[cube["is_outlier"] == 1].groupby("trip_date")["rows"].sum()
+    outliers.index = labels["trip_date"].take(outliers.index)
+    agg["outlier_count"] = agg["trip_date"].map(outliers).fillna(0).astype("int64")
+    return finish(agg, [
+        "trip_date", "total_trips", "active_taxis",
+        "total_revenue", "total_fare", "total_tips", "total_tolls", "total_extras",
+        "total_trip_miles", "total_trip_seconds", "outlier_count",
+    ])
+
+
+def hourly_kpis(cube: pd.DataFrame, labels: dict, taxis: pd.Series) -> pd.DataFrame:
+    agg = rollup(cube, labels, ["trip_date", "trip_hour"], [
+        "trips", "trip_total_cents", "fare_cents", "tips_cents", "tolls_cents", "extras_cents",
+        "trip_seconds", "trip_miles",
+    ], taxis)
+    agg["trip_weekday"] = pd.to_datetime(agg["trip_date"]).dt.dayofweek
+    return finish(agg, [
+        "trip_date", "trip_hour", "trip_weekday", "total_trips", "active_taxis",
+        "total_revenue", "total_fare", "total_tips", "total_tolls", "total_extras",
+        "total_trip_seconds", "total_trip_miles",
+    ])
+
+
+def zone_kpis(cube: pd.DataFrame, labels: dict, taxis: pd.Series) -> pd.DataFrame:
+    agg = rollup(cube, labels, ZONE_KEYS, ["trips", "trip_total_cents", "fare_cents", "trip_miles"], taxis, dropna=False)
+    for col in ZONE_KEYS:
+        agg[col] = agg[col].fillna(UNKNOWN_AREA).astype(int)
+    return finish(agg, [
+        "pickup_community_area", "dropoff_community_area",
+        "total_trips", "active_taxis", "total_revenue", "total_fare", "total_trip_miles",
+    ])
+
+
+def zone_coord_sums(cube: pd.DataFrame, labels: dict) -> pd.DataFrame:
+    # Sumas y conteos de coordenadas de ambos lados por área (outliers incluidos). Son aditivas:
+    # el modo incremental las acumula en MySQL y recalcula el promedio de las áreas tocadas.
+    sides = []
+    for side, (area, _, _) in COORD_SIDES.items():
+        sums = cube.groupby(area)[[f"{side}_lat", f"{side}_lon", f"{side}_coords"]].sum()
+        sums.index = labels[area].take(sums.index)
+        sums.columns = ["lat_sum", "lon_sum", "coord_count"]
+        sides.append(sums[sums.index.notna()])
+    agg = sides[0].add(sides[1], fill_value=0)
+    agg = agg[agg["coord_count"] > 0]
+    return pd.DataFrame({
+        "community_area": agg.index.astype(int),
+        "lat_sum": agg["lat_sum"].to_numpy(),
+        "lon_sum": agg["lon_sum"].to_numpy(),
+        "coord_count": agg["coord_count"].to_numpy().astype("int64"),
+    }).sort_values("community_area").reset_index(drop=True)
+
+
+def zone_coords(sums: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({
+        "community_area": sums["community_area"],
+        "avg_latitude": sums["lat_sum"] / sums["coord_count"],
+        "avg_longitude": sums["lon_sum"] / sums["coord_count"],
+    })
+
+
+def payment_kpis(cube: pd.DataFrame, labels: dict) -> pd.DataFrame:
+    # Viajes sin payment_type o company quedan fuera, igual que el groupby original
+    agg = rollup(cube, labels, ["trip_date", "payment_type", "company"], [
+        "trips", "trip_total_cents", "tips_cents", "fare_cents",
+    ])
+    agg["company"] = agg["company"].astype(object).fillna("")
+    return finish(agg, ["trip_date", "payment_type", "company", "total_trips", "total_revenue", "total_tips", "total_fare"])
+
+
+def total_diff_kpis(df: pd.DataFrame) -> pd.DataFrame:
+    # Histograma de quality/totals.py, fuera del cubo (agrupa por la diferencia en centavos).
+    # Incluye outliers: describe la fuente, no el revenue reportado
+    hist = totals.diff_histogram(df)
+    hist = hist[hist["trip_date"].notna()]
+    return hist.sort_values(totals.KEYS + ["diff_cents"]).reset_index(drop=True)
+
+
+def taxi_sketches(df: pd.DataFrame, codes: dict, labels: dict, keys: list, dropna: bool = True) -> pd.DataFrame:
+    """Sketch HLL de los taxis activos por grupo: a diferencia de active_taxis, se puede unir."""
+    pairs = taxi_pairs(df, codes, labels, keys)
+    taxis = len(labels["taxi_id"])
+    groups, inverse = np.unique(pairs // taxis, return_inverse=True)
+    # Se hashea cada taxi distinto una sola vez y se indexa por código
+    hashes = hll.hash_values(labels["taxi_id"])[pairs % taxis]
+    sketches = hll.registers(inverse, hashes, len(groups))
+    agg = pd.DataFrame(split(groups, labels, keys))
+    for key in keys:
+        agg[key] = labels[key].take(agg[key])
+    agg["taxi_sketch"] = [hll.to_blob(sketch) for sketch in sketches]
+    if dropna:
+        return agg.dropna(subset=keys).reset_index(drop=True)
+    for key in keys:
+        agg[key] = agg[key].fillna(UNKNOWN_AREA).astype(int)
+    return agg
+
+
+def merge_sketches(sketches: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """Une sketches al grano de `keys` (lotes incrementales, u hora → día) y estima active_taxis."""
+    grouped = sketches.groupby(keys, sort=True)
+    groups = grouped.ngroup().to_numpy()
+    agg = grouped.size().index.to_frame(index=False)
+    if agg.empty:
+        return agg.assign(taxi_sketch=[], active_taxis=[])
+    registers = np.stack([hll.from_blob(blob) for blob in sketches["taxi_sketch"]])
+    merged = hll.merge(registers, groups, len(agg))
+    agg["taxi_sketch"] = [hll.to_blob(sketch) for sketch in merged]
+    agg["active_taxis"] = hll.estimate(merged)
+    return agg
+
+
+def compute_kpis(df: pd.DataFrame, tables: list = None) -> dict:
+    """Tablas agregadas a partir de un único cubo (más los conteos de taxis distintos).
+
+    `tables` limita el cálculo a esas tablas (KPI_TABLES y/o SKETCH_TABLES); por defecto
+    se calculan las de KPI_TABLES.
+    """
+    codes, labels = encode(df)
+    cube = build_cube(df, codes, labels)
+    builders = {
+        "daily_kpis": lambda: daily_kpis(cube, labels, active_taxis(df, codes, labels, ["trip_date"])),
+        "hourly_kpis": lambda: hourly_kpis(cube, labels, active_taxis(df, codes, labels, ["trip_date", "trip_hour"])),
+        "zone_kpis": lambda: zone_kpis(cube, labels, active_taxis(df, codes, labels, ZONE_KEYS)),
+        "zone_coord_sums": lambda: zone_coord_sums(cube, labels),
+        "zone_coords": lambda: zone_coords(zone_coord_sums(cube, labels)),
+        "payment_kpis": lambda: payment_kpis(cube, labels),
+        "total_diff_kpis": lambda: total_diff_kpis(df),
+        "hourly_taxi_sketches": lambda: taxi_sketches(df, codes, labels, ["trip_date", "trip_hour"]),
+        "zone_taxi_sketches": lambda: taxi_sketches(df, codes, labels, ZONE_KEYS, dropna=False),
+    }
+    return {name: builders[name]() for name in (tables or KPI_TABLES)}
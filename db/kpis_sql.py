@@ -0,0 +1,185 @@
+from datetime import date
+
+from db.schema import FACT_LAYOUT, create_shadow, swap_shadow
+
+# Motor SQL de KPIs (KPI_ENGINE=sql): cada tabla se reconstruye con INSERT ... SELECT ... GROUP BY
+# sobre fact_trips. Misma semántica que db/kpis.py: outliers fuera (salvo outlier_count y
+# coordenadas), sumas de nulos = 0 y grupos con clave nula descartados (áreas nulas = -1).
+# Los índices FACT_INDEXES de db/schema.py cubren cada consulta (sin leer filas de la PK).
+
+# Tablas por fecha: se reconstruyen solo dentro del rango pedido
+DATED_SQL = {
+    "daily_kpis": """
+        INSERT INTO {table} (
+            trip_date, total_trips, active_taxis,
+            total_revenue, total_fare, total_tips, total_tolls, total_extras,
+            total_trip_miles, total_trip_seconds, outlier_count
+        )
+        SELECT
+            trip_date,
+            SUM(is_outlier = 0),
+            COUNT(DISTINCT CASE WHEN is_outlier = 0 THEN taxi_id END),
+            COALESCE(SUM(CASE WHEN is_outlier = 0 THEN trip_total END), 0),
+            COALESCE(SUM(CASE WHEN is_outlier = 0 THEN fare END), 0),
+            COALESCE(SUM(CASE WHEN is_outlier = 0 THEN tips END), 0),
+            COALESCE(SUM(CASE WHEN is_outlier = 0 THEN tolls END), 0),
+            COALESCE(SUM(CASE WHEN is_outlier = 0 THEN extras END), 0),
+            COALESCE(SUM(CASE WHEN is_outlier = 0 THEN trip_miles END), 0),
+            COALESCE(SUM(CASE WHEN is_outlier = 0 THEN trip_seconds END), 0),
+            SUM(is_outlier)
+        FROM fact_trips
+        WHERE trip_date IS NOT NULL {range}
+        GROUP BY trip_date
+        HAVING SUM(is_outlier = 0) > 0
+    """,
+
+    "hourly_kpis": """
+        INSERT INTO {table} (
+            trip_date, trip_hour, trip_weekday, total_trips, active_taxis,
+            total_revenue, total_fare, total_tips, total_tolls, total_extras,
+            total_trip_seconds, total_trip_miles
+        )
+        SELECT
+            trip_date, trip_hour, WEEKDAY(trip_date),
+            COUNT(*),
+            COUNT(DISTINCT taxi_id),
+            COALESCE(SUM(trip_total), 0),
+            COALESCE(SUM(fare), 0),
+            COALESCE(SUM(tips), 0),
+            COALESCE(SUM(tolls), 0),
+            COALESCE(SUM(extras), 0),
+            COALESCE(SUM(trip_seconds), 0),
+            COALESCE(SUM(trip_miles), 0)
+        FROM fact_trips
+        WHERE trip_date IS NOT NULL AND is_outlier = 0 AND trip_hour IS NOT NULL {range}
+        GROUP BY trip_date, trip_hour
+    """,
+
+    "payment_kpis": """
+        INSERT INTO {table} (
+            trip_date, payment_type, company,
+            total_trips, total_revenue, total_tips, total_fare
+        )
+        SELECT
+            trip_date, payment_type, company,
+            COUNT(*),
+            COALESCE(SUM(trip_total), 0),
+            COALESCE(SUM(tips), 0),
+            COALESCE(SUM(fare), 0)
+        FROM fact_trips
+        WHERE trip_date IS NOT NULL AND is_outlier = 0
+            AND payment_type IS NOT NULL AND company IS NOT NULL {range}
+        GROUP BY trip_date, payment_type, company
+    """,
+
+    # Histograma de quality/totals.py: incluye outliers y excluye viajes con algún monto nulo
+    "total_diff_kpis": """
+        INSERT INTO {table} (trip_date, company, payment_type, diff_cents, total_trips)
+        SELECT
+            trip_date,
+            COALESCE(company, '') AS company_name,
+            COALESCE(payment_type, '') AS payment,
+            CAST(ROUND((trip_total - (fare + tips + tolls + extras)) * 100) AS SIGNED) AS diff,
+            COUNT(*)
+        FROM fact_trips
+        WHERE trip_date IS NOT NULL AND trip_total IS NOT NULL
+            AND fare IS NOT NULL AND tips IS NOT NULL AND tolls IS NOT NULL AND extras IS NOT NULL {range}
+        GROUP BY trip_date, company_name, payment, diff
+    """,
+}
+
+# Tablas sin fecha: siempre se reconstruyen completas
+UNDATED_SQL = {
+    "zone_kpis": """
+        INSERT INTO {table} (
+            pickup_community_area, dropoff_community_area,
+            total_trips, active_taxis, total_revenue, total_fare, total_trip_miles
+        )
+        SELECT
+            COALESCE(pickup_community_area, -1) AS pickup,
+            COALESCE(dropoff_community_area, -1) AS dropoff,
+            COUNT(*),
+            COUNT(DISTINCT taxi_id),
+            COALESCE(SUM(trip_total), 0),
+            COALESCE(SUM(fare), 0),
+            COALESCE(SUM(trip_miles), 0)
+        FROM fact_trips
+        WHERE is_outlier = 0
+        GROUP BY pickup, dropoff
+    """,
+
+    "zone_coord_sums": """
+        INSERT INTO {table} (community_area, lat_sum, lon_sum, coord_count)
+        SELECT area, SUM(lat), SUM(lon), COUNT(*)
+        FROM (
+            SELECT pickup_community_area AS area, pickup_centroid_latitude AS lat,
+                   pickup_centroid_longitude AS lon
+            FROM fact_trips
+            WHERE pickup_community_area IS NOT NULL
+                AND pickup_centroid_latitude IS NOT NULL AND pickup_centroid_longitude IS NOT NULL
+            UNION ALL
+            SELECT dropoff_community_area, dropoff_centroid_latitude, dropoff_centroid_longitude
+            FROM fact_trips
+            WHERE dropoff_community_area IS NOT NULL
+                AND dropoff_centroid_latitude IS NOT NULL AND dropoff_centroid_longitude IS NOT NULL
+        ) sides
+        GROUP BY area
+    """,
+
+    # Depende de zone_coord_sums (ya reemplazada en modo shadow): va después en el dict
+    "zone_coords": """
+        INSERT INTO {table} (community_area, avg_latitude, avg_longitude)
+        SELECT community_area, lat_sum / coord_count, lon_sum / coord_count
+        FROM zone_coord_sums
+        WHERE coord_count > 0
+    """,
+}
+
+
+def date_range(date_from: date = None, date_to: date = None, column: str = "trip_date") -> tuple:
+    # Condiciones sobre la columna de fecha y sus parámetros; sin límites = toda la historia
+    conditions, params = [], []
+    if date_from is not None:
+        conditions.append(f"{column} >= %s")
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append(f"{column} <= %s")
+        params.append(date_to)
+    return conditions, params
+
+
+def rebuild_kpis(conn, cursor, date_from: date = None, date_to: date = None, shadow: bool = False) -> dict:
+    """Reconstruye las tablas KPI dentro de MySQL; devuelve filas insertadas por tabla.
+
+    Por defecto cada tabla se borra y se vuelve a llenar en una misma transacción: los
+    lectores ven la versión anterior hasta el commit. Con shadow=True se llena <tabla>__new
+    (copiando las fechas fuera de rango) y se intercambia con RENAME TABLE.
+    """
+    conditions, params = date_range(date_from, date_to)
+    where = " AND ".join(conditions)
+    # En el layout partitioned el filtro va sobre la columna de partición para podar meses
+    # (dentro de un rango, trip_date_key = trip_date)
+    fact_conditions, _ = date_range(date_from, date_to, "trip_date_key" if FACT_LAYOUT == "partitioned" else "trip_date")
+    counts = {}
+    for table, sql in {**DATED_SQL, **UNDATED_SQL}.items():
+        print(f"\n🧮 Reconstruyendo {table} en MySQL...")
+        dated = table in DATED_SQL
+        if shadow:
+            target = create_shadow(cursor, table)
+            if dated and conditions:
+                # Las fechas fuera del rango pasan tal cual a la tabla nueva
+                cursor.execute(f"INSERT INTO {target} SELECT * FROM {table} WHERE NOT ({where})", params)
+        else:
+            target = table
+            cursor.execute(f"DELETE FROM {table}" + (f" WHERE {where}" if dated and conditions else ""),
+                           params if dated else [])
+        cursor.execute(
+            sql.format(table=target, range="".join(f" AND {c}" for c in fact_conditions) if dated else ""),
+            params if dated else [],
+        )
+        counts[table] = cursor.rowcount
+        conn.commit()
+        print(f"  ✅ {target}: {counts[table]:,} filas")
+        if shadow:
+            swap_shadow(cursor, table)
+    return counts
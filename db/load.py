@@ -1,15 +1,29 @@
 import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
+import numpy as np
 import pandas as pd
-import mysql.connector
-from mysql.connector import Error
+import pyarrow as pa
+import pyarrow.compute as pc
+from mysql.connector import Error, pooling
 from dotenv import load_dotenv
 
-load_dotenv()
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from db.kpis import (
+    KPI_TABLES, MONEY_FIELDS, SKETCH_TABLES, UNKNOWN_AREA, ZONE_KEYS, compute_kpis, merge_sketches, taxi_sketches,
+)
+from db.kpis_sql import rebuild_kpis
+from db.schema import FACT_COLUMNS, FACT_LAYOUT, KPI_ENGINE, KPI_SHADOW, LOAD_MODE, create_shadow, swap_shadow
+from ingestion.ingest import LOOKBACK_DAYS
+from ingestion.staging_reader import iter_staging_batches, read_staging
 
-STAGING_FILE = Path("data/staging/trips.parquet")
+load_dotenv()
 
 DB_CONFIG = {
     "host": os.getenv("DB_HOST", "localhost"),
@@ -22,43 +36,122 @@ DB_CONFIG = {
 
 BATCH_SIZE = 5_000
 
+# insert: executemany de INSERT IGNORE | infile: LOAD DATA LOCAL INFILE a una tabla temporal
+LOAD_METHOD = os.getenv("LOAD_METHOD", "insert")
+# Conexiones del pool: shards de fact_trips y tablas KPI que se cargan en paralelo
+LOAD_WORKERS = min(int(os.getenv("LOAD_WORKERS", 1)), pooling.CNX_POOL_MAXSIZE)
+# 1: guarda sketches HLL de taxis activos por hora y por par de zonas (db/hll.py)
+KPI_SKETCHES = os.getenv("KPI_SKETCHES", "0") == "1"
+# Rango opcional (YYYY-MM-DD, inclusivo) para KPI_ENGINE=sql: solo esas fechas de staging se
+# cargan y solo esas filas de las tablas KPI por fecha se reconstruyen
+KPI_DATE_FROM = os.getenv("KPI_DATE_FROM")
+KPI_DATE_TO = os.getenv("KPI_DATE_TO")
+# Filas por bloque al escribir el TSV temporal (acota la memoria del texto armado)
+INFILE_CHUNK_ROWS = 250_000
+
+FACT_FIELDS = [
+    "trip_id", "taxi_id", "trip_start_timestamp", "trip_end_timestamp",
+    "trip_seconds", "trip_miles", "pickup_community_area", "dropoff_community_area",
+    "fare", "tips", "tolls", "extras", "trip_total", "payment_type", "company",
+    "pickup_centroid_latitude", "pickup_centroid_longitude",
+    "dropoff_centroid_latitude", "dropoff_centroid_longitude",
+    "trip_date", "trip_hour", "trip_weekday",
+    "revenue_per_mile", "tip_rate", "is_outlier"
+]
+# Columnas FLOAT de fact_trips (float32 en MySQL): al comparar con el staging se usa tolerancia
+FACT_FLOAT_FIELDS = [
+    "trip_miles", "pickup_centroid_latitude", "pickup_centroid_longitude",
+    "dropoff_centroid_latitude", "dropoff_centroid_longitude", "revenue_per_mile", "tip_rate",
+]
+FACT_TEXT_FIELDS = ["trip_id", "taxi_id", "payment_type", "company"]
+FACT_TIME_FIELDS = ["trip_start_timestamp", "trip_end_timestamp", "trip_date"]
+# Columnas aditivas de zone_kpis: los viajes nuevos suman y las versiones corregidas restan
+ZONE_ADDITIVE = ["total_trips", "total_revenue", "total_fare", "total_trip_miles"]
+
+
+def load_staging(start_date: date = None) -> pd.DataFrame:
+    df = read_staging(start_date)
+    since = f" desde {start_date}" if start_date else ""
+    print(f"📂 Staging cargado{since}: {len(df):,} registros")
+    return df
 
-def load_staging() -> pd.DataFrame:
-    if not STAGING_FILE.exists():
-        raise FileNotFoundError(f"No se encontró {STAGING_FILE}. Ejecuta staging.py primero.")
-    df = pd.read_parquet(STAGING_FILE)
-    print(f"📂 Staging cargado: {len(df):,} registros")
+
+def incremental_start(cursor) -> date:
+    # Lo nuevo solo puede caer en la ventana que volvió a pedir la ingesta: desde la última fecha
+    # cargada menos el lookback. daily_kpis (PK trip_date) da esa fecha sin recorrer fact_trips;
+    # si quedó atrás de fact_trips por una carga cortada, la ventana solo se agranda.
+    cursor.execute("SELECT MAX(trip_date) FROM daily_kpis")
+    (last,) = cursor.fetchone()
+    return None if last is None else last - timedelta(days=LOOKBACK_DAYS)
+
+
+def trip_id_filter(batch: list) -> tuple:
+    # Lookup por índice: en el layout partitioned el id indexado es trip_id_bin, no el VARCHAR
+    column, value = ("trip_id_bin", "UNHEX(SHA1(%s))") if FACT_LAYOUT == "partitioned" else ("trip_id", "%s")
+    return f"{column} IN ({', '.join([value] * len(batch))})", batch
+
+
+def stored_trips(cursor, trip_ids: list) -> pd.DataFrame:
+    """Filas de fact_trips de esos trip_id, en lotes, con montos y números como float."""
+    rows = []
+    for i in range(0, len(trip_ids), BATCH_SIZE):
+        condition, params = trip_id_filter(trip_ids[i:i + BATCH_SIZE])
+        cursor.execute(f"SELECT {', '.join(FACT_FIELDS)} FROM fact_trips WHERE {condition}", params)
+        rows.extend(cursor.fetchall())
+    df = pd.DataFrame(rows, columns=FACT_FIELDS)
+    for col in FACT_FIELDS:
+        if col not in FACT_TEXT_FIELDS + FACT_TIME_FIELDS:
+            # DECIMAL llega como Decimal: a float, igual que los montos del staging
+            df[col] = pd.to_numeric(df[col])
+    for col in ["trip_start_timestamp", "trip_end_timestamp"]:
+        df[col] = pd.to_datetime(df[col])
     return df
 
 
+def changed_trip_ids(staged: pd.DataFrame, stored: pd.DataFrame) -> set:
+    """trip_id cuya versión del staging difiere de la guardada en fact_trips (correcciones tardías)."""
+    both = staged[FACT_FIELDS].merge(stored, on="trip_id", suffixes=("", "_db"))
+    same = np.ones(len(both), dtype=bool)
+    for col in FACT_FIELDS[1:]:
+        new, old = both[col], both[f"{col}_db"]
+        missing = (new.isna() & old.isna()).to_numpy()
+        if col in MONEY_FIELDS:
+            # DECIMAL(10,2): se compara en centavos
+            equal = ((new.astype("float64") * 100).round() == (old * 100).round()).to_numpy()
+        elif col in FACT_FLOAT_FIELDS:
+            equal = np.isclose(new.to_numpy("float64", na_value=np.nan), old.to_numpy("float64", na_value=np.nan), rtol=1e-5)
+        elif col in FACT_TIME_FIELDS:
+            # DATETIME guarda segundos
+            equal = (pd.to_datetime(new).dt.floor("s") == pd.to_datetime(old).dt.floor("s")).to_numpy()
+        elif col in FACT_TEXT_FIELDS:
+            equal = (new.astype(object) == old.astype(object)).to_numpy()
+        else:
+            equal = (new.astype("float64") == old.astype("float64")).to_numpy()
+        same &= equal | missing
+    return set(both["trip_id"][~same])
+
+
+def delete_trips(cursor, trip_ids: list):
+    for i in range(0, len(trip_ids), BATCH_SIZE):
+        condition, params = trip_id_filter(trip_ids[i:i + BATCH_SIZE])
+        cursor.execute(f"DELETE FROM fact_trips WHERE {condition}", params)
+
+
+def load_fact_trips(cursor, df: pd.DataFrame):
+    if LOAD_METHOD == "infile":
+        return insert_fact_trips_infile(cursor, df)
+    return insert_fact_trips(cursor, df)
+
+
 def insert_fact_trips(cursor, df: pd.DataFrame):
     print("\n📥 Cargando fact_trips...")
 
-    sql = """
-        INSERT IGNORE INTO fact_trips (
-            trip_id, taxi_id, trip_start_timestamp, trip_end_timestamp,
-            trip_seconds, trip_miles, pickup_community_area, dropoff_community_area,
-            fare, tips, tolls, extras, trip_total, payment_type, company,
-            pickup_centroid_latitude, pickup_centroid_longitude,
-            dropoff_centroid_latitude, dropoff_centroid_longitude,
-            trip_date, trip_hour, trip_weekday,
-            revenue_per_mile, tip_rate, is_outlier
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-        )
+    sql = f"""
+        INSERT IGNORE INTO fact_trips ({", ".join(FACT_FIELDS)})
+        VALUES ({", ".join(["%s"] * len(FACT_FIELDS))})
     """
 
-    cols = [
-        "trip_id", "taxi_id", "trip_start_timestamp", "trip_end_timestamp",
-        "trip_seconds", "trip_miles", "pickup_community_area", "dropoff_community_area",
-        "fare", "tips", "tolls", "extras", "trip_total", "payment_type", "company",
-        "pickup_centroid_latitude", "pickup_centroid_longitude",
-        "dropoff_centroid_latitude", "dropoff_centroid_longitude",
-        "trip_date", "trip_hour", "trip_weekday",
-        "revenue_per_mile", "tip_rate", "is_outlier"
-    ]
-
+    cols = FACT_FIELDS
     total = len(df)
     inserted = 0
 
@@ -72,33 +165,78 @@ def insert_fact_trips(cursor, df: pd.DataFrame):
         cursor.executemany(sql, rows)
         inserted += len(rows)
         pct = inserted / total * 100
-        print(f"  ↳ {inserted:,} / {total:,} ({pct:.1f}%)", end="\r")
+        if LOAD_WORKERS == 1:
+            # Con shards en paralelo las líneas de progreso se pisarían entre sí
+            print(f"  ↳ {inserted:,} / {total:,} ({pct:.1f}%)", end="\r")
 
     print(f"  ✅ fact_trips: {inserted:,} registros insertados")
     return inserted
 
 
-def insert_daily_kpis(cursor, df: pd.DataFrame):
-    print("\n📥 Calculando y cargando daily_kpis...")
+def tsv_column(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    # Formato por defecto de LOAD DATA: \N = NULL; backslash, tab y saltos escapados dentro de los textos
+    if pa.types.is_timestamp(values.type):
+        values = pc.cast(values, pa.timestamp("s"), safe=False)
+    text = pc.cast(values, pa.string())
+    if pa.types.is_dictionary(values.type) or pa.types.is_string(values.type):
+        for char, escaped in [("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r")]:
+            text = pc.replace_substring(text, char, escaped)
+    # Los floats se castean con su repr más corto (float32 incluido): MySQL reconstruye el mismo valor
+    return pc.fill_null(text, "\\N")
+
+
+def write_tsv(df: pd.DataFrame, path: Path):
+    # Todo el armado del texto corre en Arrow (C++): sin tuplas ni objetos Python por celda
+    with open(path, "wb") as f:
+        for i in range(0, len(df), INFILE_CHUNK_ROWS):
+            table = pa.Table.from_pandas(df[FACT_FIELDS].iloc[i:i + INFILE_CHUNK_ROWS], preserve_index=False)
+            lines = pc.binary_join_element_wise(*[tsv_column(table[col]) for col in FACT_FIELDS], "\t")
+            lines = lines.combine_chunks()
+            offsets = pa.array([0, len(lines)], type=pa.int32())
+            text = pc.binary_join(pa.ListArray.from_arrays(offsets, lines), "\n")[0]
+            f.write(text.as_buffer())
+            f.write(b"\n")
+
+
+def insert_fact_trips_infile(cursor, df: pd.DataFrame):
+    print("\n📥 Cargando fact_trips (LOAD DATA LOCAL INFILE)...")
+
+    # Tabla temporal sin índices: LOAD DATA no paga la PK; el INSERT IGNORE ... SELECT
+    # final mantiene la idempotencia sobre trip_id igual que el camino executemany
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS fact_trips_stage")
+    cursor.execute(f"CREATE TEMPORARY TABLE fact_trips_stage ({FACT_COLUMNS}) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "fact_trips.tsv"
+        write_tsv(df, path)
+        cursor.execute(
+            f"""
+            LOAD DATA LOCAL INFILE %s INTO TABLE fact_trips_stage
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+            LINES TERMINATED BY '\\n'
+            ({", ".join(FACT_FIELDS)})
+            """,
+            (path.as_posix(),),
+        )
+    print(f"  ↳ {len(df):,} filas en fact_trips_stage")
 
-    agg = df[df["is_outlier"] == 0].groupby("trip_date").agg(
-        total_trips=("trip_id", "count"),
-        active_taxis=("taxi_id", "nunique"),
-        total_revenue=("trip_total", "sum"),
-        total_fare=("fare", "sum"),
-        total_tips=("tips", "sum"),
-        total_tolls=("tolls", "sum"),
-        total_extras=("extras", "sum"),
-        total_trip_miles=("trip_miles", "sum"),
-        total_trip_seconds=("trip_seconds", "sum"),
-    ).reset_index()
+    cursor.execute(f"""
+        INSERT IGNORE INTO fact_trips ({", ".join(FACT_FIELDS)})
+        SELECT {", ".join(FACT_FIELDS)} FROM fact_trips_stage
+    """)
+    inserted = cursor.rowcount
+    cursor.execute("DROP TEMPORARY TABLE fact_trips_stage")
 
-    outliers = df.groupby("trip_date")["is_outlier"].sum().reset_index()
-    outliers.columns = ["trip_date", "outlier_count"]
-    agg = agg.merge(outliers, on="trip_date", how="left")
+    print(f"  ✅ fact_trips: {inserted:,} registros nuevos de {len(df):,}")
+    return inserted
 
-    sql = """
-        INSERT INTO daily_kpis (
+
+def insert_daily_kpis(cursor, agg: pd.DataFrame, table: str = "daily_kpis"):
+    print(f"\n📥 Cargando {table}...")
+
+    sql = f"""
+        INSERT INTO {table} (
             trip_date, total_trips, active_taxis,
             total_revenue, total_fare, total_tips, total_tolls, total_extras,
             total_trip_miles, total_trip_seconds, outlier_count
@@ -121,27 +259,14 @@ def insert_daily_kpis(cursor, df: pd.DataFrame):
         for row in agg.itertuples(index=False)
     ]
     cursor.executemany(sql, rows)
-    print(f"  ✅ daily_kpis: {len(rows):,} días")
+    print(f"  ✅ {table}: {len(rows):,} días")
 
 
-def insert_hourly_kpis(cursor, df: pd.DataFrame):
-    print("\n📥 Calculando y cargando hourly_kpis...")
+def insert_hourly_kpis(cursor, agg: pd.DataFrame, table: str = "hourly_kpis"):
+    print(f"\n📥 Cargando {table}...")
 
-    agg = df[df["is_outlier"] == 0].groupby(["trip_date", "trip_hour"]).agg(
-        trip_weekday=("trip_weekday", "first"),
-        total_trips=("trip_id", "count"),
-        active_taxis=("taxi_id", "nunique"),
-        total_revenue=("trip_total", "sum"),
-        total_fare=("fare", "sum"),
-        total_tips=("tips", "sum"),
-        total_tolls=("tolls", "sum"),
-        total_extras=("extras", "sum"),
-        total_trip_seconds=("trip_seconds", "sum"),
-        total_trip_miles=("trip_miles", "sum"),
-    ).reset_index()
-
-    sql = """
-        INSERT INTO hourly_kpis (
+    sql = f"""
+        INSERT INTO {table} (
             trip_date, trip_hour, trip_weekday, total_trips, active_taxis,
             total_revenue, total_fare, total_tips, total_tolls, total_extras,
             total_trip_seconds, total_trip_miles
@@ -165,27 +290,14 @@ def insert_hourly_kpis(cursor, df: pd.DataFrame):
         for row in agg.itertuples(index=False)
     ]
     cursor.executemany(sql, rows)
-    print(f"  ✅ hourly_kpis: {len(rows):,} filas")
+    print(f"  ✅ {table}: {len(rows):,} filas")
 
 
-def insert_zone_kpis(cursor, df: pd.DataFrame):
-    print("\n📥 Calculando y cargando zone_kpis...")
+def insert_zone_kpis(cursor, agg: pd.DataFrame, table: str = "zone_kpis"):
+    print(f"\n📥 Cargando {table}...")
 
-    # NULL en área = -1 (viajes fuera de Chicago, según documentación oficial)
-    clean = df[df["is_outlier"] == 0].copy()
-    clean["pickup_community_area"] = clean["pickup_community_area"].fillna(-1).astype(int)
-    clean["dropoff_community_area"] = clean["dropoff_community_area"].fillna(-1).astype(int)
-
-    agg = clean.groupby(["pickup_community_area", "dropoff_community_area"]).agg(
-        total_trips=("trip_id", "count"),
-        active_taxis=("taxi_id", "nunique"),
-        total_revenue=("trip_total", "sum"),
-        total_fare=("fare", "sum"),
-        total_trip_miles=("trip_miles", "sum"),
-    ).reset_index()
-
-    sql = """
-        INSERT INTO zone_kpis (
+    sql = f"""
+        INSERT INTO {table} (
             pickup_community_area, dropoff_community_area,
             total_trips, active_taxis, total_revenue, total_fare, total_trip_miles
         ) VALUES (%s, %s, %s, %s, %s, %s, %s)
@@ -202,37 +314,88 @@ def insert_zone_kpis(cursor, df: pd.DataFrame):
         for row in agg.itertuples(index=False)
     ]
     cursor.executemany(sql, rows)
-    print(f"  ✅ zone_kpis: {len(rows):,} pares origen-destino")
+    print(f"  ✅ {table}: {len(rows):,} pares origen-destino")
 
 
-def insert_zone_coords(cursor, df: pd.DataFrame):
-    print("\n📥 Calculando y cargando zone_coords...")
+def insert_zone_coords(cursor, agg: pd.DataFrame, table: str = "zone_coords"):
+    print(f"\n📥 Cargando {table}...")
 
-    # Lado pickup
-    pickup = df[df["pickup_community_area"].notna()][
-        ["pickup_community_area", "pickup_centroid_latitude", "pickup_centroid_longitude"]
-    ].copy()
-    pickup.columns = ["community_area", "lat", "lon"]
+    sql = f"""
+        INSERT INTO {table} (community_area, avg_latitude, avg_longitude)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            avg_latitude=VALUES(avg_latitude),
+            avg_longitude=VALUES(avg_longitude)
+    """
 
-    # Lado dropoff
-    dropoff = df[df["dropoff_community_area"].notna()][
-        ["dropoff_community_area", "dropoff_centroid_latitude", "dropoff_centroid_longitude"]
-    ].copy()
-    dropoff.columns = ["community_area", "lat", "lon"]
+    rows = [
+        tuple(None if pd.isna(v) else v.item() if hasattr(v, 'item') else v for v in row)
+        for row in agg.itertuples(index=False)
+    ]
+    cursor.executemany(sql, rows)
+    print(f"  ✅ {table}: {len(rows):,} zonas")
 
-    # Combinar y promediar coordenadas por zona
-    combined = pd.concat([pickup, dropoff], ignore_index=True)
-    agg = combined.dropna(subset=["lat", "lon"]).groupby("community_area").agg(
-        avg_latitude=("lat", "mean"),
-        avg_longitude=("lon", "mean"),
-    ).reset_index()
 
-    sql = """
+def insert_zone_coord_sums(cursor, agg: pd.DataFrame, additive: bool = False, table: str = "zone_coord_sums"):
+    print(f"\n📥 Cargando {table}...")
+
+    # additive: los viajes nuevos se suman a lo ya acumulado en vez de reemplazarlo
+    update = "{col}={col}+VALUES({col})" if additive else "{col}=VALUES({col})"
+    sql = f"""
+        INSERT INTO {table} (community_area, lat_sum, lon_sum, coord_count)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            {", ".join(update.format(col=col) for col in ["lat_sum", "lon_sum", "coord_count"])}
+    """
+
+    rows = [
+        tuple(None if pd.isna(v) else v.item() if hasattr(v, 'item') else v for v in row)
+        for row in agg.itertuples(index=False)
+    ]
+    cursor.executemany(sql, rows)
+    print(f"  ✅ {table}: {len(rows):,} zonas")
+
+
+def refresh_zone_coords(cursor, areas: list):
+    print("\n📥 Actualizando zone_coords...")
+
+    cursor.execute(f"""
         INSERT INTO zone_coords (community_area, avg_latitude, avg_longitude)
-        VALUES (%s, %s, %s)
+        SELECT community_area, lat_sum / coord_count, lon_sum / coord_count
+        FROM zone_coord_sums
+        WHERE community_area IN ({", ".join(["%s"] * len(areas))}) AND coord_count > 0
         ON DUPLICATE KEY UPDATE
             avg_latitude=VALUES(avg_latitude),
             avg_longitude=VALUES(avg_longitude)
+    """, areas)
+    # Áreas que se quedaron sin coordenadas al restar versiones corregidas: igual que una carga
+    # completa, no tienen fila
+    placeholders = ", ".join(["%s"] * len(areas))
+    cursor.execute(f"""
+        DELETE FROM zone_coords WHERE community_area IN (
+            SELECT community_area FROM zone_coord_sums
+            WHERE community_area IN ({placeholders}) AND coord_count <= 0
+        )
+    """, areas)
+    cursor.execute(f"DELETE FROM zone_coord_sums WHERE community_area IN ({placeholders}) AND coord_count <= 0", areas)
+    print(f"  ✅ zone_coords: {len(areas):,} zonas recalculadas")
+
+
+def insert_zone_deltas(cursor, agg: pd.DataFrame):
+    print("\n📥 Sumando deltas a zone_kpis...")
+
+    # Conteos y montos son aditivos; active_taxis llega ya recalculado para cada par tocado
+    sql = """
+        INSERT INTO zone_kpis (
+            pickup_community_area, dropoff_community_area,
+            total_trips, active_taxis, total_revenue, total_fare, total_trip_miles
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            total_trips=total_trips+VALUES(total_trips),
+            active_taxis=VALUES(active_taxis),
+            total_revenue=total_revenue+VALUES(total_revenue),
+            total_fare=total_fare+VALUES(total_fare),
+            total_trip_miles=total_trip_miles+VALUES(total_trip_miles)
     """
 
     rows = [
@@ -240,24 +403,44 @@ def insert_zone_coords(cursor, df: pd.DataFrame):
         for row in agg.itertuples(index=False)
     ]
     cursor.executemany(sql, rows)
-    print(f"  ✅ zone_coords: {len(rows):,} zonas")
+    print(f"  ✅ zone_kpis: {len(rows):,} pares origen-destino actualizados")
 
 
-def insert_payment_kpis(cursor, df: pd.DataFrame):
-    print("\n📥 Calculando y cargando payment_kpis...")
+def insert_taxi_sketches(cursor, agg: pd.DataFrame, table: str):
+    print(f"\n📥 Cargando {table}...")
 
-    agg = df[df["is_outlier"] == 0].groupby(["trip_date", "payment_type", "company"]).agg(
-        total_trips=("trip_id", "count"),
-        total_revenue=("trip_total", "sum"),
-        total_tips=("tips", "sum"),
-        total_fare=("fare", "sum"),
-    ).reset_index()
+    columns = list(agg.columns)
+    sql = f"""
+        INSERT INTO {table} ({", ".join(columns)})
+        VALUES ({", ".join(["%s"] * len(columns))})
+        ON DUPLICATE KEY UPDATE
+            taxi_sketch=VALUES(taxi_sketch)
+    """
 
-    # Reemplazar company NULL con cadena vacía para la PK
-    agg["company"] = agg["company"].fillna("")
+    rows = [
+        tuple(None if pd.isna(v) else v.item() if hasattr(v, 'item') else v for v in row)
+        for row in agg.itertuples(index=False)
+    ]
+    cursor.executemany(sql, rows)
+    print(f"  ✅ {table}: {len(rows):,} sketches")
 
-    sql = """
-        INSERT INTO payment_kpis (
+
+def stored_zone_sketches(cursor) -> pd.DataFrame:
+    cursor.execute(f"SELECT {', '.join(ZONE_KEYS)}, taxi_sketch FROM zone_taxi_sketches")
+    return pd.DataFrame(cursor.fetchall(), columns=ZONE_KEYS + ["taxi_sketch"])
+
+
+def delete_dates(cursor, table: str, dates: list):
+    for i in range(0, len(dates), BATCH_SIZE):
+        batch = dates[i:i + BATCH_SIZE]
+        cursor.execute(f"DELETE FROM {table} WHERE trip_date IN ({', '.join(['%s'] * len(batch))})", batch)
+
+
+def insert_payment_kpis(cursor, agg: pd.DataFrame, table: str = "payment_kpis"):
+    print(f"\n📥 Cargando {table}...")
+
+    sql = f"""
+        INSERT INTO {table} (
             trip_date, payment_type, company,
             total_trips, total_revenue, total_tips, total_fare
         )
@@ -274,41 +457,304 @@ def insert_payment_kpis(cursor, df: pd.DataFrame):
         for row in agg.itertuples(index=False)
     ]
     cursor.executemany(sql, rows)
-    print(f"  ✅ payment_kpis: {len(rows):,} filas")
+    print(f"  ✅ {table}: {len(rows):,} filas")
 
 
-def main():
-    print("=" * 60)
-    print("WindyCity Cabs — Load MySQL")
-    print("=" * 60)
-    start = datetime.now()
+def insert_total_diff_kpis(cursor, agg: pd.DataFrame, table: str = "total_diff_kpis"):
+    print(f"\n📥 Cargando {table}...")
 
-    df = load_staging()
+    sql = f"""
+        INSERT INTO {table} (trip_date, company, payment_type, diff_cents, total_trips)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            total_trips=VALUES(total_trips)
+    """
 
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
+    rows = [
+        tuple(None if pd.isna(v) else v.item() if hasattr(v, 'item') else v for v in row)
+        for row in agg.itertuples(index=False)
+    ]
+    cursor.executemany(sql, rows)
+    print(f"  ✅ {table}: {len(rows):,} filas")
 
-        insert_fact_trips(cursor, df)
-        conn.commit()
 
-        insert_daily_kpis(cursor, df)
-        conn.commit()
+def connection_pool() -> pooling.MySQLConnectionPool:
+    # LOAD DATA LOCAL requiere habilitarlo en el cliente (y local_infile=ON en el servidor)
+    return pooling.MySQLConnectionPool(
+        pool_name="windycity_load", pool_size=LOAD_WORKERS,
+        allow_local_infile=LOAD_METHOD == "infile", **DB_CONFIG,
+    )
 
-        insert_hourly_kpis(cursor, df)
-        conn.commit()
 
-        insert_zone_kpis(cursor, df)
+def run_parallel(pool: pooling.MySQLConnectionPool, tasks: dict) -> dict:
+    """Corre cada tarea con su propia conexión del pool y un commit al final; devuelve segundos por tarea."""
+    def run(task):
+        conn = pool.get_connection()
+        cursor = conn.cursor()
+        try:
+            t0 = time.perf_counter()
+            task(conn, cursor)
+            conn.commit()
+            return time.perf_counter() - t0
+        finally:
+            cursor.close()
+            conn.close()  # devuelve la conexión al pool
+
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        futures = {name: executor.submit(run, task) for name, task in tasks.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def key_range_shards(df: pd.DataFrame, shards: int) -> list:
+    # Rangos contiguos de trip_id (cortes tomados de una muestra ordenada): cada conexión
+    # inserta en una zona distinta del índice de la PK y no compite por las mismas páginas
+    if shards <= 1 or len(df) < shards:
+        return [df]
+    ids = df["trip_id"].fillna("").to_numpy(dtype=object)
+    sample = np.sort(np.random.default_rng(0).choice(ids, min(len(ids), 10_000), replace=False))
+    bounds = sample[[len(sample) * k // shards for k in range(1, shards)]]
+    shard = np.searchsorted(bounds, ids, side="right")
+    return [df[shard == k] for k in range(shards)]
+
+
+def report_timings(timings: dict, wall: float):
+    print("\n⏱️  Tiempos de carga:")
+    for name, elapsed in timings.items():
+        print(f"  {name:<24} {elapsed:7.1f}s")
+    print(f"  {'total (reloj)':<24} {wall:7.1f}s con {LOAD_WORKERS} conexiones")
+
+
+def load_full(pool: pooling.MySQLConnectionPool, df: pd.DataFrame):
+    start = time.perf_counter()
+    shards = key_range_shards(df, LOAD_WORKERS)
+    timings = run_parallel(pool, {
+        f"fact_trips[{i}]": lambda conn, cursor, shard=shard: load_fact_trips(cursor, shard)
+        for i, shard in enumerate(shards)
+    })
+
+    t0 = time.perf_counter()
+    print("\n🧮 Calculando KPIs (cubo único)...")
+    kpis = compute_kpis(df, KPI_TABLES + (SKETCH_TABLES if KPI_SKETCHES else []))
+
+    loaders = {
+        "daily_kpis": insert_daily_kpis,
+        "hourly_kpis": insert_hourly_kpis,
+        "zone_kpis": insert_zone_kpis,
+        "zone_coord_sums": insert_zone_coord_sums,
+        "zone_coords": insert_zone_coords,
+        "payment_kpis": insert_payment_kpis,
+        "total_diff_kpis": insert_total_diff_kpis,
+    }
+    if KPI_SKETCHES:
+        loaders.update({name: insert_taxi_sketches for name in SKETCH_TABLES})
+
+    timings["cálculo KPIs"] = time.perf_counter() - t0
+
+    def load_table(name, insert):
+        def task(conn, cursor):
+            if KPI_SHADOW:
+                # Carga sobre <tabla>__new sin índices secundarios; los lectores siguen viendo la actual
+                insert(cursor, kpis[name], table=create_shadow(cursor, name))
+                conn.commit()
+                swap_shadow(cursor, name)
+            else:
+                # Borrado y recarga en la misma transacción (run_parallel hace el commit), igual
+                # que el motor SQL: no depende del DROP de schema.py, que pipeline.py puede saltear,
+                # y no deja filas de grupos que ya no existen
+                cursor.execute(f"DELETE FROM {name}")
+                insert(cursor, kpis[name], table=name)
+        return task
+
+    # Las tablas KPI no dependen entre sí: cada una va por su conexión
+    timings.update(run_parallel(pool, {name: load_table(name, insert) for name, insert in loaders.items()}))
+    report_timings(timings, time.perf_counter() - start)
+
+
+def history_zone_pairs(pairs: pd.DataFrame) -> pd.DataFrame:
+    """(par de zonas, taxi) únicos entre viajes no outlier de `pairs`, sobre toda la historia del staging.
+
+    Taxis distintos no se pueden sumar ni restar: sin sketches (o cuando un par pierde viajes)
+    hay que recontarlos. Se recorre el staging por lotes con solo las columnas del conteo y se
+    guardan los (par, taxi) únicos de los pares tocados, así la memoria no depende del tamaño de
+    la historia; el tiempo sí.
+    """
+    touched = pd.MultiIndex.from_frame(pairs[ZONE_KEYS])
+    seen = [pd.DataFrame({key: pd.Series(dtype=int) for key in ZONE_KEYS}).assign(taxi_id=pd.Series(dtype=object))]
+    for batch in iter_staging_batches(columns=ZONE_KEYS + ["taxi_id", "is_outlier"]):
+        batch = batch[(batch["is_outlier"] == 0) & batch["taxi_id"].notna()]
+        keys = batch[ZONE_KEYS].fillna(UNKNOWN_AREA).astype(int)
+        inside = pd.MultiIndex.from_frame(keys).isin(touched)
+        seen.append(keys[inside].assign(taxi_id=batch["taxi_id"][inside].astype(str)).drop_duplicates())
+    return pd.concat(seen, ignore_index=True).drop_duplicates()
+
+
+def history_zone_taxis(pairs: pd.DataFrame) -> pd.DataFrame:
+    taxis = history_zone_pairs(pairs).groupby(ZONE_KEYS).size()
+    return taxis.rename("active_taxis").reset_index()
+
+
+def history_zone_sketches(pairs: pd.DataFrame) -> pd.DataFrame:
+    # Mismo sketch que taxi_sketches sobre los viajes, armado desde los (par, taxi) únicos
+    seen = history_zone_pairs(pairs).assign(is_outlier=0)
+    codes, labels = {}, {}
+    for key in ZONE_KEYS + ["taxi_id"]:
+        codes[key], labels[key] = pd.factorize(seen[key])
+    return taxi_sketches(seen, codes, labels, ZONE_KEYS, dropna=False)
+
+
+def signed_sum(added: pd.DataFrame, removed: pd.DataFrame, table: str, keys: list, columns: list) -> pd.DataFrame:
+    # Delta aditivo de `table`: suma de los viajes agregados menos la de las versiones reemplazadas
+    parts = [compute_kpis(added, [table])[table][keys + columns]]
+    if not removed.empty:
+        minus = compute_kpis(removed, [table])[table][keys + columns]
+        minus[columns] = -minus[columns]
+        parts.append(minus)
+    return pd.concat(parts, ignore_index=True).groupby(keys, as_index=False)[columns].sum()
+
+
+def zone_deltas(cursor, added: pd.DataFrame, removed: pd.DataFrame) -> tuple:
+    """Deltas de zone_kpis (viajes agregados menos versiones reemplazadas), con active_taxis ya
+    resuelto por par tocado.
+
+    Devuelve también los sketches a escribir y los pares que se quedaron sin sketch (None sin
+    KPI_SKETCHES).
+    """
+    delta = signed_sum(added, removed, "zone_kpis", ZONE_KEYS, ZONE_ADDITIVE)
+    sketches = emptied = None
+    if KPI_SKETCHES:
+        # Sketch guardado ∪ sketch del lote: estimación sin releer la historia
+        batch = compute_kpis(added, ["zone_taxi_sketches"])["zone_taxi_sketches"]
+        stored = stored_zone_sketches(cursor)
+        rebuilt = batch.iloc[:0]
+        if not removed.empty:
+            # Un sketch no resta: los pares que pierden viajes se rearman desde la historia
+            lost = compute_kpis(removed, ["zone_taxi_sketches"])["zone_taxi_sketches"][ZONE_KEYS]
+            rebuilt = history_zone_sketches(lost)
+            stored = stored[~pd.MultiIndex.from_frame(stored[ZONE_KEYS]).isin(pd.MultiIndex.from_frame(lost))]
+            emptied = lost.merge(rebuilt[ZONE_KEYS], on=ZONE_KEYS, how="left", indicator=True)
+            emptied = emptied[emptied["_merge"] == "left_only"][ZONE_KEYS]
+        merged = merge_sketches(pd.concat([stored, batch, rebuilt], ignore_index=True), ZONE_KEYS)
+        taxis = merged[ZONE_KEYS + ["active_taxis"]]
+        touched = pd.concat([batch[ZONE_KEYS], rebuilt[ZONE_KEYS]]).drop_duplicates()
+        sketches = merged.merge(touched, on=ZONE_KEYS)[ZONE_KEYS + ["taxi_sketch"]]
+    else:
+        taxis = history_zone_taxis(delta[ZONE_KEYS])
+    delta = delta.merge(taxis, on=ZONE_KEYS, how="left")
+    # Un par sin sketch nunca tuvo viajes con taxi
+    delta["active_taxis"] = delta["active_taxis"].fillna(0).astype("int64")
+    return delta[ZONE_KEYS + ["total_trips", "active_taxis", "total_revenue", "total_fare", "total_trip_miles"]], sketches, emptied
+
+
+def dated_staging(df: pd.DataFrame, dates: list, start: date) -> pd.DataFrame:
+    # Viajes de las fechas afectadas; una corrección puede mover un viaje desde una fecha anterior
+    # a la ventana, que se lee aparte (solo esa partición)
+    frames = [df[df["trip_date"].isin(dates)]]
+    frames += [read_staging(day, day) for day in dates if start is not None and day < start]
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def load_incremental(conn, cursor):
+    # Solo la ventana de la ingesta: ni el staging completo en memoria ni todos los trip_id al servidor
+    start = incremental_start(cursor)
+    df = load_staging(start)
+    print("\n🔎 Buscando viajes nuevos y corregidos...")
+    stored = stored_trips(cursor, df["trip_id"].dropna().tolist())
+    known = df["trip_id"].isin(stored["trip_id"])
+    changed_ids = changed_trip_ids(df[known], stored)
+    new = df[~known]
+    changed = df[df["trip_id"].isin(changed_ids)]
+    # Versiones guardadas de los viajes corregidos: se restan de las tablas aditivas
+    replaced = stored[stored["trip_id"].isin(changed_ids)]
+    print(f"  ↳ {len(new):,} viajes nuevos y {len(changed):,} corregidos de {len(df):,}")
+    if new.empty and changed.empty:
+        print("  ✅ fact_trips y KPIs ya están al día")
+        return
+
+    # La versión corregida reemplaza a la guardada (INSERT IGNORE sola la conservaría)
+    added = pd.concat([new, changed], ignore_index=True)
+    delete_trips(cursor, sorted(changed_ids))
+    load_fact_trips(cursor, added)
+    conn.commit()
+
+    # Tablas por fecha: se reescriben completas, pero solo para las fechas con viajes nuevos o
+    # corregidos (incluida la fecha anterior de un viaje que cambió de día)
+    dates = sorted(set(added["trip_date"].dropna()) | set(replaced["trip_date"].dropna()))
+    print(f"\n🧮 Recalculando KPIs de {len(dates):,} fechas afectadas...")
+    by_date = [
+        ("daily_kpis", insert_daily_kpis),
+        ("hourly_kpis", insert_hourly_kpis),
+        ("payment_kpis", insert_payment_kpis),
+        ("total_diff_kpis", insert_total_diff_kpis),
+    ]
+    if KPI_SKETCHES:
+        by_date.append(("hourly_taxi_sketches", insert_taxi_sketches))
+    kpis = compute_kpis(dated_staging(df, dates, start), [table for table, _ in by_date])
+    for table, insert in by_date:
+        delete_dates(cursor, table, dates)
+        insert(cursor, kpis[table], table=table)
         conn.commit()
 
-        insert_zone_coords(cursor, df)
+    # Tablas sin fecha: los viajes nuevos y corregidos suman, las versiones reemplazadas restan
+    if not KPI_SKETCHES:
+        print("\n⚠️  Sin KPI_SKETCHES, active_taxis de zone_kpis se recuenta recorriendo toda la historia del staging")
+    delta, sketches, emptied = zone_deltas(cursor, added, replaced)
+    insert_zone_deltas(cursor, delta)
+    # Pares que se quedaron sin viajes: una carga completa no los tendría
+    cursor.execute("DELETE FROM zone_kpis WHERE total_trips <= 0")
+    if sketches is not None:
+        insert_taxi_sketches(cursor, sketches, "zone_taxi_sketches")
+    if emptied is not None and not emptied.empty:
+        cursor.executemany(
+            f"DELETE FROM zone_taxi_sketches WHERE {' AND '.join(f'{key} = %s' for key in ZONE_KEYS)}",
+            [tuple(int(v) for v in row) for row in emptied.itertuples(index=False)],
+        )
+    conn.commit()
+
+    sums = signed_sum(added, replaced, "zone_coord_sums", ["community_area"], ["lat_sum", "lon_sum", "coord_count"])
+    if not sums.empty:
+        insert_zone_coord_sums(cursor, sums, additive=True)
+        refresh_zone_coords(cursor, sums["community_area"].tolist())
         conn.commit()
 
-        insert_payment_kpis(cursor, df)
+
+def load_sql(conn, cursor):
+    # El staging nunca se materializa completo: fact_trips se carga por lotes y los KPI
+    # se agregan dentro de MySQL
+    date_from = date.fromisoformat(KPI_DATE_FROM) if KPI_DATE_FROM else None
+    date_to = date.fromisoformat(KPI_DATE_TO) if KPI_DATE_TO else None
+    total = 0
+    for batch in iter_staging_batches(date_from, date_to):
+        load_fact_trips(cursor, batch)
         conn.commit()
+        total += len(batch)
+    print(f"\n📂 Staging cargado por lotes: {total:,} registros")
+
+    if KPI_SKETCHES:
+        print("\n⚠️  KPI_SKETCHES no aplica con KPI_ENGINE=sql: los sketches no se actualizan")
+    rebuild_kpis(conn, cursor, date_from, date_to, shadow=KPI_SHADOW)
 
-        cursor.close()
-        conn.close()
+
+def main():
+    print("=" * 60)
+    print("WindyCity Cabs — Load MySQL")
+    print("=" * 60)
+    start = datetime.now()
+
+    df = load_staging() if KPI_ENGINE != "sql" and LOAD_MODE != "incremental" else None
+
+    try:
+        pool = connection_pool()
+        if KPI_ENGINE == "sql" or LOAD_MODE == "incremental":
+            conn = pool.get_connection()
+            cursor = conn.cursor()
+            if KPI_ENGINE == "sql":
+                load_sql(conn, cursor)
+            else:
+                load_incremental(conn, cursor)
+            cursor.close()
+            conn.close()
+        else:
+            load_full(pool, df)
 
     except Error as e:
         print(f"\n❌ Error MySQL: {e}")
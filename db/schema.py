@@ -1,4 +1,6 @@
 import os
+from datetime import date
+
 import mysql.connector
 from dotenv import load_dotenv
 
@@ -13,9 +15,22 @@ DB_CONFIG = {
     "use_pure": True,
 }
 
-TABLES = {
-    "fact_trips": """
-        CREATE TABLE IF NOT EXISTS fact_trips (
+# full: las tablas KPI se recrean en cada corrida | incremental: se conservan y db/load.py
+# solo reescribe las fechas tocadas por viajes nuevos
+LOAD_MODE = os.getenv("LOAD_MODE", "full")
+# pandas: KPIs calculados en db/kpis.py | sql: INSERT ... SELECT en MySQL (db/kpis_sql.py)
+KPI_ENGINE = os.getenv("KPI_ENGINE", "pandas")
+# 1: las cargas completas llenan <tabla>__new y la intercambian con RENAME TABLE (sin DROP previo)
+KPI_SHADOW = os.getenv("KPI_SHADOW", "0") == "1"
+# plain: PK VARCHAR(trip_id) | partitioned: particiones mensuales por fecha y PK binaria
+FACT_LAYOUT = os.getenv("FACT_LAYOUT", "plain")
+# Primer mes con partición propia en el layout partitioned; lo anterior cae en p_before
+FACT_PARTITION_FROM = os.getenv("FACT_PARTITION_FROM", "2024-01")
+# Meses futuros que se dejan creados por adelantado (los agrega cada corrida de schema.py)
+FACT_PARTITION_AHEAD = 12
+
+# Columnas de fact_trips; se reusan para la tabla temporal de la carga bulk (db/load.py)
+FACT_COLUMNS = """
             trip_id                     VARCHAR(64)     NOT NULL,
             taxi_id                     VARCHAR(128),
             trip_start_timestamp        DATETIME,
@@ -41,14 +56,129 @@ TABLES = {
             trip_weekday                TINYINT,
             revenue_per_mile            FLOAT,
             tip_rate                    FLOAT,
-            is_outlier                  TINYINT(1)      DEFAULT 0,
+            is_outlier                  TINYINT(1)      DEFAULT 0
+"""
+
+# Índices secundarios cubrientes de fact_trips para el motor SQL: cada GROUP BY de
+# db/kpis_sql.py se resuelve leyendo solo el índice. Se crean solo con KPI_ENGINE=sql,
+# porque encarecen cada inserción en fact_trips.
+FACT_INDEXES = {
+    "idx_fact_daily": [
+        "trip_date", "is_outlier", "taxi_id",
+        "trip_total", "fare", "tips", "tolls", "extras", "trip_miles", "trip_seconds",
+    ],
+    "idx_fact_hourly": [
+        "trip_date", "is_outlier", "trip_hour", "taxi_id",
+        "trip_total", "fare", "tips", "tolls", "extras", "trip_miles", "trip_seconds",
+    ],
+    "idx_fact_payment": [
+        "trip_date", "is_outlier", "payment_type", "company", "trip_total", "tips", "fare",
+    ],
+    "idx_fact_zone": [
+        "is_outlier", "pickup_community_area", "dropoff_community_area", "taxi_id",
+        "trip_total", "fare", "trip_miles",
+    ],
+}
+
+# Layout partitioned: trip_date_key es trip_date sin nulos (la columna de partición tiene que
+# formar parte de la PK) y trip_id_bin son los 20 bytes del SHA-1 de trip_id en lugar de un
+# VARCHAR(64). La PK (trip_date_key, trip_id_bin) agrupa las inserciones de cada día en vez de
+# repartirlas por todo el árbol, y cada índice secundario arrastra 23 bytes de PK en vez de ~65.
+FACT_PARTITIONED_COLUMNS = """
+            trip_date_key               DATE            AS (COALESCE(trip_date, '1970-01-01')) STORED NOT NULL,
+            trip_id_bin                 BINARY(20)      AS (UNHEX(SHA1(trip_id))) STORED NOT NULL
+"""
+
+# Caminos de acceso del layout partitioned (rangos de fecha, zonas, compañía) y búsqueda
+# por trip_id (la PK ya no empieza por el id)
+FACT_LAYOUT_INDEXES = {
+    "idx_fact_trip_id": ["trip_id_bin"],
+    "idx_fact_start": ["trip_start_timestamp"],
+    "idx_fact_pickup": ["pickup_community_area", "trip_date_key"],
+    "idx_fact_dropoff": ["dropoff_community_area", "trip_date_key"],
+    "idx_fact_company": ["company", "trip_date_key"],
+}
+
+
+def month_start(value: date, months: int = 0) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_partitions(start: date, end: date) -> list:
+    # Una partición por mes de [start, end]: p202601 guarda trip_date_key < 2026-02-01
+    partitions, month = [], month_start(start)
+    while month <= end:
+        upper = month_start(month, 1)
+        partitions.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{upper.isoformat()}')")
+        month = upper
+    return partitions
+
+
+def fact_ddl(layout: str) -> str:
+    if layout != "partitioned":
+        return f"""
+        CREATE TABLE IF NOT EXISTS fact_trips (
+            {FACT_COLUMNS.strip()},
             PRIMARY KEY (trip_id)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-    """,
+    """
+    first = date.fromisoformat(f"{FACT_PARTITION_FROM}-01")
+    partitions = [f"PARTITION p_before VALUES LESS THAN ('{first.isoformat()}')"]
+    partitions += month_partitions(first, month_start(date.today(), FACT_PARTITION_AHEAD))
+    partitions.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+    partitions = ",\n            ".join(partitions)
+    return f"""
+        CREATE TABLE IF NOT EXISTS fact_trips (
+            {FACT_COLUMNS.strip()},
+            {FACT_PARTITIONED_COLUMNS.strip()},
+            PRIMARY KEY (trip_date_key, trip_id_bin)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        PARTITION BY RANGE COLUMNS (trip_date_key) (
+            {partitions}
+        );
+    """
+
+
+def add_month_partitions(cursor):
+    # Parte p_future para que siempre haya FACT_PARTITION_AHEAD meses creados por delante
+    cursor.execute(
+        """
+        SELECT partition_name FROM information_schema.partitions
+        WHERE table_schema = DATABASE() AND table_name = 'fact_trips' AND partition_name LIKE 'p2%'
+        """
+    )
+    existing = sorted(row[0] for row in cursor.fetchall())
+    if not existing:
+        return
+    last = date(int(existing[-1][1:5]), int(existing[-1][5:7]), 1)
+    missing = month_partitions(month_start(last, 1), month_start(date.today(), FACT_PARTITION_AHEAD))
+    if missing:
+        cursor.execute(
+            "ALTER TABLE fact_trips REORGANIZE PARTITION p_future INTO ("
+            + ", ".join(missing + ["PARTITION p_future VALUES LESS THAN (MAXVALUE)"]) + ")"
+        )
+        print(f"  ✅ fact_trips: {len(missing)} particiones mensuales nuevas")
+
+
+# Índices secundarios de las tablas KPI (accesos de dashboards y exports fuera de la PK).
+# En las reconstrucciones shadow se crean después de llenar la tabla, en un solo ALTER. Igual
+# que FACT_INDEXES, solo con KPI_ENGINE=sql: encarecen cada escritura de la carga pandas.
+KPI_INDEXES = {
+    "hourly_kpis": {"idx_hourly_weekday": ["trip_weekday", "trip_hour"]},
+    "zone_kpis": {
+        "idx_zone_trips": ["total_trips"],
+        "idx_zone_dropoff": ["dropoff_community_area"],
+    },
+    "payment_kpis": {"idx_payment_company": ["company", "trip_date"]},
+}
+
+TABLES = {
+    "fact_trips": fact_ddl(FACT_LAYOUT),
 
     "daily_kpis": """
         DROP TABLE IF EXISTS daily_kpis;
-        CREATE TABLE daily_kpis (
+        CREATE TABLE IF NOT EXISTS daily_kpis (
             trip_date               DATE            NOT NULL,
             total_trips             INT,
             active_taxis            INT,
@@ -66,7 +196,7 @@ TABLES = {
 
     "hourly_kpis": """
         DROP TABLE IF EXISTS hourly_kpis;
-        CREATE TABLE hourly_kpis (
+        CREATE TABLE IF NOT EXISTS hourly_kpis (
             trip_date           DATE        NOT NULL,
             trip_hour           TINYINT     NOT NULL,
             trip_weekday        TINYINT,
@@ -85,7 +215,7 @@ TABLES = {
 
     "zone_kpis": """
         DROP TABLE IF EXISTS zone_kpis;
-        CREATE TABLE zone_kpis (
+        CREATE TABLE IF NOT EXISTS zone_kpis (
             pickup_community_area   INT             NOT NULL,
             dropoff_community_area  INT             NOT NULL,
             total_trips             INT,
@@ -99,7 +229,7 @@ TABLES = {
 
     "zone_coords": """
         DROP TABLE IF EXISTS zone_coords;
-        CREATE TABLE zone_coords (
+        CREATE TABLE IF NOT EXISTS zone_coords (
             community_area  INT     NOT NULL,
             avg_latitude    FLOAT,
             avg_longitude   FLOAT,
@@ -107,9 +237,44 @@ TABLES = {
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """,
 
+    # Sumas aditivas detrás de zone_coords: el modo incremental les suma los viajes nuevos
+    # y recalcula el promedio solo de las áreas tocadas
+    "zone_coord_sums": """
+        DROP TABLE IF EXISTS zone_coord_sums;
+        CREATE TABLE IF NOT EXISTS zone_coord_sums (
+            community_area  INT     NOT NULL,
+            lat_sum         DOUBLE,
+            lon_sum         DOUBLE,
+            coord_count     BIGINT,
+            PRIMARY KEY (community_area)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+
+    # Sketches HLL de taxis activos (KPI_SKETCHES=1, ver db/hll.py). Tablas aparte para que
+    # los SELECT * de exports/ no arrastren blobs
+    "hourly_taxi_sketches": """
+        DROP TABLE IF EXISTS hourly_taxi_sketches;
+        CREATE TABLE IF NOT EXISTS hourly_taxi_sketches (
+            trip_date       DATE        NOT NULL,
+            trip_hour       TINYINT     NOT NULL,
+            taxi_sketch     BLOB        NOT NULL,
+            PRIMARY KEY (trip_date, trip_hour)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+
+    "zone_taxi_sketches": """
+        DROP TABLE IF EXISTS zone_taxi_sketches;
+        CREATE TABLE IF NOT EXISTS zone_taxi_sketches (
+            pickup_community_area   INT     NOT NULL,
+            dropoff_community_area  INT     NOT NULL,
+            taxi_sketch             BLOB    NOT NULL,
+            PRIMARY KEY (pickup_community_area, dropoff_community_area)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+
     "payment_kpis": """
         DROP TABLE IF EXISTS payment_kpis;
-        CREATE TABLE payment_kpis (
+        CREATE TABLE IF NOT EXISTS payment_kpis (
             trip_date       DATE        NOT NULL,
             payment_type    VARCHAR(32) NOT NULL,
             company         VARCHAR(128) NOT NULL DEFAULT '',
@@ -120,9 +285,69 @@ TABLES = {
             PRIMARY KEY (trip_date, payment_type, company)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """,
+
+    # Viajes por diferencia trip_total - (fare + tips + tolls + extras), en centavos
+    "total_diff_kpis": """
+        DROP TABLE IF EXISTS total_diff_kpis;
+        CREATE TABLE IF NOT EXISTS total_diff_kpis (
+            trip_date       DATE         NOT NULL,
+            company         VARCHAR(128) NOT NULL DEFAULT '',
+            payment_type    VARCHAR(32)  NOT NULL DEFAULT '',
+            diff_cents      INT          NOT NULL,
+            total_trips     INT,
+            PRIMARY KEY (trip_date, company, payment_type, diff_cents)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
 }
 
 
+def create_indexes(cursor, table: str, indexes: dict):
+    # Idempotente: solo agrega los índices que falten (la tabla puede venir de una corrida anterior)
+    cursor.execute(
+        """
+        SELECT DISTINCT index_name FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+        """,
+        (table,),
+    )
+    existing = {row[0] for row in cursor.fetchall()}
+    missing = [name for name in indexes if name not in existing]
+    if missing:
+        # Un solo ALTER: InnoDB arma todos los índices en una pasada sobre la tabla
+        cursor.execute(f"ALTER TABLE {table} " + ", ".join(
+            f"ADD INDEX {name} ({', '.join(indexes[name])})" for name in missing
+        ))
+        print(f"  ✅ Índices creados en {table}: {', '.join(missing)}")
+
+
+def kpi_indexes(table: str) -> dict:
+    # Única fuente para main y swap_shadow: con o sin shadow la tabla termina con los mismos índices
+    return KPI_INDEXES.get(table, {}) if KPI_ENGINE == "sql" else {}
+
+
+def create_shadow(cursor, table: str) -> str:
+    """Crea <table>__new vacía con el DDL de TABLES, sin índices secundarios."""
+    shadow = f"{table}__new"
+    create = [s.strip() for s in TABLES[table].split(";") if s.strip().startswith("CREATE")][0]
+    cursor.execute(f"DROP TABLE IF EXISTS {shadow}")
+    cursor.execute(create.replace(f"CREATE TABLE IF NOT EXISTS {table} (", f"CREATE TABLE {shadow} (", 1))
+    return shadow
+
+
+def swap_shadow(cursor, table: str):
+    """Indexa <table>__new y la pone en lugar de <table> con un RENAME atómico."""
+    shadow = f"{table}__new"
+    create_indexes(cursor, shadow, kpi_indexes(table))
+    cursor.execute("SHOW TABLES LIKE %s", (table,))
+    if cursor.fetchall():
+        # Un único RENAME con ambos pares: los lectores ven la tabla vieja o la nueva, nunca ninguna
+        cursor.execute(f"RENAME TABLE {table} TO {table}__old, {shadow} TO {table}")
+        cursor.execute(f"DROP TABLE {table}__old")
+    else:
+        cursor.execute(f"RENAME TABLE {shadow} TO {table}")
+    print(f"  🔁 {table} reemplazada por {shadow}")
+
+
 def main():
     print("=" * 60)
     print("WindyCity Cabs — Schema MySQL")
@@ -134,10 +359,21 @@ def main():
     for table_name, ddl in TABLES.items():
         # Ejecutar cada statement por separado (DROP + CREATE para KPI tables)
         statements = [s.strip() for s in ddl.strip().split(";") if s.strip()]
+        if LOAD_MODE == "incremental" or KPI_SHADOW:
+            # Los KPI ya cargados son la base que el modo incremental actualiza; en modo
+            # shadow siguen visibles hasta que la carga los reemplaza con RENAME
+            statements = [s for s in statements if not s.startswith("DROP")]
         for stmt in statements:
             cursor.execute(stmt)
+        create_indexes(cursor, table_name, kpi_indexes(table_name))
         print(f"  ✅ Tabla creada/verificada: {table_name}")
 
+    if FACT_LAYOUT == "partitioned":
+        add_month_partitions(cursor)
+        create_indexes(cursor, "fact_trips", FACT_LAYOUT_INDEXES)
+    if KPI_ENGINE == "sql":
+        create_indexes(cursor, "fact_trips", FACT_INDEXES)
+
     conn.commit()
     cursor.close()
     conn.close()
@@ -1,9 +1,13 @@
 import os
 import csv
+import json
+from contextlib import ExitStack
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime
 
 import mysql.connector
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,29 +22,248 @@ DB_CONFIG = {
 }
 
 EXPORT_DIR = Path("exports")
+# Filas por fetchmany: la memoria del export queda acotada a un lote, sea cual sea la tabla
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 10_000))
+# 1: exporta también fact_trips (millones de filas; solo viable en streaming)
+EXPORT_FACT_TRIPS = os.getenv("EXPORT_FACT_TRIPS", "0") == "1"
+# Formatos de salida por tabla: csv (Looker Studio / Sheets), parquet y arrow (Arrow IPC),
+# estos dos con los tipos de MySQL (DATE, DECIMAL, enteros angostos)
+EXPORT_FORMATS = [f.strip() for f in os.getenv("EXPORT_FORMATS", "csv").split(",") if f.strip()]
+# Compresión de parquet / arrow: zstd | none
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "zstd")
+COLUMNAR_FORMATS = ["parquet", "arrow"]
+# Filas por row group de parquet (se juntan varios lotes de fetchmany)
+PARQUET_ROW_GROUP_ROWS = 100_000
 
-QUERIES = {
-    "daily_kpis": "SELECT * FROM daily_kpis ORDER BY trip_date ASC",
-    "hourly_kpis": "SELECT * FROM hourly_kpis ORDER BY trip_date ASC, trip_hour ASC",
-    "zone_kpis": "SELECT * FROM zone_kpis ORDER BY total_trips DESC",
-    "zone_coords": "SELECT * FROM zone_coords ORDER BY community_area ASC",
-    "payment_kpis": "SELECT * FROM payment_kpis ORDER BY trip_date ASC, payment_type ASC",
+# Tipo Arrow por DATA_TYPE de INFORMATION_SCHEMA (DECIMAL se arma con su precisión y escala)
+ARROW_TYPES = {
+    "tinyint": pa.int8(), "smallint": pa.int16(), "int": pa.int32(), "bigint": pa.int64(),
+    "float": pa.float32(), "double": pa.float64(),
+    "date": pa.date32(), "datetime": pa.timestamp("s"), "timestamp": pa.timestamp("s"),
+    "char": pa.string(), "varchar": pa.string(), "text": pa.string(),
+    "binary": pa.binary(), "varbinary": pa.binary(), "blob": pa.binary(),
 }
 
+# full: reescribe todos los CSV | incremental: saltea tablas sin cambios y parchea solo
+# la cola de fechas afectadas en las tablas por fecha
+EXPORT_MODE = os.getenv("EXPORT_MODE", "full")
+# Hash por fecha (o por tabla) de lo último exportado
+STATE_FILE = EXPORT_DIR / "export_state.json"
 
-def export_table(cursor, name: str, query: str) -> int:
-    filepath = EXPORT_DIR / f"{name}.csv"
-    cursor.execute(query)
-    rows = cursor.fetchall()
+# Orden de cada CSV. En las tablas por fecha el orden es total (incluye toda la PK), así
+# una cola re-exportada desde una fecha coincide con la que daría el export completo
+ORDER_BY = {
+    "daily_kpis": "trip_date ASC",
+    "hourly_kpis": "trip_date ASC, trip_hour ASC",
+    "zone_kpis": "total_trips DESC",
+    "zone_coords": "community_area ASC",
+    "payment_kpis": "trip_date ASC, payment_type ASC, company ASC",
+}
+DATED_TABLES = ["daily_kpis", "hourly_kpis", "payment_kpis"]
+
+QUERIES = {name: f"SELECT * FROM {name} ORDER BY {order}" for name, order in ORDER_BY.items()}
+
+
+FACT_QUERY = """
+    SELECT trip_id, taxi_id, trip_start_timestamp, trip_end_timestamp,
+           trip_seconds, trip_miles, pickup_community_area, dropoff_community_area,
+           fare, tips, tolls, extras, trip_total, payment_type, company,
+           pickup_centroid_latitude, pickup_centroid_longitude,
+           dropoff_centroid_latitude, dropoff_centroid_longitude,
+           trip_date, trip_hour, trip_weekday, revenue_per_mile, tip_rate, is_outlier
+    FROM fact_trips
+"""
+
+
+def open_stream(conn, query: str, params: tuple = ()) -> tuple:
+    """Columnas del resultado y un generador de lotes de fetchmany."""
+    # Cursor sin buffer: MySQL envía el resultado a medida que se lee, en vez de
+    # materializarlo entero del lado del cliente como fetchall
+    cursor = conn.cursor(buffered=False)
+    cursor.execute(query, params or None)
     columns = [desc[0] for desc in cursor.description]
 
-    with open(filepath, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
+    def batches():
+        while rows := cursor.fetchmany(EXPORT_BATCH_ROWS):
+            yield rows
+        cursor.close()
+
+    return columns, batches()
+
+
+def write_rows(conn, f, query: str, params: tuple = (), header: bool = True) -> int:
+    columns, batches = open_stream(conn, query, params)
+    writer = csv.writer(f)
+    if header:
         writer.writerow(columns)
+
+    total = 0
+    for rows in batches:
         writer.writerows(rows)
+        total += len(rows)
+    return total
+
+
+def arrow_schema(conn, name: str) -> dict:
+    """Tipo Arrow de cada columna de la tabla, leído de INFORMATION_SCHEMA."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT column_name, data_type, numeric_precision, numeric_scale
+        FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s
+        """,
+        (name,),
+    )
+    types = {}
+    for column, data_type, precision, scale in cursor.fetchall():
+        if data_type == "decimal":
+            types[column] = pa.decimal128(int(precision), int(scale))
+        else:
+            types[column] = ARROW_TYPES.get(data_type, pa.string())
+    cursor.close()
+    return types
+
+
+def columnar_writer(fmt: str, path: Path, schema: pa.Schema):
+    compression = None if EXPORT_COMPRESSION == "none" else EXPORT_COMPRESSION
+    if fmt == "parquet":
+        return pq.ParquetWriter(path, schema, compression=compression or "none")
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    return pa.ipc.new_file(path, schema, options=options)
+
+
+def export_table(conn, name: str, query: str, formats: list = None) -> int:
+    """Exporta el resultado en una sola pasada a todos los formatos pedidos."""
+    formats = formats or EXPORT_FORMATS
+    columnar = [fmt for fmt in formats if fmt in COLUMNAR_FORMATS]
+    types = arrow_schema(conn, name) if columnar else {}
+    columns, batches = open_stream(conn, query)
+    schema = pa.schema([pa.field(col, types.get(col, pa.string())) for col in columns])
+
+    total = 0
+    with ExitStack() as stack:
+        csv_writer = None
+        if "csv" in formats:
+            f = stack.enter_context(open(EXPORT_DIR / f"{name}.csv", "w", newline="", encoding="utf-8"))
+            csv_writer = csv.writer(f)
+            csv_writer.writerow(columns)
+        writers = [
+            stack.enter_context(columnar_writer(fmt, EXPORT_DIR / f"{name}.{fmt}", schema)) for fmt in columnar
+        ]
+
+        pending = []
+
+        def flush():
+            if pending:
+                table = pa.Table.from_batches(pending, schema=schema)
+                for writer in writers:
+                    writer.write_table(table)
+                pending.clear()
+
+        for rows in batches:
+            if csv_writer:
+                csv_writer.writerows(rows)
+            if writers:
+                # Lote tipado: columnas armadas con el tipo de MySQL, sin pasar por pandas
+                arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                pending.append(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                if sum(batch.num_rows for batch in pending) >= PARQUET_ROW_GROUP_ROWS:
+                    flush()
+            total += len(rows)
+        flush()
+
+    for fmt in formats:
+        print(f"  ✅ {name}.{fmt} → {total:,} filas → {EXPORT_DIR / f'{name}.{fmt}'}")
+    return total
 
-    print(f"  ✅ {name}.csv → {len(rows):,} filas → {filepath}")
-    return len(rows)
+
+def load_state() -> dict:
+    if STATE_FILE.exists():
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state: dict):
+    tmp = STATE_FILE.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, STATE_FILE)
+
+
+def table_columns(conn, name: str) -> list:
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT * FROM {name} LIMIT 0")
+    columns = [desc[0] for desc in cursor.description]
+    cursor.fetchall()
+    cursor.close()
+    return columns
+
+
+def content_hashes(conn, name: str, columns: list) -> dict:
+    """Conteo + XOR de hashes de fila, por fecha o de toda la tabla ("*"), calculado en MySQL.
+
+    El XOR no depende del orden de las filas y solo viaja una fila por fecha.
+    """
+    # \N distingue NULL de la cadena vacía (CONCAT_WS saltearía los NULL)
+    row = "CONCAT_WS(0x1f, " + ", ".join(f"COALESCE({col}, '\\\\N')" for col in columns) + ")"
+    row_hash = f"CAST(CONV(LEFT(SHA1({row}), 16), 16, 10) AS UNSIGNED)"
+    key = "trip_date" if name in DATED_TABLES else "'*'"
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {key}, COUNT(*), BIT_XOR({row_hash}) FROM {name} GROUP BY 1")
+    hashes = {str(k): f"{count}:{digest:016x}" for k, count, digest in cursor.fetchall()}
+    cursor.close()
+    return hashes
+
+
+def patch_dated_table(conn, name: str, since: date) -> int:
+    """Reemplaza la cola del CSV desde la primera fila con trip_date >= since."""
+    filepath = EXPORT_DIR / f"{name}.csv"
+    prefix = since.isoformat().encode()
+    with open(filepath, "r+b") as f:
+        f.readline()  # encabezado
+        offset = f.tell()
+        # Las filas están ordenadas por trip_date, que va primero y con formato YYYY-MM-DD
+        for line in iter(f.readline, b""):
+            if line[:10] >= prefix:
+                break
+            offset = f.tell()
+        f.truncate(offset)
+
+    query = f"SELECT * FROM {name} WHERE trip_date >= %s ORDER BY {ORDER_BY[name]}"
+    with open(filepath, "a", newline="", encoding="utf-8") as f:
+        return write_rows(conn, f, query, (since,), header=False)
+
+
+def export_incremental(conn, name: str, query: str, state: dict) -> int:
+    columns = table_columns(conn, name)
+    hashes = content_hashes(conn, name, columns)
+    previous = state.get(name)
+
+    outputs = [EXPORT_DIR / f"{name}.{fmt}" for fmt in EXPORT_FORMATS]
+    if previous and previous["columns"] == columns and previous.get("formats") == EXPORT_FORMATS \
+            and all(path.exists() for path in outputs):
+        if previous["hashes"] == hashes:
+            print(f"  ⏭️  {name} sin cambios")
+            return 0
+        if name in DATED_TABLES and "csv" in EXPORT_FORMATS:
+            # Fechas nuevas, modificadas o borradas: se reescribe desde la más antigua
+            changed = {d for d in hashes.keys() | previous["hashes"].keys()
+                       if hashes.get(d) != previous["hashes"].get(d)}
+            since = date.fromisoformat(min(changed))
+            total = patch_dated_table(conn, name, since)
+            print(f"  🩹 {name}.csv → {len(changed)} fechas cambiadas, {total:,} filas reescritas desde {since}")
+            # Parquet / Arrow no se pueden parchear en el lugar: se reescriben completos
+            columnar = [fmt for fmt in EXPORT_FORMATS if fmt in COLUMNAR_FORMATS]
+            if columnar:
+                export_table(conn, name, query, columnar)
+            state[name] = {"columns": columns, "formats": EXPORT_FORMATS, "hashes": hashes}
+            return total
+
+    total = export_table(conn, name, query)
+    state[name] = {"columns": columns, "formats": EXPORT_FORMATS, "hashes": hashes}
+    return total
 
 
 def main():
@@ -52,13 +275,24 @@ def main():
     EXPORT_DIR.mkdir(parents=True, exist_ok=True)
 
     conn = mysql.connector.connect(**DB_CONFIG)
-    cursor = conn.cursor()
 
+    queries = {**QUERIES, "fact_trips": FACT_QUERY} if EXPORT_FACT_TRIPS else QUERIES
     total_rows = 0
-    for name, query in QUERIES.items():
-        total_rows += export_table(cursor, name, query)
+    if EXPORT_MODE == "incremental":
+        state = load_state()
+        for name, query in queries.items():
+            if name in ORDER_BY:
+                total_rows += export_incremental(conn, name, query, state)
+            else:
+                total_rows += export_table(conn, name, query)
+            # El estado se guarda tabla por tabla: un corte deja lo ya exportado registrado
+            save_state(state)
+    else:
+        for name, query in queries.items():
+            total_rows += export_table(conn, name, query)
+        # Un export completo invalida los hashes previos
+        STATE_FILE.unlink(missing_ok=True)
 
-    cursor.close()
     conn.close()
 
     elapsed = (datetime.now() - start).seconds
@@ -1,10 +1,20 @@
 import requests
 import json
 import os
-from datetime import datetime
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from pathlib import Path
+
+import pyarrow.compute as pc
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ingestion.raw_format import EXTENSIONS, RAW_FORMAT, iter_json_array, read_raw_page, write_records
+
 load_dotenv()
 
 API_BASE_URL = os.getenv("API_BASE_URL")
@@ -12,66 +22,350 @@ PAGE_SIZE = 50_000
 START_DATE = "2025-12-03T00:00:00"
 END_DATE = "2026-01-31T23:59:59"
 OUTPUT_DIR = Path("data/raw")
+INCREMENTAL_DIR = OUTPUT_DIR / "incremental"
+MANIFEST_NAME = "manifest.json"
+WATERMARK_FILE = Path("ingestion/watermark.json")
+
+# offset: páginas por $offset (paralelizable) | keyset: cursor (trip_start_timestamp, trip_id)
+PAGINATION = os.getenv("INGESTION_PAGINATION", "offset")
+
+# full: ventana fija START_DATE → END_DATE | incremental: desde watermark.json
+MODE = os.getenv("INGESTION_MODE", "full")
+# Días hacia atrás del watermark que se vuelven a pedir: la fuente publica viajes con un lag de
+# ~2 semanas, así que un lookback menor pierde las correcciones tardías
+LOOKBACK_DAYS = int(os.getenv("INGESTION_LOOKBACK_DAYS", 14))
+
+# Concurrencia y reintentos (1 worker = modo secuencial)
+WORKERS = int(os.getenv("INGESTION_WORKERS", 4))
+MAX_RETRIES = int(os.getenv("INGESTION_MAX_RETRIES", 5))
+BACKOFF_SECONDS = float(os.getenv("INGESTION_BACKOFF_SECONDS", 2))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+STREAM_CHUNK_BYTES = 1 << 16
+
+
+def build_session(pool_size: int) -> requests.Session:
+    # Una sola sesión con pool de conexiones keep-alive compartido entre workers
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def full_window() -> dict:
+    return {"start": START_DATE, "end": END_DATE, "page_size": PAGE_SIZE, "pagination": PAGINATION}
 
-def fetch_page(offset: int) -> list:
+
+def incremental_window(watermark: dict) -> dict:
+    if LOOKBACK_DAYS == 0 and PAGINATION == "keyset" and watermark.get("cursor"):
+        # Sin lookback no hay nada que volver a pedir: keyset parte justo después de la última fila vista
+        cursor = watermark["cursor"]
+        return {"start": cursor["trip_start_timestamp"][:19], "end": None, "page_size": PAGE_SIZE,
+                "pagination": PAGINATION, "after": cursor}
+    last = datetime.fromisoformat(watermark["last_trip_start_timestamp"][:19])
+    start = (last - timedelta(days=LOOKBACK_DAYS)).replace(hour=0, minute=0, second=0)
+    # Sin límite superior: se trae todo lo publicado desde el inicio del lookback
+    return {"start": start.strftime("%Y-%m-%dT%H:%M:%S"), "end": None, "page_size": PAGE_SIZE, "pagination": PAGINATION}
+
+
+def window_filter(window: dict) -> str:
+    where = f"trip_start_timestamp >= '{window['start']}'"
+    if window["end"]:
+        where += f" AND trip_start_timestamp <= '{window['end']}'"
+    return where
+
+
+def fetch_page(offset: int, session=None, window: dict = None) -> list:
     params = {
-        "$where": f"trip_start_timestamp >= '{START_DATE}' AND trip_start_timestamp <= '{END_DATE}'",
+        "$where": window_filter(window or full_window()),
         "$limit": PAGE_SIZE,
         "$offset": offset,
-        "$order": "trip_start_timestamp ASC"
+        # trip_id desempata timestamps repetidos: el orden entre páginas es estable
+        "$order": "trip_start_timestamp ASC, trip_id ASC"
+    }
+    return get_records(params, session)
+
+
+def fetch_page_after(cursor, session=None, window: dict = None) -> list:
+    # Keyset: el servidor salta directo al cursor vía índice, sin recorrer $offset filas
+    where = window_filter(window or full_window())
+    if cursor:
+        ts, trip_id = cursor["trip_start_timestamp"], cursor["trip_id"]
+        where += (
+            f" AND (trip_start_timestamp > '{ts}'"
+            f" OR (trip_start_timestamp = '{ts}' AND trip_id > '{trip_id}'))"
+        )
+    params = {
+        "$where": where,
+        "$limit": PAGE_SIZE,
+        "$order": "trip_start_timestamp ASC, trip_id ASC"
     }
-    response = requests.get(API_BASE_URL, params=params, timeout=60)
+    return get_records(params, session)
+
+
+def get_records(params: dict, session=None):
+    if RAW_FORMAT == "json":
+        response = (session or requests).get(API_BASE_URL, params=params, timeout=60)
+        response.raise_for_status()
+        return response.json()
+    # Formatos streaming: el body se parsea a medida que llega, fila a fila
+    response = (session or requests).get(API_BASE_URL, params=params, timeout=60, stream=True)
     response.raise_for_status()
-    return response.json()
+    return iter_json_array(response.iter_content(chunk_size=STREAM_CHUNK_BYTES))
 
-def save_page(data: list, page_num: int):
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    filepath = OUTPUT_DIR / f"page_{page_num:04d}.json"
-    with open(filepath, "w") as f:
-        json.dump(data, f)
-    return filepath
 
-def main():
-    print("=" * 60)
-    print("WindyCity Cabs — Ingesta inicial")
-    print(f"Ventana: {START_DATE} → {END_DATE}")
-    print(f"Page size: {PAGE_SIZE:,}")
-    print("=" * 60)
+def with_retry(fn, *args, **kwargs):
+    # Reintenta errores de red y 429/5xx con backoff exponencial; el resto se propaga
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except requests.RequestException as e:
+            status = e.response.status_code if e.response is not None else None
+            retryable = status is None or status in RETRY_STATUS
+            if not retryable or attempt == MAX_RETRIES:
+                raise
+            wait = BACKOFF_SECONDS * 2 ** attempt
+            print(f"\n⚠️  {e.__class__.__name__} ({status or 'red'}), reintento {attempt + 1}/{MAX_RETRIES} en {wait:.0f}s")
+            time.sleep(wait)
 
-    total_records = 0
-    page_num = 1
-    offset = 0
-    start_time = datetime.now()
 
-    while True:
-        print(f"\n📦 Página {page_num} | offset={offset:,}", end=" ... ")
+def count_records(session=None, window: dict = None) -> int:
+    params = {"$select": "count(*)", "$where": window_filter(window or full_window())}
+    response = (session or requests).get(API_BASE_URL, params=params, timeout=60)
+    response.raise_for_status()
+    row = response.json()[0]
+    return int(next(iter(row.values())))
 
-        data = fetch_page(offset)
-        records_in_page = len(data)
 
-        if records_in_page == 0:
-            print("sin datos, fin de ingesta.")
-            break
+def save_page(records, page_num: int, output_dir: Path = OUTPUT_DIR) -> tuple:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return write_records(records, output_dir / f"page_{page_num:04d}")
+
+
+def load_manifest(output_dir: Path = OUTPUT_DIR, window: dict = None) -> dict:
+    # Manifest de páginas terminadas: permite retomar una ingesta interrumpida
+    window = window or full_window()
+    filepath = output_dir / MANIFEST_NAME
+    if filepath.exists():
+        with open(filepath) as f:
+            manifest = json.load(f)
+        if manifest.get("window") == window:
+            return manifest
+        print("⚠️  Manifest de otra ventana/page size, se descarta y se parte de cero")
+    return {"window": window, "pages": {}}
+
+
+def save_manifest(manifest: dict, output_dir: Path = OUTPUT_DIR):
+    # Escritura atómica: un corte a mitad de escritura no corrompe el manifest
+    output_dir.mkdir(parents=True, exist_ok=True)
+    filepath = output_dir / MANIFEST_NAME
+    tmp = filepath.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, filepath)
+
+
+def load_watermark() -> dict:
+    if WATERMARK_FILE.exists():
+        with open(WATERMARK_FILE) as f:
+            return json.load(f)
+    return {}
+
 
-        filepath = save_page(data, page_num)
-        total_records += records_in_page
-        elapsed = (datetime.now() - start_time).seconds
+def save_watermark(watermark: dict):
+    WATERMARK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = WATERMARK_FILE.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(tmp, WATERMARK_FILE)
 
-        print(f"✅ {records_in_page:,} registros → {filepath.name} | total acumulado: {total_records:,} | {elapsed}s")
 
-        if records_in_page < PAGE_SIZE:
+def fetch_to_file(fetch, position, page_num: int, session, output_dir: Path, window: dict) -> dict:
+    # El reintento cubre request + escritura: un stream cortado a mitad se vuelve a pedir entero
+    def attempt():
+        return save_page(fetch(position, session=session, window=window), page_num, output_dir)
+
+    filepath, records, last = with_retry(attempt)
+    cursor = {"trip_start_timestamp": last["trip_start_timestamp"], "trip_id": last["trip_id"]} if last else None
+    return {"cursor": cursor, "records": records, "file": filepath.name if filepath else None}
+
+
+def download_page(session, page_num: int, output_dir: Path = OUTPUT_DIR, window: dict = None) -> dict:
+    offset = (page_num - 1) * PAGE_SIZE
+    return {"offset": offset, **fetch_to_file(fetch_page, offset, page_num, session, output_dir, window)}
+
+
+def record_page(manifest: dict, page_num: int, entry: dict, start_time: datetime, output_dir: Path = OUTPUT_DIR):
+    manifest["pages"][str(page_num)] = entry
+    save_manifest(manifest, output_dir)
+    total = sum(p["records"] for p in manifest["pages"].values())
+    elapsed = (datetime.now() - start_time).seconds
+    position = f"offset={entry['offset']:,}" if "offset" in entry else f"hasta {entry['cursor']['trip_start_timestamp']}"
+    print(f"✅ Página {page_num} | {position} | {entry['records']:,} registros → {entry['file']} | total acumulado: {total:,} | {elapsed}s")
+
+
+def ingest_sequential(session, manifest: dict, start_time: datetime, output_dir: Path = OUTPUT_DIR):
+    page_num = 1
+    while True:
+        done = manifest["pages"].get(str(page_num))
+        if done is None:
+            print(f"\n📦 Página {page_num} | offset={(page_num - 1) * PAGE_SIZE:,} ...")
+            done = download_page(session, page_num, output_dir, manifest["window"])
+            if done["records"] == 0:
+                print("sin datos, fin de ingesta.")
+                break
+            record_page(manifest, page_num, done, start_time, output_dir)
+
+        if done["records"] < PAGE_SIZE:
             print("\n🏁 Última página alcanzada.")
             break
+        page_num += 1
+
+
+def ingest_keyset(session, manifest: dict, start_time: datetime, output_dir: Path = OUTPUT_DIR) -> dict:
+    pages = manifest["pages"]
+    page_num = len(pages) + 1
+    last = pages.get(str(len(pages)))
+    # Batch nuevo: desde el cursor del watermark si la ventana lo trae (incremental sin lookback)
+    cursor = last["cursor"] if last else manifest["window"].get("after")
 
-        offset += PAGE_SIZE
+    while last is None or last["records"] == PAGE_SIZE:
+        print(f"\n📦 Página {page_num} | cursor={cursor['trip_start_timestamp'] if cursor else 'inicio'} ...")
+        entry = fetch_to_file(fetch_page_after, cursor, page_num, session, output_dir, manifest["window"])
+        if entry["records"] == 0:
+            print("sin datos, fin de ingesta.")
+            break
+        last, cursor = entry, entry["cursor"]
+        record_page(manifest, page_num, last, start_time, output_dir)
         page_num += 1
+    else:
+        print("\n🏁 Última página alcanzada.")
+
+    return cursor
+
+
+def ingest_concurrent(session, manifest: dict, start_time: datetime, workers: int, output_dir: Path = OUTPUT_DIR):
+    total = with_retry(count_records, session=session, window=manifest["window"])
+    n_pages = -(-total // PAGE_SIZE)
+    pending = [p for p in range(1, n_pages + 1) if str(p) not in manifest["pages"]]
+    print(f"\n🔢 {total:,} registros en la ventana → {n_pages} páginas, {len(pending)} pendientes, {workers} workers")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(download_page, session, p, output_dir, manifest["window"]): p for p in pending}
+        # El manifest solo se actualiza desde este hilo, a medida que terminan las páginas
+        for future in as_completed(futures):
+            record_page(manifest, futures[future], future.result(), start_time, output_dir)
+
+    # Si la fuente creció desde el count(*), el barrido secuencial completa la cola
+    ingest_sequential(session, manifest, start_time, output_dir)
+
+
+def batch_dir(window: dict) -> Path:
+    # Un batch incremental inconcluso con la misma ventana se retoma en vez de crear otro
+    for existing in sorted(INCREMENTAL_DIR.glob("batch_*"), reverse=True):
+        manifest_file = existing / MANIFEST_NAME
+        if manifest_file.exists():
+            with open(manifest_file) as f:
+                manifest = json.load(f)
+            if not manifest.get("completed") and manifest.get("window") == window:
+                return existing
+    return INCREMENTAL_DIR / f"batch_{datetime.now():%Y%m%dT%H%M%S}"
+
+
+def prune_superseded(window: dict, output_dir: Path) -> int:
+    """Quita de las páginas anteriores las filas que el batch recién completado volvió a pedir."""
+    # El batch trae todo lo publicado desde window["start"]: las copias viejas de esas filas
+    # sobran. Cada fecha queda en un solo batch y el raw no crece con cada lookback
+    pruned = 0
+    pages = sorted(OUTPUT_DIR.glob("page_*")) + sorted(INCREMENTAL_DIR.glob("batch_*/page_*"))
+    for page in pages:
+        if page.parent == output_dir:
+            continue
+        table = read_raw_page(page)
+        # Un timestamp nulo no cae en ninguna ventana: la fila se conserva
+        keep = pc.fill_null(pc.less(table["trip_start_timestamp"], window["start"]), True)
+        kept = table.filter(keep)
+        if kept.num_rows == table.num_rows:
+            continue
+        pruned += table.num_rows - kept.num_rows
+        fmt = next(fmt for fmt, ext in EXTENSIONS.items() if page.name.endswith(ext))
+        if kept.num_rows:
+            write_records(kept.to_pylist(), page.with_name(page.name[: -len(EXTENSIONS[fmt])]), fmt)
+        else:
+            page.unlink()
+    return pruned
+
+
+def main():
+    watermark = load_watermark()
+    mode = MODE
+    if mode == "incremental" and "last_trip_start_timestamp" not in watermark:
+        print("⚠️  No hay watermark previo, se ejecuta la carga full")
+        mode = "full"
+
+    if mode == "incremental":
+        window = incremental_window(watermark)
+        output_dir = batch_dir(window)
+    else:
+        window = full_window()
+        output_dir = OUTPUT_DIR
+
+    print("=" * 60)
+    print(f"WindyCity Cabs — Ingesta {'incremental' if mode == 'incremental' else 'inicial'}")
+    if mode == "incremental":
+        print(f"Watermark: {watermark['last_trip_start_timestamp']} | lookback: {LOOKBACK_DAYS} días")
+    print(f"Ventana: {window['start']} → {window['end'] or 'último dato publicado'}")
+    print(f"Page size: {PAGE_SIZE:,} | Paginación: {PAGINATION} | Workers: {WORKERS} | Formato raw: {RAW_FORMAT}")
+    print("=" * 60)
+
+    start_time = datetime.now()
+    manifest = load_manifest(output_dir, window)
+    if manifest["pages"]:
+        print(f"\n♻️  Retomando: {len(manifest['pages'])} páginas ya descargadas según {MANIFEST_NAME}")
+
+    session = build_session(WORKERS)
+    try:
+        if PAGINATION == "keyset":
+            ingest_keyset(session, manifest, start_time, output_dir)
+        elif WORKERS > 1:
+            ingest_concurrent(session, manifest, start_time, WORKERS, output_dir)
+        else:
+            ingest_sequential(session, manifest, start_time, output_dir)
+    finally:
+        session.close()
+
+    manifest["completed"] = True
+    save_manifest(manifest, output_dir)
+
+    # Con lookback, el batch se solapa con los anteriores. Recién con el batch completo se
+    # recortan las copias viejas (un corte a mitad deja duplicados que staging resuelve)
+    if mode == "incremental" and not window.get("after"):
+        pruned = prune_superseded(window, output_dir)
+        if pruned:
+            print(f"\n🧹 {pruned:,} registros de batches anteriores reemplazados por este batch")
+
+    # Watermark = última fila (trip_start_timestamp, trip_id) vista; nunca retrocede
+    cursors = [p["cursor"] for p in manifest["pages"].values() if p.get("cursor")]
+    if watermark.get("cursor"):
+        cursors.append(watermark["cursor"])
+    if cursors:
+        cursor = max(cursors, key=lambda c: (c["trip_start_timestamp"], c["trip_id"]))
+        save_watermark({
+            "last_trip_start_timestamp": cursor["trip_start_timestamp"],
+            "cursor": cursor,
+            "last_batch": str(output_dir),
+            "updated_at": datetime.now().isoformat(),
+        })
 
+    total_records = sum(p["records"] for p in manifest["pages"].values())
     elapsed_total = (datetime.now() - start_time).seconds
     print("\n" + "=" * 60)
     print(f"✅ Ingesta completa")
     print(f"   Total registros : {total_records:,}")
-    print(f"   Páginas          : {page_num}")
-    print(f"   Archivos en      : {OUTPUT_DIR}/")
+    print(f"   Páginas          : {len(manifest['pages'])}")
+    print(f"   Archivos en      : {output_dir}/")
+    if cursors:
+        print(f"   Watermark        : {cursor['trip_start_timestamp']}")
     print(f"   Tiempo total     : {elapsed_total}s")
     print("=" * 60)
 
@@ -0,0 +1,141 @@
+import codecs
+import gzip
+import json
+import os
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# json: lista completa por página (legacy) | ndjson.gz / ndjson.zst: una fila por línea comprimida
+# parquet: un archivo por página con un único row group
+RAW_FORMAT = os.getenv("RAW_FORMAT", "json")
+EXTENSIONS = {
+    "json": ".json",
+    "ndjson.gz": ".ndjson.gz",
+    "ndjson.zst": ".ndjson.zst",
+    "parquet": ".parquet",
+}
+
+# Campos del dataset tal como llegan de la API: todos string. Los *_centroid_location
+# (GeoJSON) y los campos calculados de Socrata quedan fuera y se ignoran al leer.
+RAW_FIELDS = [
+    "trip_id", "taxi_id", "trip_start_timestamp", "trip_end_timestamp",
+    "trip_seconds", "trip_miles",
+    "pickup_census_tract", "dropoff_census_tract",
+    "pickup_community_area", "dropoff_community_area",
+    "fare", "tips", "tolls", "extras", "trip_total",
+    "payment_type", "company",
+    "pickup_centroid_latitude", "pickup_centroid_longitude",
+    "dropoff_centroid_latitude", "dropoff_centroid_longitude",
+]
+RAW_SCHEMA = pa.schema([(field, pa.string()) for field in RAW_FIELDS])
+
+PARQUET_BATCH_SIZE = 10_000
+
+
+def iter_json_array(chunks):
+    # Parser incremental de un array JSON: emite cada objeto apenas está completo,
+    # sin materializar el body entero ni la lista de dicts
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer, pos = "", 0
+    for chunk in chunks:
+        buffer = buffer[pos:] + text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,[":
+                pos += 1
+            if pos >= len(buffer) or buffer[pos] == "]":
+                break
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # objeto cortado entre chunks: esperar más bytes
+            yield record
+
+    rest = (buffer[pos:] + text.decode(b"", final=True)).strip()
+    if rest not in ("", "]"):
+        raise ValueError(f"JSON incompleto al final del body: {rest[:80]!r}")
+
+
+def _write_json(records, tmp: Path) -> tuple:
+    data = list(records)
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    return len(data), data[-1] if data else None
+
+
+def _write_ndjson(records, stream) -> tuple:
+    count, last = 0, None
+    for record in records:
+        stream.write((json.dumps(record) + "\n").encode("utf-8"))
+        count, last = count + 1, record
+    return count, last
+
+
+def _write_parquet(records, tmp: Path) -> tuple:
+    # Se acumulan record batches Arrow (compactos) y se escribe un row group por página
+    batches, pending, count, last = [], [], 0, None
+    for record in records:
+        pending.append(record)
+        count, last = count + 1, record
+        if len(pending) == PARQUET_BATCH_SIZE:
+            batches.append(pa.RecordBatch.from_pylist(pending, schema=RAW_SCHEMA))
+            pending = []
+    if pending:
+        batches.append(pa.RecordBatch.from_pylist(pending, schema=RAW_SCHEMA))
+    if count:
+        table = pa.Table.from_batches(batches, schema=RAW_SCHEMA)
+        pq.write_table(table, tmp, row_group_size=count, compression="zstd")
+    return count, last
+
+
+def write_records(records, filepath: Path, fmt: str = RAW_FORMAT) -> tuple:
+    """Escribe las filas en `filepath` (sin extensión) y devuelve (archivo, filas, última fila)."""
+    filepath = filepath.with_name(filepath.name + EXTENSIONS[fmt])
+    # Archivo temporal oculto: un corte a mitad de página nunca deja un page_* a medias
+    tmp = filepath.with_name(f".{filepath.name}.tmp")
+    if fmt == "json":
+        count, last = _write_json(records, tmp)
+    elif fmt == "ndjson.gz":
+        with gzip.open(tmp, "wb", compresslevel=6) as f:
+            count, last = _write_ndjson(records, f)
+    elif fmt == "ndjson.zst":
+        with pa.CompressedOutputStream(str(tmp), "zstd") as f:
+            count, last = _write_ndjson(records, f)
+    elif fmt == "parquet":
+        count, last = _write_parquet(records, tmp)
+    else:
+        raise ValueError(f"RAW_FORMAT desconocido: {fmt}")
+
+    if count == 0:
+        tmp.unlink(missing_ok=True)
+        return None, 0, None
+    os.replace(tmp, filepath)
+    return filepath, count, last
+
+
+def read_raw_page(filepath: Path) -> pa.Table:
+    """Lee una página raw en cualquier formato como tabla Arrow con RAW_SCHEMA."""
+    name = filepath.name
+    if name.endswith(".parquet"):
+        table = pq.read_table(filepath)
+    elif name.endswith(".ndjson.gz") or name.endswith(".ndjson.zst"):
+        compression = "gzip" if name.endswith(".gz") else "zstd"
+        options = pa_json.ParseOptions(explicit_schema=RAW_SCHEMA, unexpected_field_behavior="ignore")
+        table = pa_json.read_json(pa.input_stream(str(filepath), compression=compression), parse_options=options)
+    else:
+        with open(filepath) as f:
+            table = pa.Table.from_pylist(json.load(f), schema=RAW_SCHEMA)
+
+    # Campos ausentes en la página se completan como null: el schema es siempre el mismo
+    columns = [
+        table[field].cast(pa.string()) if field in table.column_names else pa.nulls(len(table), pa.string())
+        for field in RAW_FIELDS
+    ]
+    return pa.Table.from_arrays(columns, schema=RAW_SCHEMA)
@@ -1,46 +1,160 @@
-import json
 import os
+import shutil
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ingestion.raw_format import read_raw_page
+from ingestion.staging_reader import LEGACY_STAGING_FILE, PARTITIONING, STAGING_DATASET, STAGING_DIR
+
 load_dotenv()
 
 RAW_DIR = Path("data/raw")
-STAGING_DIR = Path("data/staging")
-STAGING_FILE = STAGING_DIR / "trips.parquet"
+# Row groups chicos dentro de cada día ordenado: min/max de timestamp útiles para podar
+ROW_GROUP_ROWS = 100_000
+
+# full: todo el raw en un DataFrame | streaming: página a página con memoria acotada
+STAGING_MODE = os.getenv("STAGING_MODE", "full")
+# Procesos para parsear y castear páginas raw en paralelo (1 = en el proceso principal)
+STAGING_WORKERS = int(os.getenv("STAGING_WORKERS", os.cpu_count() or 1))
 
 # Campos a descartar (GeoJSON redundante)
 DROP_FIELDS = ["pickup_centroid_location", "dropoff_centroid_location"]
 
 # Mapeo de tipos
-FLOAT_FIELDS = [
-    "trip_miles",
+FLOAT_FIELDS = ["trip_miles"]
+# float32 alcanza (~0.5 m de precisión) y es lo que guarda el FLOAT de MySQL
+COORD_FIELDS = [
     "pickup_centroid_latitude", "pickup_centroid_longitude",
     "dropoff_centroid_latitude", "dropoff_centroid_longitude",
 ]
 DECIMAL_FIELDS = ["fare", "tips", "tolls", "extras", "trip_total"]
-INT_FIELDS = ["trip_seconds", "pickup_community_area", "dropoff_community_area"]
+INT_FIELDS = {"trip_seconds": "Int32", "pickup_community_area": "Int16", "dropoff_community_area": "Int16"}
 DATETIME_FIELDS = ["trip_start_timestamp", "trip_end_timestamp"]
 
-
-def load_raw_pages() -> pd.DataFrame:
-    pages = sorted(RAW_DIR.glob("page_*.json"))
+# Mismo casteo que cast_types, expresado como tipos Arrow para los workers
+ARROW_CASTS = {
+    **{col: pa.float64() for col in FLOAT_FIELDS + COORD_FIELDS + DECIMAL_FIELDS},
+    **{col: pa.int64() for col in INT_FIELDS},
+    **{col: pa.timestamp("ns") for col in DATETIME_FIELDS},
+}
+
+# Strings de baja cardinalidad (miles de taxis, decenas de compañías) → dictionary/categorical
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+# Montos en centavos enteros: exactos y sumables sin error de punto flotante
+CENTS = pa.field("cents", pa.int64(), metadata={"unit": "cents"})
+
+# Schema de salida fijo y compacto: ambos modos escriben exactamente los mismos tipos
+STAGING_SCHEMA = pa.schema([
+    ("trip_id", pa.string()),
+    ("taxi_id", CATEGORY),
+    ("trip_start_timestamp", pa.timestamp("ns")),
+    ("trip_end_timestamp", pa.timestamp("ns")),
+    ("trip_seconds", pa.int32()),
+    ("trip_miles", pa.float64()),
+    ("pickup_census_tract", pa.string()),
+    ("dropoff_census_tract", pa.string()),
+    ("pickup_community_area", pa.int16()),
+    ("dropoff_community_area", pa.int16()),
+    *[CENTS.with_name(col) for col in DECIMAL_FIELDS],
+    ("payment_type", CATEGORY),
+    ("company", CATEGORY),
+    ("pickup_centroid_latitude", pa.float32()),
+    ("pickup_centroid_longitude", pa.float32()),
+    ("dropoff_centroid_latitude", pa.float32()),
+    ("dropoff_centroid_longitude", pa.float32()),
+    ("trip_date", pa.date32()),
+    ("trip_hour", pa.int8()),
+    ("trip_weekday", pa.int8()),
+    ("revenue_per_mile", pa.float64()),
+    ("tip_rate", pa.float64()),
+    ("is_outlier", pa.int8()),
+])
+# Mismo schema con los montos todavía en dólares float, tal como salen de cast_types
+FRAME_SCHEMA = pa.schema([
+    pa.field(f.name, pa.float64()) if f.name in DECIMAL_FIELDS else f for f in STAGING_SCHEMA
+])
+
+
+def raw_page_files() -> list:
+    # Carga full primero y luego los batches incrementales en orden cronológico
+    # page_* cubre todos los formatos raw (json, ndjson.gz, ndjson.zst, parquet)
+    return sorted(RAW_DIR.glob("page_*")) + sorted(RAW_DIR.glob("incremental/batch_*/page_*"))
+
+
+def cast_table(table: pa.Table) -> pa.Table:
+    columns = {}
+    for name in table.column_names:
+        if name in DROP_FIELDS:
+            continue
+        column = table[name]
+        target = ARROW_CASTS.get(name)
+        if target is not None:
+            try:
+                column = pc.cast(column, target)
+            except pa.ArrowInvalid:
+                # Valores no parseables → nulo, igual que errors="coerce" de pandas
+                values = column.to_pandas()
+                if pa.types.is_timestamp(target):
+                    values = pd.to_datetime(values, errors="coerce")
+                else:
+                    values = pd.to_numeric(values, errors="coerce")
+                column = pa.array(values, type=target, from_pandas=True)
+        columns[name] = column
+    return pa.table(columns)
+
+
+def parse_page(page: Path) -> pa.Table:
+    # Corre en un proceso worker: parseo + casteo en Arrow. Se devuelve una tabla Arrow,
+    # que viaja entre procesos como buffers contiguos (sin columnas object de pandas)
+    return cast_table(read_raw_page(page))
+
+
+def iter_parsed_pages(pages: list, workers: int = STAGING_WORKERS):
+    if workers <= 1:
+        for page in pages:
+            yield page, parse_page(page)
+        return
+
+    # Ventana acotada de páginas en vuelo: el orden se respeta y la memoria no crece con el raw
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for page in pages:
+            in_flight.append((page, pool.submit(parse_page, page)))
+            if len(in_flight) >= workers * 2:
+                done, future = in_flight.popleft()
+                yield done, future.result()
+        while in_flight:
+            done, future = in_flight.popleft()
+            yield done, future.result()
+
+
+def load_raw_pages(workers: int = STAGING_WORKERS) -> pd.DataFrame:
+    pages = raw_page_files()
     if not pages:
         raise FileNotFoundError(f"No se encontraron archivos en {RAW_DIR}")
 
-    print(f"📂 Encontrados {len(pages)} archivos raw")
-    frames = []
-    for i, page in enumerate(pages, 1):
-        with open(page) as f:
-            data = json.load(f)
-        frames.append(pd.DataFrame(data))
-        print(f"  ✅ {page.name} → {len(data):,} registros", end="\r")
+    print(f"📂 Encontrados {len(pages)} archivos raw ({workers} workers)")
+    tables = []
+    for page, table in iter_parsed_pages(pages, workers):
+        tables.append(table)
+        print(f"  ✅ {page.relative_to(RAW_DIR)} → {table.num_rows:,} registros", end="\r")
 
     print()
-    df = pd.concat(frames, ignore_index=True)
+    # Concatenar tablas Arrow es casi gratis; la conversión a pandas se hace una sola vez
+    df = pa.concat_tables(tables, promote=True).to_pandas()
     print(f"📦 Total raw: {len(df):,} registros")
     return df
 
@@ -56,15 +170,19 @@ def cast_types(df: pd.DataFrame) -> pd.DataFrame:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors="coerce")
 
+    for col in COORD_FIELDS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float32")
+
     # Castear decimales
     for col in DECIMAL_FIELDS:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors="coerce")
 
     # Castear enteros (nullable)
-    for col in INT_FIELDS:
+    for col, dtype in INT_FIELDS.items():
         if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
 
     # Castear datetimes
     for col in DATETIME_FIELDS:
@@ -74,26 +192,34 @@ def cast_types(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+def round_decimals(values: pd.Series, decimals: int) -> pd.Series:
+    # Series.round escala y redondea (x * 10^d), y en empates casi exactos puede diferir
+    # del round() de Python en el último decimal. Esos pocos casos se resuelven con round().
+    rounded = values.round(decimals)
+    scaled = values * 10 ** decimals
+    ties = ((scaled - np.floor(scaled)) - 0.5).abs() < 1e-6
+    if ties.any():
+        rounded[ties] = [round(v, decimals) for v in values[ties]]
+    return rounded
+
+
+def safe_ratio(numerator: pd.Series, denominator: pd.Series) -> pd.Series:
+    # Cociente columnar a 4 decimales; nulo si el denominador es nulo o <= 0.
+    # Toda métrica derivada se calcula así, sin df.apply fila a fila.
+    return round_decimals((numerator / denominator).where(denominator > 0), 4)
+
+
 def add_derived_fields(df: pd.DataFrame) -> pd.DataFrame:
     df["trip_date"] = df["trip_start_timestamp"].dt.date
-    df["trip_hour"] = df["trip_start_timestamp"].dt.hour
-    df["trip_weekday"] = df["trip_start_timestamp"].dt.dayofweek  # 0=Lunes, 6=Domingo
+    # Int8 nullable: un trip_start_timestamp inválido (NaT) deja hora y día nulos
+    df["trip_hour"] = df["trip_start_timestamp"].dt.hour.astype("Int8")
+    df["trip_weekday"] = df["trip_start_timestamp"].dt.dayofweek.astype("Int8")  # 0=Lunes, 6=Domingo
 
     # revenue_per_mile: evitar división por cero
-    df["revenue_per_mile"] = df.apply(
-        lambda r: round(r["trip_total"] / r["trip_miles"], 4)
-        if pd.notna(r["trip_miles"]) and r["trip_miles"] > 0
-        else None,
-        axis=1,
-    )
+    df["revenue_per_mile"] = safe_ratio(df["trip_total"], df["trip_miles"])
 
     # tip_rate: propina sobre tarifa base
-    df["tip_rate"] = df.apply(
-        lambda r: round(r["tips"] / r["fare"], 4)
-        if pd.notna(r["fare"]) and r["fare"] > 0
-        else None,
-        axis=1,
-    )
+    df["tip_rate"] = safe_ratio(df["tips"], df["fare"])
 
     # is_outlier: reglas heurísticas
     df["is_outlier"] = (
@@ -101,26 +227,129 @@ def add_derived_fields(df: pd.DataFrame) -> pd.DataFrame:
         (df["trip_miles"] > 100) |               # más de 100 millas
         (df["fare"] < 0) |                       # tarifa negativa
         (df["trip_end_timestamp"] < df["trip_start_timestamp"])  # tiempo incoherente
-    ).fillna(False).astype(int)
+    ).fillna(False).astype("int8")
 
     return df
 
 
 def deduplicate(df: pd.DataFrame) -> pd.DataFrame:
     before = len(df)
-    df = df.drop_duplicates(subset=["trip_id"], keep="first")
+    # keep="last": si el lookback incremental re-descarga un viaje, gana la versión más reciente
+    df = df.drop_duplicates(subset=["trip_id"], keep="last")
     after = len(df)
     if before != after:
         print(f"⚠️  Duplicados eliminados: {before - after:,}")
     return df
 
 
-def main():
-    print("=" * 60)
-    print("WindyCity Cabs — Staging")
-    print("=" * 60)
-    start = datetime.now()
+def to_cents(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    # Los montos de la API traen 2 decimales: x * 100 queda a un ulp de un entero
+    return pc.cast(pc.round(pc.multiply(values, 100)), pa.int64())
+
+
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    table = pa.Table.from_pandas(df, schema=FRAME_SCHEMA, preserve_index=False)
+    for col in DECIMAL_FIELDS:
+        i = table.schema.get_field_index(col)
+        table = table.set_column(i, STAGING_SCHEMA.field(col), to_cents(table[col]))
+    return table
+
+
+def hash_trip_ids(trip_ids: pd.Series) -> np.ndarray:
+    # Hash de 64 bits por trip_id: 8 bytes por viaje en vez del string completo
+    return pd.util.hash_pandas_object(trip_ids, index=False).to_numpy()
+
 
+def contains(sorted_keys: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    idx = np.searchsorted(sorted_keys, keys)
+    found = np.zeros(len(keys), dtype=bool)
+    inside = idx < len(sorted_keys)
+    found[inside] = sorted_keys[idx[inside]] == keys[inside]
+    return found
+
+
+def merge_sorted(sorted_keys: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    # Dos corridas ordenadas: el sort estable (timsort) las fusiona en tiempo lineal
+    return np.sort(np.concatenate([sorted_keys, np.sort(keys)]), kind="stable")
+
+
+def write_fragments(table: pa.Table, output_dir: Path, name: str):
+    ds.write_dataset(
+        table, output_dir, format="parquet", partitioning=PARTITIONING,
+        basename_template=f"{name}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def local_dictionaries(table: pa.Table) -> pa.Table:
+    # to_arrow codifica sobre el frame entero: cada partición heredaría el diccionario global
+    # (un taxi nuevo en otro día cambiaría los bytes de todas). Se recodifica con los valores
+    # propios de la partición, en orden de aparición
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            values = table.column(i).cast(pa.string()).combine_chunks()
+            table = table.set_column(i, field, pc.dictionary_encode(values).cast(field.type))
+    return table
+
+
+def compact_partitions(output_dir: Path):
+    # Cada partición termina en un único archivo ordenado por (trip_start_timestamp, trip_id).
+    # Memoria acotada por un día de datos.
+    for partition in sorted(output_dir.glob("trip_date=*")):
+        fragments = sorted(partition.glob("*.parquet"))
+        table = pa.concat_tables([pq.read_table(f) for f in fragments])
+        table = local_dictionaries(table.sort_by([("trip_start_timestamp", "ascending"), ("trip_id", "ascending")]))
+        tmp = partition / ".part-0.tmp"
+        pq.write_table(table, tmp, row_group_size=ROW_GROUP_ROWS, compression="zstd", write_statistics=True)
+        for fragment in fragments:
+            fragment.unlink()
+        os.replace(tmp, partition / "part-0.parquet")
+
+
+def publish_dataset(output_dir: Path):
+    # Swap del directorio completo: los lectores nunca ven un dataset a medio escribir
+    old = STAGING_DIR / ".trips.old"
+    shutil.rmtree(old, ignore_errors=True)
+    if STAGING_DATASET.exists():
+        STAGING_DATASET.rename(old)
+    output_dir.rename(STAGING_DATASET)
+    shutil.rmtree(old, ignore_errors=True)
+    LEGACY_STAGING_FILE.unlink(missing_ok=True)
+
+
+def stage_streaming(output_dir: Path) -> dict:
+    pages = raw_page_files()
+    if not pages:
+        raise FileNotFoundError(f"No se encontraron archivos en {RAW_DIR}")
+    print(f"📂 Encontrados {len(pages)} archivos raw — modo streaming ({STAGING_WORKERS} workers)")
+
+    # Se procesa de la página más nueva a la más vieja: con un seen-set eso equivale
+    # a keep="last" del modo full (gana la versión más reciente de cada trip_id)
+    seen = np.empty(0, dtype=np.uint64)
+    stats = {"rows": 0, "raw_rows": 0, "outliers": 0}
+    for n, (page, table) in enumerate(iter_parsed_pages(list(reversed(pages)))):
+        chunk = table.to_pandas()
+        stats["raw_rows"] += len(chunk)
+        chunk = add_derived_fields(cast_types(chunk))
+        chunk = chunk.drop_duplicates(subset=["trip_id"], keep="last")
+
+        keys = hash_trip_ids(chunk["trip_id"])
+        fresh = ~contains(seen, keys)
+        chunk = chunk[fresh]
+        seen = merge_sorted(seen, keys[fresh])
+
+        write_fragments(to_arrow(chunk), output_dir, f"chunk-{n:05d}")
+        stats["rows"] += len(chunk)
+        stats["outliers"] += int(chunk["is_outlier"].sum())
+        print(f"  ✅ {page.relative_to(RAW_DIR)} → {len(chunk):,} registros nuevos", end="\r")
+
+    print()
+    duplicates = stats["raw_rows"] - stats["rows"]
+    if duplicates:
+        print(f"⚠️  Duplicados eliminados: {duplicates:,}")
+    return stats
+
+
+def stage_full(output_dir: Path) -> dict:
     # 1. Cargar raw
     df = load_raw_pages()
 
@@ -136,23 +365,42 @@ def main():
     print("🔍 Verificando duplicados...")
     df = deduplicate(df)
 
-    # 5. Guardar Parquet
+    # 5. Guardar Parquet particionado por trip_date
+    write_fragments(to_arrow(df), output_dir, "part")
+    return {"rows": len(df), "outliers": int(df["is_outlier"].sum())}
+
+
+def main():
+    print("=" * 60)
+    print(f"WindyCity Cabs — Staging ({STAGING_MODE})")
+    print("=" * 60)
+    start = datetime.now()
+
     STAGING_DIR.mkdir(parents=True, exist_ok=True)
-    df.to_parquet(STAGING_FILE, index=False)
+    output_dir = STAGING_DIR / ".trips.tmp"
+    shutil.rmtree(output_dir, ignore_errors=True)
+    if STAGING_MODE == "streaming":
+        stats = stage_streaming(output_dir)
+    else:
+        stats = stage_full(output_dir)
+
+    print("🗂️  Ordenando particiones por fecha...")
+    compact_partitions(output_dir)
+    publish_dataset(output_dir)
 
     elapsed = (datetime.now() - start).seconds
     print(f"\n✅ Staging completo")
-    print(f"   Registros        : {len(df):,}")
-    print(f"   Columnas         : {len(df.columns)}")
-    print(f"   Outliers flagueados: {df['is_outlier'].sum():,}")
-    print(f"   Archivo          : {STAGING_FILE}")
+    print(f"   Registros        : {stats['rows']:,}")
+    print(f"   Columnas         : {len(STAGING_SCHEMA)}")
+    print(f"   Outliers flagueados: {stats['outliers']:,}")
+    print(f"   Dataset          : {STAGING_DATASET}/ ({len(list(STAGING_DATASET.glob('trip_date=*')))} particiones)")
     print(f"   Tiempo           : {elapsed}s")
     print("=" * 60)
 
     # Preview de tipos resultantes
     print("\n📋 Schema final:")
-    for col, dtype in df.dtypes.items():
-        print(f"   {col:<45} {dtype}")
+    for field in STAGING_SCHEMA:
+        print(f"   {field.name:<45} {field.type}")
 
 
 if __name__ == "__main__":
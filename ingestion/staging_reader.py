@@ -0,0 +1,118 @@
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+STAGING_DIR = Path("data/staging")
+STAGING_DATASET = STAGING_DIR / "trips"
+# Archivo único de versiones anteriores: se sigue leyendo si todavía no hay dataset particionado
+LEGACY_STAGING_FILE = STAGING_DIR / "trips.parquet"
+
+# Dataset Hive: data/staging/trips/trip_date=YYYY-MM-DD/part-0.parquet
+PARTITIONING = ds.partitioning(pa.schema([("trip_date", pa.date32())]), flavor="hive")
+
+
+def staging_dataset() -> ds.Dataset:
+    if STAGING_DATASET.exists():
+        return ds.dataset(STAGING_DATASET, format="parquet", partitioning=PARTITIONING)
+    if LEGACY_STAGING_FILE.exists():
+        return ds.dataset(LEGACY_STAGING_FILE, format="parquet")
+    raise FileNotFoundError(f"No se encontró {STAGING_DATASET}. Ejecuta staging.py primero.")
+
+
+def date_filter(start_date: date = None, end_date: date = None):
+    # Filtro sobre la columna de partición: los directorios fuera de rango ni se abren
+    expression = None
+    if start_date is not None:
+        expression = ds.field("trip_date") >= start_date
+    if end_date is not None:
+        upper = ds.field("trip_date") <= end_date
+        expression = upper if expression is None else expression & upper
+    return expression
+
+
+def _columns(dataset: ds.Dataset, columns: list = None) -> list:
+    if columns is not None:
+        return columns
+    names = dataset.schema.names
+    # El dataset agrega trip_date al final; se devuelve en su posición original
+    if "trip_date" in names and "trip_hour" in names:
+        names.remove("trip_date")
+        names.insert(names.index("trip_hour"), "trip_date")
+    return names
+
+
+def to_frame(table, cents: bool = False) -> pd.DataFrame:
+    # Montos guardados en centavos (metadata unit=cents): por defecto vuelven como dólares float64
+    money = [f.name for f in table.schema if f.metadata and f.metadata.get(b"unit") == b"cents"]
+    if not cents:
+        for col in money:
+            i = table.schema.get_field_index(col)
+            dollars = pc.divide(pc.cast(table[col], pa.float64()), 100.0)
+            table = table.set_column(i, pa.field(col, pa.float64()), dollars)
+    df = table.to_pandas()
+    if cents:
+        for col in money:
+            df[col] = df[col].astype("Int64")
+    return df
+
+
+def read_staging(start_date: date = None, end_date: date = None, columns: list = None,
+                 cents: bool = False) -> pd.DataFrame:
+    """Lee staging podando particiones por rango de fechas y columnas no pedidas.
+
+    Con cents=True los montos se devuelven como Int64 en centavos.
+    """
+    dataset = staging_dataset()
+    table = dataset.to_table(columns=_columns(dataset, columns), filter=date_filter(start_date, end_date))
+    return to_frame(table, cents)
+
+
+def iter_staging_batches(start_date: date = None, end_date: date = None, columns: list = None,
+                         batch_size: int = 250_000, cents: bool = False):
+    """Igual que read_staging pero por lotes de a lo sumo `batch_size` filas."""
+    dataset = staging_dataset()
+    scanner = dataset.scanner(
+        columns=_columns(dataset, columns), filter=date_filter(start_date, end_date), batch_size=batch_size
+    )
+    # Cada partición (un día) trae lotes chicos: se juntan hasta batch_size filas para que el
+    # costo fijo por lote de pandas no domine. Los diccionarios distintos por partición se
+    # unifican en to_frame
+    pending, rows = [], 0
+    for batch in scanner.to_batches():
+        if not batch.num_rows:
+            continue
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= batch_size:
+            table = pa.Table.from_batches(pending)
+            yield to_frame(table.slice(0, batch_size), cents)
+            pending, rows = table.slice(batch_size).to_batches(), rows - batch_size
+    if pending:
+        yield to_frame(pa.Table.from_batches(pending), cents)
+
+
+def iter_partition_batches(partition: Path, columns: list = None, batch_size: int = 250_000,
+                           cents: bool = False):
+    """Lotes de una sola partición del dataset, incluida la de trip_date nulo."""
+    # partition_base_dir: trip_date se sigue leyendo del nombre del directorio
+    dataset = ds.dataset(partition, format="parquet", partitioning=PARTITIONING, partition_base_dir=str(partition.parent))
+    scanner = dataset.scanner(columns=columns, batch_size=batch_size)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield to_frame(pa.Table.from_batches([batch]), cents)
+
+
+def staging_dates() -> list:
+    """Fechas con partición en staging, en orden."""
+    if not STAGING_DATASET.exists():
+        return sorted(read_staging(columns=["trip_date"])["trip_date"].dropna().unique())
+    dates = []
+    for partition in STAGING_DATASET.glob("trip_date=*"):
+        value = partition.name.split("=", 1)[1]
+        if value != "__HIVE_DEFAULT_PARTITION__":
+            dates.append(date.fromisoformat(value))
+    return sorted(dates)
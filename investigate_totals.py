@@ -1,14 +1,21 @@
-import pandas as pd
+import sys
 
-df = pd.read_parquet('data/staging/trips.parquet')
-df['calculated'] = df['fare'] + df['tips'] + df['tolls'] + df['extras'] + 0.50
-df['diff'] = (df['trip_total'] - df['calculated']).abs()
+from quality import totals
 
-inconsistent = df[df['diff'] > 0.10]
-print(f"Total inconsistentes con +$0.50: {len(inconsistent):,}")
-print(f"\nDistribución de diffs:")
-print(inconsistent['diff'].round(2).value_counts().head(10))
+# Surcharge a evaluar, en centavos: python investigate_totals.py [centavos] (por defecto 50)
+surcharge = int(sys.argv[1]) if len(sys.argv) > 1 else totals.SURCHARGE_CENTS
 
-# Ver si hay viajes donde la diff ahora es -0.50 (sobrecompensamos)
-over = df[df['trip_total'] - df['calculated'] < -0.10]
-print(f"\nViajes donde sumamos $0.50 de más: {len(over):,}")
\ No newline at end of file
+# Una pasada por lotes sobre staging; cada hipótesis se evalúa después sobre el histograma
+hist = totals.staging_histogram()
+
+result = totals.hypothesis(hist, surcharge).iloc[0]
+print(f"Total inconsistentes con +${surcharge / 100:.2f}: {result['total_trips'] - result['explained']:,}")
+print(f"\nDistribución de diffs (centavos):")
+print(totals.top_diffs(hist))
+
+# Ver si hay viajes donde la diff es menor al surcharge (sobrecompensamos)
+print(f"\nViajes donde sumamos ${surcharge / 100:.2f} de más: {result['over_surcharge']:,}")
+
+for key in ["payment_type", "company", "trip_date"]:
+    print(f"\nPor {key}:")
+    print(totals.hypothesis(hist, surcharge, by=[key]).head(10))
@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import hashlib
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+
+import mysql.connector
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT))
+
+from db.kpis import KPI_TABLES
+from db.schema import DB_CONFIG, TABLES
+from exports.export import EXPORT_DIR, EXPORT_FORMATS, QUERIES
+from ingestion.staging_reader import STAGING_DATASET
+
+# Huella de entradas de cada etapa en la última corrida exitosa
+STATE_FILE = Path("data/pipeline_state.json")
+# Etapas a correr aunque sus entradas no hayan cambiado: "all" o lista separada por comas
+PIPELINE_FORCE = [s.strip() for s in os.getenv("PIPELINE_FORCE", "").split(",") if s.strip()]
+QUALITY_SOURCE = os.getenv("QUALITY_SOURCE", "staging")
+# Las etapas de una misma ronda escriben el estado desde hilos distintos
+STATE_LOCK = threading.Lock()
+
+# DAG del pipeline: script, dependencias, código y variables de entorno que cambian su resultado
+STAGES = {
+    "schema": {
+        "script": "db/schema.py",
+        "deps": [],
+        "code": ["db/schema.py"],
+        "env": ["DB_", "LOAD_MODE", "KPI_ENGINE", "KPI_SHADOW", "FACT_"],
+    },
+    "ingest": {
+        "script": "ingestion/ingest.py",
+        "deps": [],
+        "code": ["ingestion/ingest.py", "ingestion/raw_format.py"],
+        "env": ["API_", "INGESTION_", "RAW_FORMAT"],
+    },
+    "staging": {
+        "script": "ingestion/staging.py",
+        "deps": ["ingest"],
+        "code": ["ingestion/staging.py", "ingestion/raw_format.py", "ingestion/staging_reader.py"],
+        "env": ["RAW_FORMAT"],
+    },
+    "load": {
+        "script": "db/load.py",
+        "deps": ["schema", "staging"],
+        "code": ["db/load.py", "db/kpis.py", "db/hll.py", "db/kpis_sql.py", "db/schema.py", "quality/totals.py"],
+        "env": ["DB_", "LOAD_", "KPI_", "FACT_", "INFILE_", "INGESTION_LOOKBACK_DAYS"],
+    },
+    "quality": {
+        "script": "quality/checks.py",
+        # Contra MySQL valida lo que dejó la carga; contra staging corre en paralelo con ella
+        "deps": ["load"] if QUALITY_SOURCE == "mysql" else ["staging"],
+        "code": ["quality/checks.py", "quality/totals.py"],
+        "env": ["DB_", "QUALITY_"],
+    },
+    "export": {
+        "script": "exports/export.py",
+        "deps": ["load"],
+        "code": ["exports/export.py"],
+        "env": ["DB_", "EXPORT_"],
+    },
+}
+
+
+def file_digest(paths: list) -> str:
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(str(path).encode())
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def raw_manifest() -> list:
+    # Páginas raw: nombre, tamaño y mtime (ingest solo escribe páginas nuevas o re-descargadas)
+    raw_dir = Path("data/raw")
+    files = sorted(p for p in raw_dir.rglob("*") if p.is_file()) if raw_dir.exists() else []
+    return [[str(p), p.stat().st_size, p.stat().st_mtime_ns] for p in files]
+
+
+def staging_digest() -> str:
+    # staging.py republica el dataset entero en cada corrida: se hashea el contenido, no el mtime.
+    # compact_partitions deja cada fecha con sus propios diccionarios, así que una fecha sin
+    # cambios conserva sus bytes (lo verifica benchmarks/bench_quality.py)
+    if not STAGING_DATASET.exists():
+        return None
+    return file_digest(sorted(p for p in STAGING_DATASET.rglob("*.parquet")))
+
+
+def table_state(tables: list, checksum: bool = False) -> dict:
+    """Filas (o CHECKSUM TABLE) por tabla; None si MySQL no responde o la tabla no existe."""
+    try:
+        conn = mysql.connector.connect(**DB_CONFIG)
+    except mysql.connector.Error:
+        return None
+    cursor = conn.cursor()
+    state = {}
+    for table in tables:
+        try:
+            if checksum:
+                cursor.execute(f"CHECKSUM TABLE {table}")
+                state[table] = cursor.fetchone()[1]
+            else:
+                cursor.execute(f"SELECT COUNT(*) FROM {table}")
+                state[table] = cursor.fetchone()[0]
+        except mysql.connector.Error:
+            state[table] = None
+    cursor.close()
+    conn.close()
+    return state
+
+
+def stage_inputs(name: str) -> dict:
+    """Datos de entrada de la etapa (además de su código y entorno)."""
+    if name == "schema":
+        # Solo importa qué tablas existen (una base nueva vuelve a correr schema), no su contenido
+        tables = table_state(list(TABLES))
+        return {"tables": None if tables is None else sorted(t for t, rows in tables.items() if rows is not None)}
+    if name == "ingest":
+        # La fuente es la API: no se puede comparar sin consultarla, así que se re-ingesta
+        # una vez por día (o con PIPELINE_FORCE=ingest)
+        return {"day": date.today().isoformat()}
+    if name == "staging":
+        return {"raw": raw_manifest()}
+    if name == "load":
+        # Incluye las tablas destino: si schema las recreó vacías, la carga se repite
+        return {"staging": staging_digest(), "tables": table_state(["fact_trips"] + KPI_TABLES)}
+    if name == "quality":
+        source = table_state(["fact_trips"]) if QUALITY_SOURCE == "mysql" else staging_digest()
+        return {"source": source, "report": Path("quality/report.json").exists()}
+    if name == "export":
+        outputs = [str(EXPORT_DIR / f"{table}.{fmt}") for table in QUERIES for fmt in EXPORT_FORMATS]
+        return {
+            "tables": table_state(list(QUERIES), checksum=True),
+            "outputs": [path for path in outputs if Path(path).exists()],
+        }
+    return {}
+
+
+def fingerprint(name: str) -> str:
+    stage = STAGES[name]
+    env = {k: v for k, v in sorted(os.environ.items()) if any(k.startswith(p) for p in stage["env"])}
+    inputs = stage_inputs(name)
+    # Sin MySQL no hay forma de saber si la etapa está al día: se corre
+    if None in inputs.values():
+        return None
+    payload = {"code": file_digest(stage["code"]), "env": env, "inputs": inputs}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_state() -> dict:
+    return json.loads(STATE_FILE.read_text()) if STATE_FILE.exists() else {}
+
+
+def save_state(state: dict):
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    STATE_FILE.write_text(json.dumps(state, indent=2))
+
+
+def run_stage(name: str, state: dict, capture: bool) -> tuple:
+    forced = "all" in PIPELINE_FORCE or name in PIPELINE_FORCE
+    if not forced and state.get(name) is not None and fingerprint(name) == state[name]:
+        return name, "skipped", 0.0, ""
+
+    # Se olvida la huella antes de correr: si la etapa falla (o se corta) a medio escribir sus
+    # salidas, la próxima corrida la repite en vez de darla por al día
+    with STATE_LOCK:
+        state.pop(name, None)
+        save_state(state)
+
+    t0 = time.perf_counter()
+    # Etapas en paralelo: la salida se junta y se imprime al terminar, sin intercalarse
+    result = subprocess.run(
+        [sys.executable, STAGES[name]["script"]], cwd=ROOT,
+        capture_output=capture, text=True,
+    )
+    elapsed = time.perf_counter() - t0
+    output = (result.stdout or "") + (result.stderr or "")
+    if result.returncode != 0:
+        return name, "failed", elapsed, output
+    # Huella tomada después de correr: incluye lo que la etapa dejó en sus propias tablas/archivos
+    current = fingerprint(name)
+    with STATE_LOCK:
+        state[name] = current
+    return name, "ran", elapsed, output
+
+
+def main():
+    print("=" * 60)
+    print("WindyCity Cabs — Pipeline")
+    print("=" * 60)
+    start = datetime.now()
+
+    state = load_state()
+    done, results = set(), {}
+    pending = list(STAGES)
+    while pending:
+        ready = [name for name in pending if all(dep in done for dep in STAGES[name]["deps"])]
+        print(f"\n▶️  {' + '.join(ready)}")
+        with ThreadPoolExecutor(max_workers=len(ready)) as pool:
+            outcomes = list(pool.map(lambda name: run_stage(name, state, len(ready) > 1), ready))
+        save_state(state)
+
+        for name, status, elapsed, output in outcomes:
+            if output and len(ready) > 1:
+                print(f"\n── {name} " + "─" * 40)
+                print(output.rstrip())
+            results[name] = (status, elapsed)
+            pending.remove(name)
+            done.add(name)
+        failed = [name for name, status, *_ in outcomes if status == "failed"]
+        if failed:
+            print(f"\n❌ Falló: {', '.join(failed)} — se detiene el pipeline")
+            break
+
+    print(f"\n{'=' * 60}")
+    icons = {"ran": "✅", "skipped": "⏭️ ", "failed": "❌"}
+    for name, (status, elapsed) in results.items():
+        print(f"  {icons[status]} {name:<8} {status:<8} {elapsed:7.1f}s")
+    print(f"Tiempo total: {(datetime.now() - start).seconds}s")
+    print("=" * 60)
+    if any(status == "failed" for status, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,375 @@
 import os
+import sys
 import json
+import shutil
+import hashlib
+from functools import reduce
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime
 
+import mysql.connector
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from db.kpis_sql import date_range
+from db.schema import DB_CONFIG, FACT_LAYOUT
+from ingestion.staging import contains, hash_trip_ids, merge_sorted
+from ingestion.staging_reader import STAGING_DATASET, iter_partition_batches, iter_staging_batches
+from quality import totals
+
 load_dotenv()
 
-STAGING_FILE = Path("data/staging/trips.parquet")
 REPORT_DIR = Path("quality")
 REPORT_FILE = REPORT_DIR / "report.json"
 
+# staging: Parquet local | mysql: un único SELECT agregado sobre fact_trips
+QUALITY_SOURCE = os.getenv("QUALITY_SOURCE", "staging")
+# Rango opcional de fechas (YYYY-MM-DD) para QUALITY_SOURCE=mysql y el modo full sobre staging.
+# El modo incremental lo rechaza: sus resultados cubren siempre todas las particiones
+QUALITY_DATE_FROM = os.getenv("QUALITY_DATE_FROM")
+QUALITY_DATE_TO = os.getenv("QUALITY_DATE_TO")
+# full: valida todo el staging | incremental: solo las particiones nuevas o reescritas
+QUALITY_MODE = os.getenv("QUALITY_MODE", "full")
+# Resultados por partición (trip_date) y hashes de trip_id ya validados
+STATE_DIR = REPORT_DIR / "state"
+RESULTS_FILE = STATE_DIR / "results.json"
+KEYS_DIR = STATE_DIR / "keys"
+# Histograma de diferencias de totales de cada partición (quality/totals.py)
+DIFFS_DIR = STATE_DIR / "total_diffs"
+# Hashes de todas las particiones, ordenados, con una aparición por partición
+KEY_INDEX_FILE = STATE_DIR / "trip_id_index.npy"
+
+
+# Lote de filas por paso del escaneo: la memoria queda acotada a un lote + los acumuladores
+QUALITY_BATCH_ROWS = int(os.getenv("QUALITY_BATCH_ROWS", 250_000))
+
+CRITICAL_FIELDS = ["trip_id", "trip_start_timestamp", "fare"]
+NON_NEGATIVE_FIELDS = ["fare", "tips", "tolls", "extras", "trip_total", "trip_miles", "trip_seconds"]
+TOTAL_TOLERANCE = totals.TOLERANCE_CENTS / 100
+
+# Predicados por fila: nombre -> (columnas, máscara sobre un lote, condición SQL sobre
+# fact_trips). Cada uno se evalúa una sola vez por lote y se acumula como conteo, aunque lo
+# usen varios checks. Un NULL no cumple ningún predicado, igual que NaN en pandas
+PREDICATES = {
+    **{
+        f"null_{field}": ([field], lambda df, field=field: df[field].isna(), f"{field} IS NULL")
+        for field in CRITICAL_FIELDS
+    },
+    **{
+        f"negative_{field}": ([field], lambda df, field=field: df[field] < 0, f"{field} < 0")
+        for field in NON_NEGATIVE_FIELDS
+    },
+    "end_before_start": (
+        ["trip_start_timestamp", "trip_end_timestamp"],
+        lambda df: df["trip_end_timestamp"] < df["trip_start_timestamp"],
+        "trip_end_timestamp < trip_start_timestamp",
+    ),
+    "is_outlier": (["is_outlier"], lambda df: df["is_outlier"] == 1, "is_outlier = 1"),
+    "trip_seconds_gt_3h": (["trip_seconds"], lambda df: df["trip_seconds"] > 10_800, "trip_seconds > 10800"),
+    "trip_miles_gt_100": (["trip_miles"], lambda df: df["trip_miles"] > 100, "trip_miles > 100"),
+    "total_inconsistent": (
+        ["fare", "tips", "tolls", "extras", "trip_total"],
+        # Misma diferencia en centavos enteros que el histograma: en dólares float el borde de
+        # $0.10 depende del redondeo. En MySQL los montos son DECIMAL(10,2), exactos
+        lambda df: np.abs(totals.diff_cents(df)) > totals.TOLERANCE_CENTS,
+        f"ABS(trip_total - (fare + tips + tolls + extras)) * 100 > {totals.TOLERANCE_CENTS}",
+    ),
+}
+
+
+def min_skipna(a, b):
+    return b if pd.isna(a) else a if pd.isna(b) else min(a, b)
+
+
+def max_skipna(a, b):
+    return b if pd.isna(a) else a if pd.isna(b) else max(a, b)
+
+
+def trip_id_hashes(trip_ids: pd.Series) -> list:
+    # Mismo hash de 64 bits que la deduplicación de staging, ordenado y sin repetidos
+    return [np.unique(hash_trip_ids(trip_ids.dropna()))]
+
+
+def merge_runs(runs: list, other: list) -> list:
+    """Corridas ordenadas de hashes; se fusionan cuando las dos últimas tienen tamaño parecido.
+
+    Cada hash se re-fusiona O(log n) veces, en vez de una vez por lote con un único arreglo.
+    """
+    runs = runs + other
+    while len(runs) > 1 and len(runs[-2]) <= 2 * len(runs[-1]):
+        runs = runs[:-2] + [np.union1d(runs[-2], runs[-1])]
+    return runs
+
+
+def unique_keys(runs: list) -> np.ndarray:
+    return reduce(np.union1d, runs, np.array([], dtype=np.uint64))
+
+
+# Acumuladores que no son conteos: nombre -> (columnas, valor parcial de un lote, merge, vacío)
+AGGREGATES = {
+    "start_min": (["trip_start_timestamp"], lambda df: df["trip_start_timestamp"].min(), min_skipna, pd.NaT),
+    "start_max": (["trip_start_timestamp"], lambda df: df["trip_start_timestamp"].max(), max_skipna, pd.NaT),
+    "trip_id_hashes": (["trip_id"], lambda df: trip_id_hashes(df["trip_id"]), merge_runs, []),
+    "total_diffs": (totals.COLUMNS, lambda df: [totals.diff_histogram(df)], totals.merge_histograms, []),
+}
+
+
+def empty_accumulators() -> dict:
+    return {
+        "rows": 0,
+        "counts": {name: 0 for name in PREDICATES},
+        **{name: empty for name, (_, _, _, empty) in AGGREGATES.items()},
+    }
+
+
+def partial(df: pd.DataFrame) -> dict:
+    """Acumuladores de un lote."""
+    return {
+        "rows": len(df),
+        "counts": {name: int(mask(df).sum()) for name, (_, mask, _) in PREDICATES.items()},
+        **{name: value(df) for name, (_, value, _, _) in AGGREGATES.items()},
+    }
+
+
+def merge(acc: dict, other: dict) -> dict:
+    """Combina dos acumuladores: conteos se suman, el resto con su merge declarado."""
+    return {
+        "rows": acc["rows"] + other["rows"],
+        "counts": {name: acc["counts"][name] + other["counts"][name] for name in PREDICATES},
+        **{name: combine(acc[name], other[name]) for name, (_, _, combine, _) in AGGREGATES.items()},
+    }
+
+
+def needed_columns() -> list:
+    columns = [col for cols, *_ in PREDICATES.values() for col in cols]
+    columns += [col for cols, *_ in AGGREGATES.values() for col in cols]
+    return list(dict.fromkeys(columns))
+
+
+def scan(batches) -> dict:
+    """Una sola pasada: cada lote se reduce a sus acumuladores y se descarta."""
+    acc = empty_accumulators()
+    for df in batches:
+        acc = merge(acc, partial(df))
+    return acc
+
 
-def load_staging() -> pd.DataFrame:
-    if not STAGING_FILE.exists():
-        raise FileNotFoundError(f"No se encontró {STAGING_FILE}. Ejecuta staging.py primero.")
-    df = pd.read_parquet(STAGING_FILE)
-    print(f"📂 Staging cargado: {len(df):,} registros")
-    return df
+def scan_staging(start_date=None, end_date=None) -> dict:
+    batches = iter_staging_batches(start_date, end_date, columns=needed_columns(), batch_size=QUALITY_BATCH_ROWS)
+    acc = scan(batches)
+    acc["unique_trip_ids"] = len(unique_keys(acc["trip_id_hashes"]))
+    print(f"📂 Staging escaneado: {acc['rows']:,} registros")
+    return acc
 
 
-def check_nulls(df: pd.DataFrame) -> dict:
+def partition_fingerprint(partition: Path) -> str:
+    # staging.py republica el dataset entero en cada corrida, así que el mtime no sirve. Pero
+    # cada partición compactada es determinista (mismas filas, mismo orden, diccionarios propios):
+    # el hash del archivo comprimido detecta cambios sin decodificar nada
+    digest = hashlib.sha1()
+    for file in sorted(partition.glob("*.parquet")):
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def engine_fingerprint() -> str:
+    # Los predicados son lambdas: se versiona el código que los define (este módulo y totals.py).
+    # Un cambio en cualquier check invalida los resultados guardados de todas las particiones
+    digest = hashlib.sha1()
+    for module in (Path(__file__), Path(totals.__file__)):
+        digest.update(module.read_bytes())
+    return digest.hexdigest()
+
+
+def to_record(acc: dict, fingerprint: str) -> dict:
+    return {
+        "fingerprint": fingerprint,
+        "rows": acc["rows"],
+        "counts": acc["counts"],
+        "start_min": None if pd.isna(acc["start_min"]) else acc["start_min"].isoformat(),
+        "start_max": None if pd.isna(acc["start_max"]) else acc["start_max"].isoformat(),
+    }
+
+
+def from_record(record: dict, diffs: pd.DataFrame) -> dict:
+    return {
+        **empty_accumulators(),
+        "total_diffs": [diffs],
+        "rows": record["rows"],
+        "counts": {name: record["counts"].get(name, 0) for name in PREDICATES},
+        "start_min": pd.Timestamp(record["start_min"]) if record["start_min"] else pd.NaT,
+        "start_max": pd.Timestamp(record["start_max"]) if record["start_max"] else pd.NaT,
+    }
+
+
+def remove_keys(index: np.ndarray, partition: str) -> np.ndarray:
+    # Los hashes de una partición son únicos: searchsorted ubica una aparición de cada uno.
+    # Los que no están en el índice (corrida cortada antes de guardarlo) se ignoran
+    path = KEYS_DIR / f"{partition}.npy"
+    if not path.exists():
+        return index
+    old = np.load(path)
+    path.unlink()
+    positions = np.searchsorted(index, old)
+    found = contains(index, old)
+    return np.delete(index, positions[found])
+
+
+def distinct_count(index: np.ndarray) -> int:
+    return 1 + int(np.count_nonzero(np.diff(index))) if len(index) else 0
+
+
+def scan_incremental() -> dict:
+    """Valida solo particiones nuevas o cambiadas y combina con los resultados guardados."""
+    engine = engine_fingerprint()
+    state = json.loads(RESULTS_FILE.read_text()) if RESULTS_FILE.exists() else {}
+    if state.get("engine") != engine:
+        # Estado de otra versión de los checks (o de antes de versionarlo): se revalida todo
+        if state:
+            print("🔄 Los checks cambiaron desde la última corrida: se revalidan todas las particiones")
+        shutil.rmtree(STATE_DIR, ignore_errors=True)
+        state = {}
+    results = state.get("partitions", {})
+    index = np.load(KEY_INDEX_FILE) if KEY_INDEX_FILE.exists() else np.array([], dtype=np.uint64)
+    KEYS_DIR.mkdir(parents=True, exist_ok=True)
+    DIFFS_DIR.mkdir(parents=True, exist_ok=True)
+
+    partitions = {p.name.split("=", 1)[1]: p for p in STAGING_DATASET.glob("trip_date=*")}
+    for removed in sorted(results.keys() - partitions.keys()):
+        index = remove_keys(index, removed)
+        (DIFFS_DIR / f"{removed}.parquet").unlink(missing_ok=True)
+        del results[removed]
+
+    validated = 0
+    for name, partition in sorted(partitions.items()):
+        fingerprint = partition_fingerprint(partition)
+        if results.get(name, {}).get("fingerprint") == fingerprint:
+            continue
+        acc = scan(iter_partition_batches(partition, needed_columns(), QUALITY_BATCH_ROWS))
+        keys = unique_keys(acc["trip_id_hashes"])
+        index = merge_sorted(remove_keys(index, name), keys)
+        np.save(KEYS_DIR / f"{name}.npy", keys)
+        totals.combine_histograms(acc["total_diffs"]).to_parquet(DIFFS_DIR / f"{name}.parquet", index=False)
+        results[name] = to_record(acc, fingerprint)
+        validated += 1
+
+    # Si se corta antes de guardar results.json, la próxima corrida re-valida esas
+    # particiones y remove_keys saca del índice los hashes que alcanzaron a entrar
+    with open(KEY_INDEX_FILE.with_suffix(".tmp"), "wb") as f:
+        np.save(f, index)
+    os.replace(KEY_INDEX_FILE.with_suffix(".tmp"), KEY_INDEX_FILE)
+    RESULTS_FILE.write_text(json.dumps({"engine": engine, "partitions": results}, indent=2))
+
+    stored = (from_record(r, pd.read_parquet(DIFFS_DIR / f"{name}.parquet")) for name, r in results.items())
+    acc = reduce(merge, stored, empty_accumulators())
+    # Cada partición aporta sus hashes una vez: repetidos en el índice = trip_id en varias fechas
+    acc["unique_trip_ids"] = distinct_count(index)
+    print(f"📂 Staging: {validated} particiones validadas, {len(results) - validated} reutilizadas "
+          f"— {acc['rows']:,} registros")
+    return acc
+
+
+# Acumuladores en SQL: los hashes de trip_id se reemplazan por el conteo de distintos
+SQL_AGGREGATES = {
+    "start_min": "MIN(trip_start_timestamp)",
+    "start_max": "MAX(trip_start_timestamp)",
+    "unique_trip_ids": "COUNT(DISTINCT trip_id)",
+}
+
+
+def quality_sql(date_from: date = None, date_to: date = None) -> tuple:
+    """Todos los checks en un único SELECT sobre fact_trips: un SUM(CASE) por predicado."""
+    # En el layout partitioned el filtro va sobre la columna de partición para podar meses
+    conditions, params = date_range(date_from, date_to, "trip_date_key" if FACT_LAYOUT == "partitioned" else "trip_date")
+    sums = ",\n            ".join(
+        f"SUM(CASE WHEN {condition} THEN 1 ELSE 0 END) AS {name}" for name, (_, _, condition) in PREDICATES.items()
+    )
+    aggregates = ",\n            ".join(f"{sql} AS {name}" for name, sql in SQL_AGGREGATES.items())
+    query = f"""
+        SELECT
+            COUNT(*) AS total_rows,
+            {sums},
+            {aggregates}
+        FROM fact_trips
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+    """
+    return query, params
+
+
+def cross_date_sql(date_from: date = None, date_to: date = None) -> tuple:
+    """trip_id del rango que también están cargados con otra fecha (layout partitioned).
+
+    La PK (trip_date_key, trip_id_bin) solo impide repetidos dentro de una misma fecha: si la API
+    cambia la fecha de un viaje, INSERT IGNORE lo deja dos veces. La copia puede estar fuera del
+    rango, así que se busca en toda la tabla vía idx_fact_trip_id.
+    """
+    conditions, params = date_range(date_from, date_to, "f.trip_date_key")
+    query = f"""
+        SELECT COUNT(DISTINCT f.trip_id_bin) AS cross_date_trip_ids
+        FROM fact_trips f
+        WHERE EXISTS (
+            SELECT 1 FROM fact_trips g
+            WHERE g.trip_id_bin = f.trip_id_bin AND g.trip_date_key <> f.trip_date_key
+        )
+        {"AND " + " AND ".join(conditions) if conditions else ""}
+    """
+    return query, params
+
+
+def scan_mysql(date_from: date = None, date_to: date = None) -> dict:
+    query, params = quality_sql(date_from, date_to)
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(query, params)
+    row = cursor.fetchone()
+
+    cross_date = None
+    if FACT_LAYOUT == "partitioned":
+        cursor.execute(*cross_date_sql(date_from, date_to))
+        cross_date = int(cursor.fetchone()["cross_date_trip_ids"])
+
+    # El histograma de diferencias ya está agregado en total_diff_kpis (db/load.py)
+    conditions, diff_params = date_range(date_from, date_to)
+    cursor.execute(
+        f"SELECT {', '.join(totals.HISTOGRAM_COLUMNS)} FROM total_diff_kpis"
+        + (f" WHERE {' AND '.join(conditions)}" if conditions else ""),
+        diff_params,
+    )
+    diffs = pd.DataFrame(cursor.fetchall(), columns=totals.HISTOGRAM_COLUMNS)
+    cursor.close()
+    conn.close()
+
+    def timestamp(value):
+        return pd.NaT if value is None else pd.Timestamp(value)
+
+    # SUM sobre cero filas devuelve NULL y sobre enteros devuelve DECIMAL
+    acc = {
+        **empty_accumulators(),
+        "rows": int(row["total_rows"]),
+        "counts": {name: int(row[name] or 0) for name in PREDICATES},
+        "start_min": timestamp(row["start_min"]),
+        "start_max": timestamp(row["start_max"]),
+        "unique_trip_ids": int(row["unique_trip_ids"]),
+        "total_diffs": [totals.normalize(diffs)] if len(diffs) else [],
+    }
+    if cross_date is not None:
+        acc["cross_date_trip_ids"] = cross_date
+    print(f"🐬 fact_trips escaneada en MySQL: {acc['rows']:,} registros")
+    return acc
+
+
+def check_nulls(acc: dict) -> dict:
     """Campos clave no deben ser nulos."""
-    critical_fields = ["trip_id", "trip_start_timestamp", "fare"]
     results = {}
-    for field in critical_fields:
-        null_count = df[field].isna().sum()
+    for field in CRITICAL_FIELDS:
+        null_count = acc["counts"][f"null_{field}"]
         results[field] = {
-            "null_count": int(null_count),
+            "null_count": null_count,
             "passed": null_count == 0
         }
     passed = all(r["passed"] for r in results.values())
@@ -36,39 +377,42 @@ def check_nulls(df: pd.DataFrame) -> dict:
     return {"check": "nulls_in_critical_fields", "passed": passed, "detail": results}
 
 
-def check_non_negative(df: pd.DataFrame) -> dict:
+def check_non_negative(acc: dict) -> dict:
     """Montos y métricas no deben ser negativos."""
-    fields = ["fare", "tips", "tolls", "extras", "trip_total", "trip_miles", "trip_seconds"]
     results = {}
-    for field in fields:
-        neg_count = int((df[field] < 0).sum())
+    for field in NON_NEGATIVE_FIELDS:
+        neg_count = acc["counts"][f"negative_{field}"]
         results[field] = {"negative_count": neg_count, "passed": neg_count == 0}
     passed = all(r["passed"] for r in results.values())
     print(f"  {'✅' if passed else '❌'} Valores negativos: {results}")
     return {"check": "non_negative_values", "passed": passed, "detail": results}
 
 
-def check_uniqueness(df: pd.DataFrame) -> dict:
+def check_uniqueness(acc: dict) -> dict:
     """trip_id debe ser único."""
-    total = len(df)
-    unique = df["trip_id"].nunique()
+    total = acc["rows"]
+    unique = acc["unique_trip_ids"]
     duplicates = total - unique
-    passed = duplicates == 0
-    print(f"  {'✅' if passed else '❌'} Unicidad trip_id: {duplicates:,} duplicados de {total:,}")
-    return {
+    # Layout partitioned sobre MySQL: repetidos con otra fecha, aunque la copia quede fuera del rango
+    cross_date = acc.get("cross_date_trip_ids", 0)
+    passed = duplicates == 0 and cross_date == 0
+    print(f"  {'✅' if passed else '❌'} Unicidad trip_id: {duplicates:,} duplicados de {total:,}"
+          + (f", {cross_date:,} trip_id cargados con más de una fecha" if cross_date else ""))
+    result = {
         "check": "trip_id_uniqueness",
         "passed": passed,
         "total": total,
         "unique": unique,
         "duplicates": duplicates
     }
+    if "cross_date_trip_ids" in acc:
+        result["cross_date_trip_ids"] = cross_date
+    return result
 
 
-def check_temporal_coherence(df: pd.DataFrame) -> dict:
+def check_temporal_coherence(acc: dict) -> dict:
     """trip_end debe ser >= trip_start."""
-    incoherent = int(
-        (df["trip_end_timestamp"] < df["trip_start_timestamp"]).sum()
-    )
+    incoherent = acc["counts"]["end_before_start"]
     passed = incoherent == 0
     print(f"  {'✅' if passed else '⚠️ '} Coherencia temporal: {incoherent:,} viajes con end < start")
     return {
@@ -78,20 +422,12 @@ def check_temporal_coherence(df: pd.DataFrame) -> dict:
     }
 
 
-def check_outliers(df: pd.DataFrame) -> dict:
+def check_outliers(acc: dict) -> dict:
     """Resumen de outliers flagueados."""
-    total = len(df)
-    outlier_count = int(df["is_outlier"].sum())
+    total = acc["rows"]
+    outlier_count = acc["counts"]["is_outlier"]
     outlier_rate = round(outlier_count / total * 100, 4)
 
-    # Breakdown por regla
-    long_trips = int((df["trip_seconds"] > 10_800).sum())
-    long_distance = int((df["trip_miles"] > 100).sum())
-    negative_fare = int((df["fare"] < 0).sum())
-    time_incoherent = int(
-        (df["trip_end_timestamp"] < df["trip_start_timestamp"]).sum()
-    )
-
     passed = outlier_rate < 1.0  # Aceptable si < 1% de outliers
     print(f"  {'✅' if passed else '⚠️ '} Outliers: {outlier_count:,} ({outlier_rate}%) de {total:,}")
     return {
@@ -99,39 +435,52 @@ def check_outliers(df: pd.DataFrame) -> dict:
         "passed": passed,
         "outlier_count": outlier_count,
         "outlier_rate_pct": outlier_rate,
+        # Breakdown por regla: mismos conteos que usan los otros checks
         "breakdown": {
-            "trip_seconds_gt_3h": long_trips,
-            "trip_miles_gt_100": long_distance,
-            "negative_fare": negative_fare,
-            "end_before_start": time_incoherent
+            "trip_seconds_gt_3h": acc["counts"]["trip_seconds_gt_3h"],
+            "trip_miles_gt_100": acc["counts"]["trip_miles_gt_100"],
+            "negative_fare": acc["counts"]["negative_fare"],
+            "end_before_start": acc["counts"]["end_before_start"]
         }
     }
 
 
-def check_total_consistency(df: pd.DataFrame) -> dict:
+def check_total_consistency(acc: dict) -> dict:
     """trip_total debe ser aprox fare + tips + tolls + extras."""
-    calculated = df["fare"] + df["tips"] + df["tolls"] + df["extras"]
-    diff = (df["trip_total"] - calculated).abs()
-    inconsistent = int((diff > 0.10).sum())
+    inconsistent = acc["counts"]["total_inconsistent"]
     # Se acepta como advertencia, no como error bloqueante
     # trip_total incluye componentes no desglosados en el dataset (surcharges, etc.)
     passed = True  # informativo, no bloqueante
-    print(f"  ⚠️  Consistencia totales: {inconsistent:,} viajes con diferencia > $0.10 (ver nota)")
+    print(f"  ⚠️  Consistencia totales: {inconsistent:,} viajes con diferencia > ${TOTAL_TOLERANCE:.2f} (ver nota)")
+
+    # Histograma de diferencias: cuánto explica el surcharge de $0.50, en total y por tipo de pago
+    hist = totals.combine_histograms(acc["total_diffs"])
+    surcharge = totals.hypothesis(hist).iloc[0] if len(hist) else None
+    by_payment = totals.hypothesis(hist, by=["payment_type"]) if len(hist) else pd.DataFrame()
     return {
         "check": "total_consistency",
         "passed": passed,
         "inconsistent_count": inconsistent,
-        "tolerance": 0.10,
-        "note": "trip_total incluye componentes no desglosados en el dataset público (surcharges municipales variables)"
+        "tolerance": TOTAL_TOLERANCE,
+        "note": "trip_total incluye componentes no desglosados en el dataset público (surcharges municipales variables)",
+        "diff_histogram": {
+            "top_diffs_cents": {int(d): int(n) for d, n in totals.top_diffs(hist).items()},
+            "surcharge_cents": totals.SURCHARGE_CENTS,
+            "explained_by_surcharge": 0 if surcharge is None else int(surcharge["explained"]),
+            "by_payment_type": {
+                payment_type: {col: int(value) for col, value in row.items()}
+                for payment_type, row in by_payment.iterrows()
+            },
+        }
     }
 
 
-def check_date_range(df: pd.DataFrame) -> dict:
+def check_date_range(acc: dict) -> dict:
     """Verificar que los datos caen dentro de la ventana esperada."""
     expected_start = pd.Timestamp("2025-12-03")
     expected_end = pd.Timestamp("2026-01-31 23:59:59")
-    actual_min = df["trip_start_timestamp"].min()
-    actual_max = df["trip_start_timestamp"].max()
+    actual_min = acc["start_min"]
+    actual_max = acc["start_max"]
     passed = actual_min >= expected_start and actual_max <= expected_end
     print(f"  {'✅' if passed else '❌'} Rango de fechas: {actual_min.date()} → {actual_max.date()}")
     return {
@@ -144,23 +493,39 @@ def check_date_range(df: pd.DataFrame) -> dict:
     }
 
 
+# Orden del reporte
+CHECKS = [
+    check_nulls,
+    check_non_negative,
+    check_uniqueness,
+    check_temporal_coherence,
+    check_outliers,
+    check_total_consistency,
+    check_date_range,
+]
+
+
 def main():
     print("=" * 60)
     print("WindyCity Cabs — Quality Checks")
     print("=" * 60)
     start = datetime.now()
 
-    df = load_staging()
+    date_from = date.fromisoformat(QUALITY_DATE_FROM) if QUALITY_DATE_FROM else None
+    date_to = date.fromisoformat(QUALITY_DATE_TO) if QUALITY_DATE_TO else None
+    if QUALITY_SOURCE != "mysql" and QUALITY_MODE == "incremental" and (date_from or date_to):
+        raise ValueError("QUALITY_DATE_FROM/QUALITY_DATE_TO no aplican con QUALITY_MODE=incremental")
+    if QUALITY_SOURCE == "mysql":
+        acc = scan_mysql(date_from, date_to)
+    elif QUALITY_MODE == "incremental" and STAGING_DATASET.exists():
+        acc = scan_incremental()
+    else:
+        acc = scan_staging(date_from, date_to)
+        # Un escaneo completo invalida los resultados guardados
+        shutil.rmtree(STATE_DIR, ignore_errors=True)
     print()
 
-    results = []
-    results.append(check_nulls(df))
-    results.append(check_non_negative(df))
-    results.append(check_uniqueness(df))
-    results.append(check_temporal_coherence(df))
-    results.append(check_outliers(df))
-    results.append(check_total_consistency(df))
-    results.append(check_date_range(df))
+    results = [check(acc) for check in CHECKS]
 
     # Resumen
     total_checks = len(results)
@@ -181,7 +546,7 @@ def main():
     # Guardar reporte
     report = {
         "generated_at": datetime.now().isoformat(),
-        "total_records": len(df),
+        "total_records": acc["rows"],
         "summary": {
             "total_checks": total_checks,
             "passed": passed_checks,
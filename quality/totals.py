@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+from ingestion.staging_reader import iter_staging_batches
+
+# Analizador de trip_total vs fare + tips + tolls + extras. Todo se reduce a un histograma de
+# diferencias en centavos enteros por fecha, compañía y tipo de pago: se arma en una pasada por
+# lotes, se suma entre lotes/particiones y cualquier hipótesis (surcharge de $0.50, etc.) se
+# evalúa sobre el histograma sin volver a leer los viajes.
+
+KEYS = ["trip_date", "company", "payment_type"]
+MONEY_PARTS = ["fare", "tips", "tolls", "extras"]
+COLUMNS = KEYS + MONEY_PARTS + ["trip_total"]
+HISTOGRAM_COLUMNS = KEYS + ["diff_cents", "total_trips"]
+
+# Misma tolerancia que check_total_consistency ($0.10) y surcharge municipal investigado ($0.50)
+TOLERANCE_CENTS = 10
+SURCHARGE_CENTS = 50
+
+
+def to_cents(values: pd.Series) -> np.ndarray:
+    # Los montos de staging vienen de centavos enteros: el redondeo recupera el valor exacto
+    return np.rint(values.to_numpy(dtype="float64", na_value=np.nan) * 100)
+
+
+def diff_cents(df: pd.DataFrame) -> np.ndarray:
+    """trip_total - (fare + tips + tolls + extras) en centavos enteros (NaN si falta algún monto)."""
+    return to_cents(df["trip_total"]) - sum(to_cents(df[col]) for col in MONEY_PARTS)
+
+
+def empty_histogram() -> pd.DataFrame:
+    return pd.DataFrame({col: pd.Series(dtype="int64" if col in ("diff_cents", "total_trips") else object)
+                         for col in HISTOGRAM_COLUMNS})
+
+
+def diff_histogram(df: pd.DataFrame) -> pd.DataFrame:
+    """Viajes por (trip_date, company, payment_type, diff_cents) de un lote.
+
+    Viajes con algún monto nulo quedan fuera; company / payment_type nulos quedan como "".
+    """
+    diff = diff_cents(df)
+    valid = ~np.isnan(diff)
+    if not valid.any():
+        return empty_histogram()
+    # Igual que el cubo de db/kpis.py: cada clave se factoriza y la combinación es un entero
+    columns = {key: df[key][valid] for key in KEYS}
+    columns["diff_cents"] = diff[valid].astype(np.int64)
+    codes, labels = {}, {}
+    combined = np.zeros(int(valid.sum()), dtype=np.int64)
+    for key, values in columns.items():
+        codes[key], labels[key] = pd.factorize(values, use_na_sentinel=False)
+        combined = combined * len(labels[key]) + codes[key]
+    groups, counts = np.unique(combined, return_counts=True)
+
+    hist = {}
+    for key in reversed(list(columns)):
+        groups, code = np.divmod(groups, len(labels[key]))
+        hist[key] = np.asarray(labels[key].take(code), dtype=object)
+    hist["total_trips"] = counts
+    return normalize(pd.DataFrame(hist))
+
+
+def normalize(hist: pd.DataFrame) -> pd.DataFrame:
+    # Claves como string ("" para nulos) para que histogramas de lotes distintos se puedan sumar
+    for key in ["company", "payment_type"]:
+        hist[key] = hist[key].astype(object).fillna("")
+    hist["diff_cents"] = hist["diff_cents"].astype("int64")
+    hist["total_trips"] = hist["total_trips"].astype("int64")
+    return hist[HISTOGRAM_COLUMNS]
+
+
+def combine_histograms(parts: list) -> pd.DataFrame:
+    """Suma una lista de histogramas en uno solo."""
+    if not parts:
+        return empty_histogram()
+    if len(parts) == 1:
+        return parts[0]
+    merged = pd.concat(parts, ignore_index=True)
+    return merged.groupby(KEYS + ["diff_cents"], dropna=False)["total_trips"].sum().reset_index()
+
+
+def merge_histograms(parts: list, other: list) -> list:
+    # Mismo esquema que las corridas de hashes de quality/checks.py: se suman recién cuando las
+    # dos últimas partes tienen tamaño parecido, no con cada lote
+    parts = parts + other
+    while len(parts) > 1 and len(parts[-2]) <= 2 * len(parts[-1]):
+        parts = parts[:-2] + [combine_histograms(parts[-2:])]
+    return parts
+
+
+def staging_histogram(start_date=None, end_date=None) -> pd.DataFrame:
+    """Histograma del staging en una pasada por lotes, leyendo solo COLUMNS."""
+    parts = []
+    for batch in iter_staging_batches(start_date, end_date, columns=COLUMNS):
+        parts = merge_histograms(parts, [diff_histogram(batch)])
+    return combine_histograms(parts)
+
+
+def top_diffs(hist: pd.DataFrame, n: int = 10) -> pd.Series:
+    """Viajes por diferencia en centavos, las `n` más frecuentes."""
+    return hist.groupby("diff_cents")["total_trips"].sum().nlargest(n)
+
+
+def hypothesis(hist: pd.DataFrame, surcharge_cents: int = SURCHARGE_CENTS, by: list = None,
+               tolerance_cents: int = TOLERANCE_CENTS) -> pd.DataFrame:
+    """Evalúa "trip_total = suma de componentes + surcharge" sobre el histograma.
+
+    Por grupo (o en total si `by` es None): viajes, consistentes sin surcharge, explicados por
+    el surcharge, y viajes donde el surcharge sobra (diferencia menor a la esperada).
+    """
+    residual = hist["diff_cents"] - surcharge_cents
+    trips = hist["total_trips"]
+    frame = pd.DataFrame({
+        "total_trips": trips,
+        "consistent": trips.where(hist["diff_cents"].abs() <= tolerance_cents, 0),
+        "explained": trips.where(residual.abs() <= tolerance_cents, 0),
+        "over_surcharge": trips.where(residual < -tolerance_cents, 0),
+    })
+    if by is None:
+        return frame.sum().to_frame().T
+    return frame.groupby([hist[key] for key in by]).sum().sort_values("total_trips", ascending=False)